@@ -21,6 +21,7 @@ url_for = None
 connect = None
 applyledger = None
 initialize_user_economy = None
+grant_many = None
 spend_gold = None
 userlanguage = None
 currentaccount = None
@@ -1730,31 +1731,23 @@ def _abyss_build_leaderboard_rows(db) -> list[dict]:
 
 def _abyss_distribute_leaderboard_rewards(db, ordered: list[dict]) -> None:
     today = _abyss_legacy_now().date().isoformat()
+    done = {
+        (str(r[0]), str(r[1]), int(r[2]), int(r[3]))
+        for r in db.execute(
+            "SELECT reward_type, rank_code, position, user_id FROM abyss_legacy_leaderboard_rewards WHERE reward_date = ?",
+            (today,),
+        )
+    }
+    # (reward_type, rank_code, position, user_id, amount, ledger row)
+    pending = []
     # Global rewards: economy money.
     for idx, amount in enumerate(ABYSS_GLOBAL_REWARDS, start=1):
         if idx > len(ordered):
             break
-        row = ordered[idx - 1]
-        uid = int(row["user_id"])
-        exists = db.execute(
-            """
-            SELECT 1 FROM abyss_legacy_leaderboard_rewards
-            WHERE reward_date = ? AND reward_type = 'global_money' AND rank_code = '' AND position = ? AND user_id = ?
-            """,
-            (today, idx, uid),
-        ).fetchone()
-        if exists:
+        uid = int(ordered[idx - 1]["user_id"])
+        if ("global_money", "", idx, uid) in done:
             continue
-        initialize_user_economy(uid)
-        applyledger(uid, int(amount), "abyss_global_rank_reward", f"Abyss global rank #{idx} reward", f"abyss:global:{today}:{idx}:{uid}")
-        db.execute(
-            """
-            INSERT OR IGNORE INTO abyss_legacy_leaderboard_rewards
-            (reward_date, reward_type, rank_code, position, user_id, amount)
-            VALUES (?, 'global_money', '', ?, ?, ?)
-            """,
-            (today, idx, uid, int(amount)),
-        )
+        pending.append(("global_money", "", idx, uid, int(amount), (uid, int(amount), "abyss_global_rank_reward", f"Abyss global rank #{idx} reward", f"abyss:global:{today}:{idx}:{uid}")))
 
     # Rank-group rewards: economy gold rewards for top 2 in each rank.
     by_rank: dict[str, list[dict]] = {}
@@ -1764,27 +1757,24 @@ def _abyss_distribute_leaderboard_rewards(db, ordered: list[dict]) -> None:
         for idx, amount in enumerate(ABYSS_RANK_REWARDS, start=1):
             if idx > len(members):
                 break
-            row = members[idx - 1]
-            uid = int(row["user_id"])
-            exists = db.execute(
-                """
-                SELECT 1 FROM abyss_legacy_leaderboard_rewards
-                WHERE reward_date = ? AND reward_type = 'rank_gold' AND rank_code = ? AND position = ? AND user_id = ?
-                """,
-                (today, rank_code, idx, uid),
-            ).fetchone()
-            if exists:
+            uid = int(members[idx - 1]["user_id"])
+            if ("rank_gold", rank_code, idx, uid) in done:
                 continue
-            initialize_user_economy(uid)
-            applyledger(uid, int(amount), "abyss_rank_group_reward", f"Abyss {rank_code} rank #{idx} reward", f"abyss:rank:{today}:{rank_code}:{idx}:{uid}")
-            db.execute(
-                """
-                INSERT OR IGNORE INTO abyss_legacy_leaderboard_rewards
-                (reward_date, reward_type, rank_code, position, user_id, amount)
-                VALUES (?, 'rank_gold', ?, ?, ?, ?)
-                """,
-                (today, rank_code, idx, uid, int(amount)),
-            )
+            pending.append(("rank_gold", rank_code, idx, uid, int(amount), (uid, int(amount), "abyss_rank_group_reward", f"Abyss {rank_code} rank #{idx} reward", f"abyss:rank:{today}:{rank_code}:{idx}:{uid}")))
+
+    if not pending:
+        return
+    # One ledger transaction for every payout (and any missing signup grant);
+    # ledger references keep a retry after a crash from paying twice.
+    grant_many([p[5] for p in pending])
+    db.executemany(
+        """
+        INSERT OR IGNORE INTO abyss_legacy_leaderboard_rewards
+        (reward_date, reward_type, rank_code, position, user_id, amount)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [(today, p[0], p[1], p[2], p[3], p[4]) for p in pending],
+    )
 
 
 def _abyss_next_reward_at() -> datetime:
@@ -2320,6 +2310,7 @@ def register_abysslegacy_backend(
     connect_obj,
     applyledger_obj,
     initialize_user_economy_obj,
+    grant_many_obj,
     spend_gold_obj,
     userlanguage_obj,
     currentaccount_obj,
@@ -2329,7 +2320,7 @@ def register_abysslegacy_backend(
     accountbyid_obj,
     root_path=None,
 ):
-    global _registered, app, request, redirect, render_template, url_for, connect, applyledger, initialize_user_economy, spend_gold, userlanguage, currentaccount, texts, navcontext, viewfile, accountbyid, ROOT
+    global _registered, app, request, redirect, render_template, url_for, connect, applyledger, initialize_user_economy, grant_many, spend_gold, userlanguage, currentaccount, texts, navcontext, viewfile, accountbyid, ROOT
     app = app_obj
     request = request_obj
     redirect = redirect_obj
@@ -2338,6 +2329,7 @@ def register_abysslegacy_backend(
     connect = connect_obj
     applyledger = applyledger_obj
     initialize_user_economy = initialize_user_economy_obj
+    grant_many = grant_many_obj
     spend_gold = spend_gold_obj
     userlanguage = userlanguage_obj
     currentaccount = currentaccount_obj
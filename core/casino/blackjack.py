@@ -1,49 +1,120 @@
-import random
+import base64
 import secrets
-from threading import Lock
+from array import array
+
+from core.casino.rng import SEEDS
+from core.casino.state import StateTable
+from core.database import holdcasinoseed
 
 
 RANKS = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
 SUITS = ["H", "D", "C", "S"]
-RNG = random.SystemRandom()
+CARDS_PER_DECK = 52
+SHOE_DECKS = 6
+SHOE_PENETRATION = 0.75
 
 
 def _card_value(rank: str) -> int:
     if rank in {"J", "Q", "K"}:
         return 10
     if rank == "A":
-        return 11
+        return 1
     return int(rank)
 
 
-def hand_total_details(cards: list[dict]) -> tuple[int, bool]:
+# Card c (0..51) is RANKS[c % 13] of SUITS[c // 13]. Aces count 1 here and
+# are promoted to 11 by hand_total_details when that does not bust.
+CARD_POINTS = bytes(_card_value(RANKS[c % 13]) for c in range(CARDS_PER_DECK))
+CARD_ACE = bytes(1 if c % 13 == 0 else 0 for c in range(CARDS_PER_DECK))
+CARD_FACES = tuple(
+    {"rank": RANKS[c % 13], "suit": SUITS[c // 13], "code": f"{RANKS[c % 13]}{SUITS[c // 13]}"}
+    for c in range(CARDS_PER_DECK)
+)
+
+
+def card_faces(cards) -> list[dict]:
+    return [CARD_FACES[c] for c in cards]
+
+
+def hand_total_details(cards) -> tuple[int, bool]:
     total = 0
-    aces = 0
-    for card in cards:
-        rank = card["rank"]
-        if rank == "A":
-            aces += 1
-        total += _card_value(rank)
-    while total > 21 and aces > 0:
-        total -= 10
-        aces -= 1
-    soft = aces > 0
-    return total, soft
-
-
-def is_blackjack(cards: list[dict]) -> bool:
+    ace = 0
+    for c in cards:
+        total += CARD_POINTS[c]
+        ace |= CARD_ACE[c]
+    if ace and total <= 11:
+        return total + 10, True
+    return total, False
+
+
+def is_blackjack(cards) -> bool:
     if len(cards) != 2:
         return False
     total, _ = hand_total_details(cards)
     return total == 21
 
 
+def shuffled_shoe(rng, decks: int) -> array:
+    cards = array("B", range(CARDS_PER_DECK)) * max(1, int(decks))
+    rng.shuffle(cards)
+    return cards
+
+
+class Shoe:
+    def __init__(self, decks: int = SHOE_DECKS, penetration: float = SHOE_PENETRATION) -> None:
+        self.decks = max(1, int(decks))
+        self.penetration = min(1.0, max(0.1, float(penetration)))
+        self.cards = array("B")
+        self.position = 0
+        self.cut = 0
+        self.seed = {"seed_hash": "", "nonce": 0}
+
+    def shuffle(self) -> None:
+        rng, self.seed = SEEDS.round()
+        self.cards = shuffled_shoe(rng, self.decks)
+        self.position = 0
+        self.cut = int(len(self.cards) * self.penetration)
+
+    def needs_shuffle(self) -> bool:
+        return self.position >= self.cut
+
+    def remaining(self) -> int:
+        return len(self.cards) - self.position
+
+    def draw(self) -> int | None:
+        if self.position >= len(self.cards):
+            return None
+        card = self.cards[self.position]
+        self.position += 1
+        return card
+
+    def to_record(self) -> dict:
+        return {
+            "decks": self.decks,
+            "penetration": self.penetration,
+            "cards": base64.b64encode(self.cards.tobytes()).decode("ascii"),
+            "position": self.position,
+            "cut": self.cut,
+            "seed": dict(self.seed),
+        }
+
+    @classmethod
+    def from_record(cls, data: dict) -> "Shoe":
+        shoe = cls(decks=int(data.get("decks", SHOE_DECKS)), penetration=float(data.get("penetration", SHOE_PENETRATION)))
+        shoe.cards = array("B", base64.b64decode(str(data.get("cards", ""))))
+        shoe.position = int(data.get("position", 0))
+        shoe.cut = int(data.get("cut", 0))
+        seed = data.get("seed") or {}
+        shoe.seed = {"seed_hash": str(seed.get("seed_hash", "")), "nonce": int(seed.get("nonce", 0))}
+        return shoe
+
+
 class BlackjackGame:
-    def __init__(self, soft17_stand: bool = True) -> None:
+    def __init__(self, soft17_stand: bool = True, decks: int = SHOE_DECKS, penetration: float = SHOE_PENETRATION) -> None:
         self.soft17_stand = soft17_stand
-        self.deck: list[dict] = []
-        self.player_hand: list[dict] = []
-        self.dealer_hand: list[dict] = []
+        self.shoe = Shoe(decks=decks, penetration=penetration)
+        self.player_hand: list[int] = []
+        self.dealer_hand: list[int] = []
         self.phase = "idle"
         self.result = ""
         self.message = "ready"
@@ -52,15 +123,38 @@ class BlackjackGame:
         self.round_id = ""
         self.settled = False
 
-    def _new_deck(self) -> list[dict]:
-        cards = [{"rank": r, "suit": s, "code": f"{r}{s}"} for s in SUITS for r in RANKS]
-        RNG.shuffle(cards)
-        return cards
+    def to_record(self) -> dict:
+        return {
+            "soft17_stand": self.soft17_stand,
+            "shoe": self.shoe.to_record(),
+            "player_hand": list(self.player_hand),
+            "dealer_hand": list(self.dealer_hand),
+            "phase": self.phase,
+            "result": self.result,
+            "message": self.message,
+            "dealer_hole_hidden": self.dealer_hole_hidden,
+            "current_bet": self.current_bet,
+            "round_id": self.round_id,
+            "settled": self.settled,
+        }
 
-    def _draw(self) -> dict | None:
-        if not self.deck:
-            return None
-        return self.deck.pop()
+    @classmethod
+    def from_record(cls, data: dict) -> "BlackjackGame":
+        game = cls(soft17_stand=bool(data.get("soft17_stand", True)))
+        game.shoe = Shoe.from_record(data.get("shoe") or {})
+        game.player_hand = [int(c) for c in data.get("player_hand", [])]
+        game.dealer_hand = [int(c) for c in data.get("dealer_hand", [])]
+        game.phase = str(data.get("phase", "idle"))
+        game.result = str(data.get("result", ""))
+        game.message = str(data.get("message", "ready"))
+        game.dealer_hole_hidden = bool(data.get("dealer_hole_hidden", True))
+        game.current_bet = int(data.get("current_bet", 0))
+        game.round_id = str(data.get("round_id", ""))
+        game.settled = bool(data.get("settled"))
+        return game
+
+    def _draw(self) -> int | None:
+        return self.shoe.draw()
 
     def _public_dealer_hand(self) -> list[dict]:
         out = []
@@ -68,7 +162,7 @@ class BlackjackGame:
             if idx == 1 and self.dealer_hole_hidden:
                 out.append({"hidden": True})
             else:
-                out.append(card)
+                out.append(CARD_FACES[card])
         return out
 
     def _dealer_visible_total(self) -> str:
@@ -84,8 +178,10 @@ class BlackjackGame:
         player_total, _ = hand_total_details(self.player_hand)
         dealer_total, _ = hand_total_details(self.dealer_hand) if self.dealer_hand else (0, False)
         return {
-            "deck_count": len(self.deck),
-            "player_hand": self.player_hand,
+            "deck_count": self.shoe.remaining(),
+            "shoe_seed_hash": self.shoe.seed["seed_hash"],
+            "shoe_nonce": self.shoe.seed["nonce"],
+            "player_hand": card_faces(self.player_hand),
             "dealer_hand": self._public_dealer_hand(),
             "phase": self.phase,
             "result": self.result,
@@ -103,7 +199,8 @@ class BlackjackGame:
         if value <= 0:
             return False, {"error": "invalid_bet", "state": self._state()}
         self.current_bet = value
-        self.deck = self._new_deck()
+        if self.shoe.needs_shuffle():
+            self.shoe.shuffle()
         self.player_hand = []
         self.dealer_hand = []
         self.phase = "dealing"
@@ -117,7 +214,7 @@ class BlackjackGame:
         c2 = self._draw()
         c3 = self._draw()
         c4 = self._draw()
-        if not c1 or not c2 or not c3 or not c4:
+        if c1 is None or c2 is None or c3 is None or c4 is None:
             self.phase = "finished"
             self.result = "push"
             self.message = "deck exhausted"
@@ -159,7 +256,7 @@ class BlackjackGame:
         if self.phase != "player_turn":
             return False, {"error": "invalid_state", "state": self._state()}
         card = self._draw()
-        if not card:
+        if card is None:
             self.phase = "finished"
             self.result = "push"
             self.message = "deck exhausted"
@@ -189,7 +286,7 @@ class BlackjackGame:
             dealer_total, dealer_soft = hand_total_details(self.dealer_hand)
             if dealer_total < 17:
                 card = self._draw()
-                if not card:
+                if card is None:
                     self.phase = "finished"
                     self.result = "push"
                     self.message = "deck exhausted"
@@ -198,7 +295,7 @@ class BlackjackGame:
                 continue
             if dealer_total == 17 and dealer_soft and not self.soft17_stand:
                 card = self._draw()
-                if not card:
+                if card is None:
                     self.phase = "finished"
                     self.result = "push"
                     self.message = "deck exhausted"
@@ -230,34 +327,55 @@ class BlackjackGame:
         return self._state()
 
 
+def _encode_state(rec: dict) -> dict:
+    game = rec.get("game")
+    return {"game": game.to_record()} if game else {}
+
+
+def _decode_state(data: dict) -> dict:
+    game = data.get("game")
+    return {"game": BlackjackGame.from_record(game)} if game else {}
+
+
 class BlackjackManager:
     def __init__(self) -> None:
-        self._games: dict[int, BlackjackGame] = {}
-        self._lock = Lock()
-
-    def _get(self, user_id: int) -> BlackjackGame:
-        uid = int(user_id)
-        with self._lock:
-            game = self._games.get(uid)
-            if game is None:
-                game = BlackjackGame(soft17_stand=True)
-                self._games[uid] = game
-            return game
+        self._state = StateTable("blackjack", _encode_state, _decode_state)
+
+    def _game(self, rec: dict) -> BlackjackGame:
+        game = rec.get("game")
+        if game is None:
+            game = BlackjackGame(soft17_stand=True)
+            rec["game"] = game
+        return game
 
     def start_round(self, user_id: int, bet: int) -> tuple[bool, dict]:
-        return self._get(user_id).start_round(bet)
+        # The shoe keeps dealing from its seed across rounds, so a reshuffle
+        # moves this user's hold to the new seed before the shoe is stored.
+        with self._state.session(user_id) as rec:
+            game = self._game(rec)
+            before = game.shoe.seed["seed_hash"]
+            result = game.start_round(bet)
+            after = game.shoe.seed["seed_hash"]
+            if after != before:
+                holdcasinoseed(f"blackjack:{int(user_id)}", after)
+            return result
 
     def get_state(self, user_id: int) -> dict:
-        return self._get(user_id).get_state()
+        with self._state.session(user_id, readonly=True) as rec:
+            game = rec.get("game")
+            return game.get_state() if game else BlackjackGame(soft17_stand=True).get_state()
 
     def hit(self, user_id: int) -> tuple[bool, dict]:
-        return self._get(user_id).hit()
+        with self._state.session(user_id) as rec:
+            return self._game(rec).hit()
 
     def stand(self, user_id: int) -> tuple[bool, dict]:
-        return self._get(user_id).stand()
+        with self._state.session(user_id) as rec:
+            return self._game(rec).stand()
 
     def mark_settled(self, user_id: int) -> dict:
-        return self._get(user_id).mark_settled()
+        with self._state.session(user_id) as rec:
+            return self._game(rec).mark_settled()
 
 
 MANAGER = BlackjackManager()
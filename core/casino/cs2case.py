@@ -1,10 +1,17 @@
-﻿import random
+﻿import hashlib
+import json
 import secrets
 import time
-from threading import Lock
+
+from core.casino.rng import SEEDS
+from core.casino.state import StateTable
+from core.database import addcasehistory, casehistory, casetopwins
 
 CASE_HISTORY_LIMIT = 10
-RNG = random.SystemRandom()
+CASE_TOP_WINS = 10
+IDEMPOTENCY_LIMIT = 100
+SEQUENCE_LENGTH = 45
+SEQUENCE_WIN_SLOT = 35
 
 CASES = {
     "afet": {
@@ -57,11 +64,48 @@ CASES = {
 }
 
 
+# Item tables go to clients once as a versioned catalog; rounds, history and
+# top wins refer to items by their index in CASES[case_id]["items"]. The
+# version changes whenever any case or item changes, so clients holding an
+# old catalog can tell from the version they send back.
+CATALOG_BODY = json.dumps(
+    {"cases": {k: {"id": c["id"], "name": c["name"], "price": int(c["price"]), "items": c["items"]} for k, c in CASES.items()}},
+    ensure_ascii=False,
+    sort_keys=True,
+    separators=(",", ":"),
+)
+CATALOG_VERSION = hashlib.sha256(CATALOG_BODY.encode("utf-8")).hexdigest()[:16]
+CATALOG_JSON = ('{"version":' + json.dumps(CATALOG_VERSION) + "," + CATALOG_BODY[1:]).encode("utf-8")
+
+
+def _encode_state(rec: dict) -> dict:
+    return {"idem": rec.get("idem", {})}
+
+
+def _decode_state(data: dict) -> dict:
+    return {"idem": dict(data.get("idem") or {})}
+
+
+def _history_row(case_id: str, row) -> dict | None:
+    items = CASES.get(case_id, {}).get("items", [])
+    idx = int(row[2])
+    if not 0 <= idx < len(items):
+        return None
+    return {
+        "history_id": int(row[0]),
+        "round_id": row[1],
+        "case_id": case_id,
+        "item_index": idx,
+        "payout": int(row[3]),
+        "created_at": float(row[4]),
+        "seed_hash": row[5],
+        "nonce": int(row[6]),
+    }
+
+
 class CaseManager:
     def __init__(self) -> None:
-        self._lock = Lock()
-        self._history: dict[int, dict[str, list]] = {}
-        self._idem: dict[int, dict[str, dict]] = {}
+        self._state = StateTable("cs2case", _encode_state, _decode_state)
 
     def list_cases(self) -> list[dict]:
         return [{"id": c["id"], "name": c["name"], "price": int(c["price"])} for c in CASES.values()]
@@ -71,20 +115,33 @@ class CaseManager:
         if not case:
             return {}
         return {
+            "catalog_version": CATALOG_VERSION,
             "case": {"id": case["id"], "name": case["name"], "price": int(case["price"])},
             "items": case["items"],
         }
 
-    def _pick_item(self, case: dict) -> dict:
+    def price(self, case_id: str) -> int:
+        case = CASES.get(str(case_id or "").strip().lower())
+        return int(case["price"]) if case else 0
+
+    def _pick_index(self, case: dict, rng) -> int:
         items = case.get("items", [])
         total = sum(float(i["weight"]) for i in items)
-        target = RNG.random() * total
+        target = rng.random() * total
         upto = 0.0
-        for item in items:
+        for idx, item in enumerate(items):
             upto += float(item["weight"])
             if target <= upto:
-                return item
-        return items[0]
+                return idx
+        return 0
+
+    def draw(self, case: dict, rng) -> tuple[int, list[int]]:
+        # Draw order is part of the replay contract: the winner first, then
+        # the strip shown while the case spins.
+        winning_index = self._pick_index(case, rng)
+        sequence = [self._pick_index(case, rng) for _ in range(SEQUENCE_LENGTH)]
+        sequence[SEQUENCE_WIN_SLOT] = winning_index
+        return winning_index, sequence
 
     def open_case(self, user_id: int, case_id: str, idempotency_key: str, settle_round) -> tuple[bool, dict]:
         uid = int(user_id)
@@ -97,23 +154,22 @@ class CaseManager:
             return False, {"error": "invalid_case"}
 
         cache_key = f"{key}:{idem}"
-        with self._lock:
-            cache = self._idem.setdefault(uid, {})
+        with self._state.session(uid, readonly=True) as rec:
+            cache = rec.get("idem", {})
             if cache_key in cache:
                 cached = cache[cache_key]
                 out = dict(cached.get("data") or {})
                 out["idempotent_replay"] = True
                 return bool(cached.get("ok")), out
 
-        winning_item = self._pick_item(case)
+        rng, seed = SEEDS.round()
+        winning_index, sequence_index = self.draw(case, rng)
+        winning_item = case["items"][winning_index]
         rid = secrets.token_hex(10)
         case_price = int(case["price"])
         multiplier = float(winning_item.get("multiplier", 1.0))
         payout = max(0, int(round(case_price * multiplier)))
 
-        sequence = [self._pick_item(case) for _ in range(45)]
-        sequence[35] = winning_item
-
         ok, err = settle_round(uid, rid, case_price, payout)
 
         if not ok:
@@ -124,38 +180,38 @@ class CaseManager:
             round_data = {
                 "round_id": rid,
                 "case_id": key,
-                "item": winning_item,
+                "item_index": winning_index,
                 "multiplier": multiplier,
-                "sequence": sequence,
+                "sequence": sequence_index,
                 "payout": payout,
                 "created_at": time.time(),
+                "seed_hash": seed["seed_hash"],
+                "nonce": seed["nonce"],
             }
             outcome_data = {"state": round_data}
 
-        with self._lock:
-            if outcome_ok:
-                by_case = self._history.setdefault(uid, {})
-                case_rows = by_case.setdefault(key, [])
-                case_rows.insert(0, round_data)
-                del case_rows[CASE_HISTORY_LIMIT:]
-            self._idem.setdefault(uid, {})[cache_key] = {"ok": outcome_ok, "data": dict(outcome_data)}
+        # The round is settled, so its result is stored for replays before
+        # the history row; a failed history write must not let a retry of the
+        # same key open (and charge for) another case.
+        with self._state.session(uid) as rec:
+            cache = rec.setdefault("idem", {})
+            cache[cache_key] = {"ok": outcome_ok, "data": dict(outcome_data)}
+            for stale in list(cache)[:-IDEMPOTENCY_LIMIT]:
+                del cache[stale]
+        if outcome_ok:
+            addcasehistory(uid, key, rid, winning_index, payout, CASE_TOP_WINS, seed["seed_hash"], seed["nonce"])
 
         return outcome_ok, outcome_data
 
-    def history(self, user_id: int, case_id: str) -> list[dict]:
-        uid = int(user_id)
+    def history(self, user_id: int, case_id: str, limit: int = CASE_HISTORY_LIMIT, before_id: int = 0) -> list[dict]:
         key = str(case_id or "").strip().lower()
-        with self._lock:
-            return list(self._history.get(uid, {}).get(key, []))
+        rows = [_history_row(key, r) for r in casehistory(user_id, key, max(1, int(limit)), before_id)]
+        return [r for r in rows if r]
 
     def top_wins(self, user_id: int, case_id: str, limit: int = 3) -> list[dict]:
-        uid = int(user_id)
         key = str(case_id or "").strip().lower()
-        cap = max(1, int(limit))
-        with self._lock:
-            rows = list(self._history.get(uid, {}).get(key, []))
-        rows.sort(key=lambda r: int(r.get("payout", 0) or 0), reverse=True)
-        return rows[:cap]
+        rows = [_history_row(key, r) for r in casetopwins(user_id, key, max(1, min(int(limit), CASE_TOP_WINS)))]
+        return [r for r in rows if r]
 
 
 MANAGER = CaseManager()
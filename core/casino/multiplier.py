@@ -1,18 +1,20 @@
-import random
 import secrets
 import time
+from bisect import bisect_left
 from dataclasses import dataclass, field
-from decimal import Decimal, ROUND_HALF_UP
-from threading import Lock
 from typing import Callable
 
+from core.casino.rng import RNG, SEEDS
+from core.casino.state import StateTable
+
 
 MIN_BET = 10
 MAX_BET = 10000
 PICK_COUNT = 5
 HISTORY_LIMIT = 10
+IDEMPOTENCY_LIMIT = 100
+IN_PROGRESS_TIMEOUT_SECONDS = 60
 REVEAL_INTERVAL_MS = 350
-RNG = random.SystemRandom()
 
 # Assumptions from product prompt:
 # - 0.4x -> 30 weight
@@ -44,26 +46,47 @@ MULTIPLIER_WEIGHTS: list[tuple[str, float]] = [
 ALLOWED_MULTIPLIERS = {x[0] for x in MULTIPLIER_WEIGHTS}
 
 
-def _fmt_decimal(val: Decimal) -> str:
-    norm = val.normalize()
-    text = format(norm, "f")
-    return text.rstrip("0").rstrip(".") if "." in text else text
+def _parse_milli(text: str) -> int:
+    whole, _, frac = text.partition(".")
+    return int(whole or 0) * 1000 + int((frac + "000")[:3])
 
 
-def _compute_payout_int(bet_amount: int, total_multiplier: Decimal) -> int:
-    amount = (Decimal(int(bet_amount)) * total_multiplier).quantize(Decimal("1"), rounding=ROUND_HALF_UP)
-    return int(amount)
+def _fmt_milli(milli: int) -> str:
+    whole, frac = divmod(int(milli), 1000)
+    return f"{whole}.{frac:03d}".rstrip("0") if frac else str(whole)
 
 
-def _weighted_pick() -> Decimal:
-    total = float(sum(w for _, w in MULTIPLIER_WEIGHTS))
-    target = RNG.random() * total
+def _cumulative(weights: list[float]) -> list[float]:
+    out = []
     upto = 0.0
-    for value, weight in MULTIPLIER_WEIGHTS:
+    for weight in weights:
         upto += float(weight)
-        if target <= upto:
-            return Decimal(value)
-    return Decimal(MULTIPLIER_WEIGHTS[-1][0])
+        out.append(upto)
+    return out
+
+
+# Multipliers are integer thousandths end to end; the strings above are only
+# parsed once here. Cumulative weights are summed in table order so a draw
+# lands on the same entry as a linear scan would.
+MULTIPLIER_MILLI = [_parse_milli(m) for m, _ in MULTIPLIER_WEIGHTS]
+MULTIPLIER_LABELS = [_fmt_milli(m) for m in MULTIPLIER_MILLI]
+MULTIPLIER_CUMULATIVE = _cumulative([w for _, w in MULTIPLIER_WEIGHTS])
+MULTIPLIER_TOTAL_WEIGHT = float(sum(w for _, w in MULTIPLIER_WEIGHTS))
+
+
+def _compute_payout_int(bet_amount: int, total_milli: int) -> int:
+    # Half-up rounding to whole gold; both factors are non-negative.
+    return (int(bet_amount) * int(total_milli) + 500) // 1000
+
+
+def _weighted_pick(rng=None) -> int:
+    target = (rng or RNG).random() * MULTIPLIER_TOTAL_WEIGHT
+    idx = bisect_left(MULTIPLIER_CUMULATIVE, target)
+    return min(idx, len(MULTIPLIER_MILLI) - 1)
+
+
+def draw_picks(rng) -> list[int]:
+    return [_weighted_pick(rng) for _ in range(PICK_COUNT)]
 
 
 @dataclass
@@ -78,6 +101,8 @@ class MultiplierRound:
     status: str = "created"  # created/debited/revealed/credited/finished/failed
     error: str = ""
     idempotency_key: str = ""
+    seed_hash: str = ""
+    nonce: int = 0
 
     def to_dict(self) -> dict:
         return {
@@ -90,16 +115,62 @@ class MultiplierRound:
             "created_at": float(self.created_at),
             "status": self.status,
             "error": self.error,
+            "seed_hash": self.seed_hash,
+            "nonce": int(self.nonce),
         }
 
+    def to_record(self) -> dict:
+        data = self.to_dict()
+        data["idempotency_key"] = self.idempotency_key
+        return data
+
+    @classmethod
+    def from_record(cls, data: dict) -> "MultiplierRound":
+        return cls(
+            round_id=str(data.get("round_id", "")),
+            user_id=int(data.get("user_id", 0)),
+            bet_amount=int(data.get("bet_amount", 0)),
+            picks=[str(p) for p in data.get("picks", [])],
+            total_multiplier=str(data.get("total_multiplier", "0")),
+            payout_amount=int(data.get("payout_amount", 0)),
+            created_at=float(data.get("created_at", 0.0)),
+            status=str(data.get("status", "created")),
+            error=str(data.get("error", "")),
+            idempotency_key=str(data.get("idempotency_key", "")),
+            seed_hash=str(data.get("seed_hash", "")),
+            nonce=int(data.get("nonce", 0)),
+        )
+
+
+def _encode_state(rec: dict) -> dict:
+    cur = rec.get("current")
+    return {
+        "current": cur.to_record() if cur else None,
+        "history": [r.to_record() for r in rec.get("history", [])],
+        "in_progress": float(rec.get("in_progress", 0.0)),
+        "idem": rec.get("idem", {}),
+    }
+
+
+def _decode_state(data: dict) -> dict:
+    cur = data.get("current")
+    return {
+        "current": MultiplierRound.from_record(cur) if cur else None,
+        "history": [MultiplierRound.from_record(r) for r in data.get("history", [])],
+        "in_progress": float(data.get("in_progress", 0.0)),
+        "idem": dict(data.get("idem") or {}),
+    }
+
+
+def _in_progress(rec: dict) -> bool:
+    # A worker that died mid-round must not block the user forever.
+    started = float(rec.get("in_progress", 0.0))
+    return started > 0 and time.time() - started < IN_PROGRESS_TIMEOUT_SECONDS
+
 
 class MultiplierManager:
     def __init__(self) -> None:
-        self._lock = Lock()
-        self._current: dict[int, MultiplierRound] = {}
-        self._history: dict[int, list[MultiplierRound]] = {}
-        self._in_progress: set[int] = set()
-        self._idem: dict[int, dict[str, dict]] = {}
+        self._state = StateTable("multiplier", _encode_state, _decode_state)
 
     def constants(self) -> dict:
         return {
@@ -111,18 +182,16 @@ class MultiplierManager:
         }
 
     def state(self, user_id: int) -> dict:
-        uid = int(user_id)
-        with self._lock:
-            cur = self._current.get(uid)
+        with self._state.session(user_id, readonly=True) as rec:
+            cur = rec.get("current")
             return {
-                "in_progress": uid in self._in_progress,
+                "in_progress": _in_progress(rec),
                 "current_round": cur.to_dict() if cur else None,
             }
 
     def history(self, user_id: int, limit: int = HISTORY_LIMIT) -> list[dict]:
-        uid = int(user_id)
-        with self._lock:
-            rows = self._history.get(uid, [])
+        with self._state.session(user_id, readonly=True) as rec:
+            rows = rec.get("history", [])
             return [r.to_dict() for r in rows[: max(1, int(limit))]]
 
     def play(
@@ -142,20 +211,20 @@ class MultiplierManager:
         if bet > MAX_BET:
             return False, {"error": "max_bet"}
 
-        with self._lock:
-            cache = self._idem.setdefault(uid, {})
+        with self._state.session(uid) as rec:
+            cache = rec.setdefault("idem", {})
             if idem in cache:
                 cached = cache[idem]
                 out = dict(cached.get("data") or {})
                 out["idempotent_replay"] = True
                 return bool(cached.get("ok")), out
-            if uid in self._in_progress:
-                cur = self._current.get(uid)
+            if _in_progress(rec):
+                cur = rec.get("current")
                 return False, {
                     "error": "round_in_progress",
                     "state": {"in_progress": True, "current_round": cur.to_dict() if cur else None},
                 }
-            self._in_progress.add(uid)
+            rec["in_progress"] = time.time()
 
         rnd = MultiplierRound(
             round_id=secrets.token_hex(10),
@@ -168,11 +237,14 @@ class MultiplierManager:
         outcome_ok = False
         outcome_data: dict = {}
         try:
-            picks = [_weighted_pick() for _ in range(PICK_COUNT)]
-            total_multiplier = sum(picks, Decimal("0"))
-            payout_amount = _compute_payout_int(bet, total_multiplier)
-            rnd.picks = [_fmt_decimal(p) for p in picks]
-            rnd.total_multiplier = _fmt_decimal(total_multiplier)
+            rng, seed = SEEDS.round()
+            rnd.seed_hash = seed["seed_hash"]
+            rnd.nonce = seed["nonce"]
+            picks = draw_picks(rng)
+            total_milli = sum(MULTIPLIER_MILLI[i] for i in picks)
+            payout_amount = _compute_payout_int(bet, total_milli)
+            rnd.picks = [MULTIPLIER_LABELS[i] for i in picks]
+            rnd.total_multiplier = _fmt_milli(total_milli)
             rnd.payout_amount = int(payout_amount)
             rnd.status = "revealed"
 
@@ -189,14 +261,17 @@ class MultiplierManager:
             outcome_data = {"state": rnd.to_dict()}
             return outcome_ok, outcome_data
         finally:
-            with self._lock:
-                self._in_progress.discard(uid)
-                self._current[uid] = rnd
-                items = self._history.setdefault(uid, [])
+            with self._state.session(uid) as rec:
+                rec["in_progress"] = 0.0
+                rec["current"] = rnd
+                items = rec.setdefault("history", [])
                 items.insert(0, rnd)
                 del items[HISTORY_LIMIT:]
                 if rnd.status in {"finished", "failed"}:
-                    self._idem.setdefault(uid, {})[idem] = {"ok": outcome_ok, "data": dict(outcome_data)}
+                    cache = rec.setdefault("idem", {})
+                    cache[idem] = {"ok": outcome_ok, "data": dict(outcome_data)}
+                    for stale in list(cache)[:-IDEMPOTENCY_LIMIT]:
+                        del cache[stale]
 
 
 MANAGER = MultiplierManager()
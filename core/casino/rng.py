@@ -0,0 +1,177 @@
+import hashlib
+import hmac
+import os
+import random
+import threading
+import time
+from typing import Callable
+
+
+# Two generators back the casino:
+#   RNG    - a CSPRNG that reads os.urandom in POOL_BLOCK_BYTES blocks into a
+#            per-thread buffer, so a draw is a slice instead of a syscall.
+#   SEEDS  - hands out per-round generators derived from a committed server
+#            seed: draws are HMAC-SHA256(server_seed, "nonce:counter") blocks,
+#            so a round is replayed offline from (server_seed, nonce) once the
+#            seed is revealed, and the published seed_hash proves it was fixed
+#            before play.
+
+POOL_BLOCK_BYTES = 64 * 1024
+SEED_BYTES = 32
+SEED_ROTATE_ROUNDS = 100000
+SEED_MAX_AGE_SECONDS = 24 * 3600
+
+
+class BufferedRandom(random.Random):
+    def __init__(self, block: int = POOL_BLOCK_BYTES) -> None:
+        self._block = max(64, int(block))
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+        super().__init__()
+
+    def _reset(self) -> None:
+        self._local = threading.local()
+
+    def _take(self, n: int) -> bytes:
+        local = self._local
+        buf = getattr(local, "buf", b"")
+        pos = getattr(local, "pos", 0)
+        if pos + n > len(buf):
+            buf = os.urandom(max(self._block, n))
+            pos = 0
+            local.buf = buf
+        local.pos = pos + n
+        return buf[pos:pos + n]
+
+    def random(self) -> float:
+        return (int.from_bytes(self._take(7), "big") >> 3) * (1.0 / 9007199254740992.0)
+
+    def getrandbits(self, k: int) -> int:
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        if k == 0:
+            return 0
+        numbytes = (k + 7) // 8
+        return int.from_bytes(self._take(numbytes), "big") >> (numbytes * 8 - k)
+
+    def randbytes(self, n: int) -> bytes:
+        return self._take(int(n))
+
+    def seed(self, *args, **kwds) -> None:
+        return None
+
+    def _notimplemented(self, *args, **kwds):
+        raise NotImplementedError("entropy pool state is not available")
+
+    getstate = setstate = _notimplemented
+
+
+class SeededRandom(random.Random):
+    def __init__(self, server_seed: bytes, nonce: int) -> None:
+        self._key = bytes(server_seed)
+        self._nonce = int(nonce)
+        self._counter = 0
+        self._buf = b""
+        super().__init__()
+
+    def _take(self, n: int) -> bytes:
+        while len(self._buf) < n:
+            msg = f"{self._nonce}:{self._counter}".encode("ascii")
+            self._buf += hmac.new(self._key, msg, hashlib.sha256).digest()
+            self._counter += 1
+        out, self._buf = self._buf[:n], self._buf[n:]
+        return out
+
+    def random(self) -> float:
+        return (int.from_bytes(self._take(7), "big") >> 3) * (1.0 / 9007199254740992.0)
+
+    def getrandbits(self, k: int) -> int:
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        if k == 0:
+            return 0
+        numbytes = (k + 7) // 8
+        return int.from_bytes(self._take(numbytes), "big") >> (numbytes * 8 - k)
+
+    def seed(self, *args, **kwds) -> None:
+        return None
+
+
+def seed_hash(server_seed: bytes) -> str:
+    return hashlib.sha256(bytes(server_seed)).hexdigest()
+
+
+def verify_seed(server_seed_hex: str, expected_hash: str) -> bool:
+    try:
+        raw = bytes.fromhex(str(server_seed_hex))
+    except ValueError:
+        return False
+    return hmac.compare_digest(seed_hash(raw), str(expected_hash))
+
+
+class SeedManager:
+    def __init__(self, source: random.Random, rotate_rounds: int = SEED_ROTATE_ROUNDS, max_age: float = SEED_MAX_AGE_SECONDS) -> None:
+        self._source = source
+        self._rotate = max(1, int(rotate_rounds))
+        self._max_age = max(1.0, float(max_age))
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[str, bytes], None]] = []
+        self._retire_listeners: list[Callable[[str], None]] = []
+        self._seed = b""
+        self._hash = ""
+        self._nonce = 0
+        self._born = 0.0
+
+    def on_new_seed(self, listener: Callable[[str, bytes], None]) -> None:
+        # Listeners persist seeds so rounds can be revealed and replayed later.
+        with self._lock:
+            self._listeners.append(listener)
+            if self._seed:
+                listener(self._hash, self._seed)
+
+    def on_retire_seed(self, listener: Callable[[str], None]) -> None:
+        # Called with the hash of each seed this manager rotates away from.
+        with self._lock:
+            self._retire_listeners.append(listener)
+
+    def _rotate_locked(self) -> None:
+        previous = self._hash
+        self._seed = self._source.randbytes(SEED_BYTES)
+        self._hash = seed_hash(self._seed)
+        self._nonce = 0
+        self._born = time.monotonic()
+        for listener in self._listeners:
+            listener(self._hash, self._seed)
+        if previous:
+            for retire in self._retire_listeners:
+                retire(previous)
+
+    def rotate(self) -> str:
+        with self._lock:
+            self._rotate_locked()
+            return self._hash
+
+    def current_hash(self) -> str:
+        with self._lock:
+            if not self._seed:
+                self._rotate_locked()
+            return self._hash
+
+    def round(self) -> tuple[SeededRandom, dict]:
+        with self._lock:
+            if not self._seed or self._nonce >= self._rotate or time.monotonic() - self._born >= self._max_age:
+                self._rotate_locked()
+            nonce = self._nonce
+            self._nonce += 1
+            key = self._seed
+            digest = self._hash
+        return SeededRandom(key, nonce), {"seed_hash": digest, "nonce": nonce}
+
+
+def replay(server_seed_hex: str, nonce: int) -> SeededRandom:
+    return SeededRandom(bytes.fromhex(server_seed_hex), int(nonce))
+
+
+RNG = BufferedRandom()
+SEEDS = SeedManager(RNG)
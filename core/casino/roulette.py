@@ -1,9 +1,10 @@
 import secrets
 import time
 from dataclasses import dataclass, field
-from threading import Lock
 from typing import Any
-import random
+
+from core.casino.rng import SEEDS
+from core.casino.state import StateTable
 
 
 ROULETTE_VARIANT = "EU"
@@ -13,7 +14,6 @@ MIN_BET = 10
 MAX_BET = 10000
 MAX_TOTAL_BET_PER_ROUND = 20000
 CHIPS = [10, 50, 100, 500, 1000, 5000]
-RNG = random.SystemRandom()
 
 EU_WHEEL = [
     "0", "32", "15", "19", "4", "21", "2", "25", "17", "34", "6", "27", "13", "36", "11", "30", "8", "23", "10", "5",
@@ -24,12 +24,19 @@ US_WHEEL = [
     "27", "10", "25", "29", "12", "8", "19", "31", "18", "6", "21", "33", "16", "4", "23", "35", "14", "2",
 ]
 RED_NUMBERS = {"1", "3", "5", "7", "9", "12", "14", "16", "18", "19", "21", "23", "25", "27", "30", "32", "34", "36"}
+OUTSIDE_BETS = ("red", "black", "odd", "even", "low", "high", "dozen1", "dozen2", "dozen3", "col1", "col2", "col3")
+INSIDE_BETS = {"straight": 1, "split": 2, "street": 3, "corner": 4, "sixline": 6}
+POCKET_BITS = {**{str(n): n for n in range(37)}, "00": 37}
 
 
 def wheel_pockets() -> list[str]:
     return EU_WHEEL[:] if ROULETTE_VARIANT == "EU" else US_WHEEL[:]
 
 
+def draw_pocket(rng) -> str:
+    return rng.choice(wheel_pockets())
+
+
 def color_of(pocket: str) -> str:
     if pocket in {"0", "00"}:
         return "green"
@@ -97,31 +104,11 @@ def _is_valid_sixline(selection: list[str]) -> bool:
 
 
 def _selection_key(bet_type: str, selection: list[str]) -> str:
-    if bet_type in {"red", "black", "odd", "even", "low", "high", "dozen1", "dozen2", "dozen3", "col1", "col2", "col3"}:
+    if bet_type in OUTSIDE_BETS:
         return bet_type
     return f"{bet_type}:{','.join(sorted(selection))}"
 
 
-def _validate_bet(bet_type: str, selection: list[str], amount: int) -> tuple[bool, str]:
-    if amount < MIN_BET:
-        return False, "min_bet"
-    if amount > MAX_BET:
-        return False, "max_bet"
-    if bet_type == "straight" and _is_valid_straight(selection):
-        return True, ""
-    if bet_type == "split" and _is_valid_split(selection):
-        return True, ""
-    if bet_type == "street" and _is_valid_street(selection):
-        return True, ""
-    if bet_type == "corner" and _is_valid_corner(selection):
-        return True, ""
-    if bet_type == "sixline" and _is_valid_sixline(selection):
-        return True, ""
-    if bet_type in {"red", "black", "odd", "even", "low", "high", "dozen1", "dozen2", "dozen3", "col1", "col2", "col3"}:
-        return True, ""
-    return False, "invalid_selection"
-
-
 def _wins(bet_type: str, selection: list[str], pocket: str) -> bool:
     if bet_type == "straight":
         return pocket in selection
@@ -179,12 +166,109 @@ def _ratio(bet_type: str) -> int:
     }[bet_type]
 
 
+def _inside_selections(bet_type: str, pockets: list[str]) -> list[list[str]]:
+    if bet_type == "straight":
+        return [[p] for p in pockets]
+    if bet_type == "split":
+        return [[str(x), str(x + 3)] for x in range(1, 34)] + [[str(x), str(x + 1)] for x in range(1, 36) if x % 3]
+    if bet_type == "street":
+        return [[str(x + d) for d in range(3)] for x in range(1, 37, 3)]
+    if bet_type == "corner":
+        return [[str(x + d) for d in (0, 1, 3, 4)] for x in range(1, 33) if x % 3 in {1, 2}]
+    if bet_type == "sixline":
+        return [[str(x + d) for d in range(6)] for x in range(1, 32, 3)]
+    return []
+
+
+def _pocket_mask(bet_type: str, selection: list[str], pockets: list[str]) -> int:
+    mask = 0
+    for pocket in pockets:
+        if _wins(bet_type, selection, pocket):
+            mask |= 1 << POCKET_BITS[pocket]
+    return mask
+
+
+def build_resolution_table(pockets: list[str]) -> dict[str, tuple[int, int]]:
+    table = {}
+    for bet_type in INSIDE_BETS:
+        for selection in _inside_selections(bet_type, pockets):
+            table[_selection_key(bet_type, selection)] = (_ratio(bet_type), _pocket_mask(bet_type, selection, pockets))
+    for bet_type in OUTSIDE_BETS:
+        table[bet_type] = (_ratio(bet_type), _pocket_mask(bet_type, [], pockets))
+    return table
+
+
+def build_selection_index(pockets: list[str]) -> dict[tuple[str, frozenset], str]:
+    return {
+        (bet_type, frozenset(selection)): _selection_key(bet_type, selection)
+        for bet_type in INSIDE_BETS
+        for selection in _inside_selections(bet_type, pockets)
+    }
+
+
+# Every legal bet key -> (payout ratio, pocket bitmask); bit n is pocket n, bit 37 is "00".
+RESOLUTION_TABLES = {"EU": build_resolution_table(EU_WHEEL), "US": build_resolution_table(US_WHEEL)}
+SELECTION_INDEX = {"EU": build_selection_index(EU_WHEEL), "US": build_selection_index(US_WHEEL)}
+POCKET_TOKENS = {str(n): str(n) for n in range(37)}
+
+
+def resolution_table() -> dict[str, tuple[int, int]]:
+    return RESOLUTION_TABLES["EU" if ROULETTE_VARIANT == "EU" else "US"]
+
+
+def bet_key(bet_type: str, selection: list[str]) -> str:
+    if bet_type in OUTSIDE_BETS:
+        return bet_type
+    if len(selection) != INSIDE_BETS.get(bet_type, -1):
+        return ""
+    if not all(isinstance(s, (str, int)) for s in selection):
+        return ""
+    nums = frozenset(POCKET_TOKENS.get(str(s)) or _normalize_num(s) for s in selection)
+    return SELECTION_INDEX["EU" if ROULETTE_VARIANT == "EU" else "US"].get((bet_type, nums), "")
+
+
+def _validate_bet(bet_type: str, selection: list[str], amount: int) -> tuple[str, str]:
+    if amount < MIN_BET:
+        return "", "min_bet"
+    if amount > MAX_BET:
+        return "", "max_bet"
+    key = bet_key(bet_type, selection)
+    if key not in resolution_table():
+        return "", "invalid_selection"
+    return key, ""
+
+
+def bet_payout(key: str, amount: int, pocket: str) -> int:
+    entry = resolution_table().get(key)
+    if entry is None or not entry[1] >> POCKET_BITS.get(pocket, 38) & 1:
+        return 0
+    return amount * (entry[0] + 1)
+
+
+def settle_bets(bets: list[tuple[str, int]], pocket: str) -> int:
+    table = resolution_table()
+    bit = 1 << POCKET_BITS.get(pocket, 38)
+    total = 0
+    for key, amount in bets:
+        entry = table.get(key)
+        if entry is not None and entry[1] & bit:
+            total += amount * (entry[0] + 1)
+    return total
+
+
 @dataclass
 class Bet:
     bet_id: str
     bet_type: str
     selection: list[str]
     amount: int
+    key: str = ""
+
+
+def _bet_from_record(row: list) -> Bet:
+    selection = [str(s) for s in row[2]]
+    key = str(row[4]) if len(row) > 4 else bet_key(str(row[1]), selection)
+    return Bet(bet_id=str(row[0]), bet_type=str(row[1]), selection=selection, amount=int(row[3]), key=key)
 
 
 @dataclass
@@ -193,6 +277,8 @@ class RouletteRound:
     state: str = "betting_open"
     betting_open_until: float = 0.0
     result_pocket: str = ""
+    seed_hash: str = ""
+    nonce: int = 0
     bets: list[Bet] = field(default_factory=list)
     idempotency: set[str] = field(default_factory=set)
     stake_locked: bool = False
@@ -203,6 +289,39 @@ class RouletteRound:
     def total_bet(self) -> int:
         return sum(b.amount for b in self.bets)
 
+    def to_record(self) -> dict:
+        return {
+            "round_id": self.round_id,
+            "state": self.state,
+            "betting_open_until": self.betting_open_until,
+            "result_pocket": self.result_pocket,
+            "seed_hash": self.seed_hash,
+            "nonce": self.nonce,
+            "bets": [[b.bet_id, b.bet_type, b.selection, b.amount, b.key] for b in self.bets],
+            "idempotency": sorted(self.idempotency),
+            "stake_locked": self.stake_locked,
+            "settled": self.settled,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_record(cls, data: dict) -> "RouletteRound":
+        return cls(
+            round_id=str(data.get("round_id", "")),
+            state=str(data.get("state", "betting_open")),
+            betting_open_until=float(data.get("betting_open_until", 0.0)),
+            result_pocket=str(data.get("result_pocket", "")),
+            seed_hash=str(data.get("seed_hash", "")),
+            nonce=int(data.get("nonce", 0)),
+            bets=[_bet_from_record(b) for b in data.get("bets", [])],
+            idempotency=set(data.get("idempotency", [])),
+            stake_locked=bool(data.get("stake_locked")),
+            settled=bool(data.get("settled")),
+            created_at=float(data.get("created_at", 0.0)),
+            updated_at=float(data.get("updated_at", 0.0)),
+        )
+
     def to_dict(self) -> dict:
         return {
             "round_id": self.round_id,
@@ -210,6 +329,8 @@ class RouletteRound:
             "betting_open_until": self.betting_open_until,
             "result_pocket": self.result_pocket,
             "result_color": color_of(self.result_pocket) if self.result_pocket else "",
+            "seed_hash": self.seed_hash,
+            "nonce": self.nonce,
             "bets": [{"bet_id": b.bet_id, "bet_type": b.bet_type, "selection": b.selection, "amount": b.amount} for b in self.bets],
             "total_bet": self.total_bet(),
             "stake_locked": bool(self.stake_locked),
@@ -218,60 +339,67 @@ class RouletteRound:
         }
 
 
+def _encode_state(rec: dict) -> dict:
+    rnd = rec.get("round")
+    return {"round": rnd.to_record()} if rnd else {}
+
+
+def _decode_state(data: dict) -> dict:
+    rnd = data.get("round")
+    return {"round": RouletteRound.from_record(rnd)} if rnd else {}
+
+
 class RouletteManager:
     def __init__(self) -> None:
-        self._rounds: dict[int, RouletteRound] = {}
-        self._lock = Lock()
+        self._state = StateTable("roulette", _encode_state, _decode_state)
 
-    def _current(self, user_id: int) -> RouletteRound:
-        uid = int(user_id)
-        rnd = self._rounds.get(uid)
+    def _current(self, rec: dict) -> RouletteRound:
+        rnd = rec.get("round")
         now = time.time()
         if rnd is None or rnd.state in {"finished"}:
             rnd = RouletteRound(round_id=secrets.token_hex(10), betting_open_until=now + BETTING_TIMER_SECONDS)
-            self._rounds[uid] = rnd
+            rec["round"] = rnd
         elif rnd.state == "betting_open" and now >= rnd.betting_open_until:
             rnd.state = "betting_locked"
         return rnd
 
     def get_state(self, user_id: int) -> dict:
-        with self._lock:
-            return self._current(user_id).to_dict()
+        with self._state.session(user_id) as rec:
+            return self._current(rec).to_dict()
 
     def start_round(self, user_id: int) -> dict:
-        with self._lock:
+        with self._state.session(user_id) as rec:
             rnd = RouletteRound(round_id=secrets.token_hex(10), betting_open_until=time.time() + BETTING_TIMER_SECONDS)
-            self._rounds[int(user_id)] = rnd
+            rec["round"] = rnd
             return rnd.to_dict()
 
     def place_bet(self, user_id: int, bet_type: str, selection: list[str], amount: int, idempotency_key: str) -> tuple[bool, dict]:
-        with self._lock:
-            rnd = self._current(user_id)
+        with self._state.session(user_id) as rec:
+            rnd = self._current(rec)
             if rnd.state != "betting_open":
                 return False, {"error": "betting_closed", "state": rnd.to_dict()}
             if idempotency_key and idempotency_key in rnd.idempotency:
                 return True, {"state": rnd.to_dict()}
-            ok, err = _validate_bet(bet_type, selection, int(amount))
-            if not ok:
+            key, err = _validate_bet(bet_type, selection, int(amount))
+            if err:
                 return False, {"error": err, "state": rnd.to_dict()}
             total = rnd.total_bet() + int(amount)
             if total > MAX_TOTAL_BET_PER_ROUND:
                 return False, {"error": "max_total_bet", "state": rnd.to_dict()}
 
-            key = _selection_key(bet_type, selection)
-            same_spot = sum(b.amount for b in rnd.bets if _selection_key(b.bet_type, b.selection) == key)
+            same_spot = sum(b.amount for b in rnd.bets if b.key == key)
             if same_spot + int(amount) > MAX_BET:
                 return False, {"error": "max_bet", "state": rnd.to_dict()}
 
-            rnd.bets.append(Bet(bet_id=secrets.token_hex(8), bet_type=bet_type, selection=[str(s) for s in selection], amount=int(amount)))
+            rnd.bets.append(Bet(bet_id=secrets.token_hex(8), bet_type=bet_type, selection=key.partition(":")[2].split(",") if ":" in key else [], amount=int(amount), key=key))
             if idempotency_key:
                 rnd.idempotency.add(idempotency_key)
             rnd.updated_at = time.time()
             return True, {"state": rnd.to_dict()}
 
     def undo(self, user_id: int) -> tuple[bool, dict]:
-        with self._lock:
-            rnd = self._current(user_id)
+        with self._state.session(user_id) as rec:
+            rnd = self._current(rec)
             if rnd.state != "betting_open":
                 return False, {"error": "betting_closed", "state": rnd.to_dict()}
             if rnd.bets:
@@ -280,8 +408,8 @@ class RouletteManager:
             return True, {"state": rnd.to_dict()}
 
     def clear(self, user_id: int) -> tuple[bool, dict]:
-        with self._lock:
-            rnd = self._current(user_id)
+        with self._state.session(user_id) as rec:
+            rnd = self._current(rec)
             if rnd.state != "betting_open":
                 return False, {"error": "betting_closed", "state": rnd.to_dict()}
             rnd.bets = []
@@ -289,8 +417,8 @@ class RouletteManager:
             return True, {"state": rnd.to_dict()}
 
     def lock_bets(self, user_id: int, idempotency_key: str) -> tuple[bool, dict]:
-        with self._lock:
-            rnd = self._current(user_id)
+        with self._state.session(user_id) as rec:
+            rnd = self._current(rec)
             if rnd.state not in {"betting_open", "betting_locked"}:
                 return False, {"error": "invalid_state", "state": rnd.to_dict()}
             if idempotency_key and idempotency_key in rnd.idempotency:
@@ -304,8 +432,8 @@ class RouletteManager:
             return True, {"state": rnd.to_dict()}
 
     def spin(self, user_id: int, idempotency_key: str) -> tuple[bool, dict]:
-        with self._lock:
-            rnd = self._current(user_id)
+        with self._state.session(user_id) as rec:
+            rnd = self._current(rec)
             if rnd.state == "betting_open" and time.time() >= rnd.betting_open_until:
                 rnd.state = "betting_locked"
             if rnd.state != "betting_locked":
@@ -315,7 +443,10 @@ class RouletteManager:
             if idempotency_key and idempotency_key in rnd.idempotency and rnd.result_pocket:
                 return True, {"state": rnd.to_dict()}
             rnd.state = "spinning"
-            rnd.result_pocket = RNG.choice(wheel_pockets())
+            rng, seed = SEEDS.round()
+            rnd.result_pocket = draw_pocket(rng)
+            rnd.seed_hash = seed["seed_hash"]
+            rnd.nonce = seed["nonce"]
             rnd.state = "result_revealed"
             if idempotency_key:
                 rnd.idempotency.add(idempotency_key)
@@ -323,8 +454,8 @@ class RouletteManager:
             return True, {"state": rnd.to_dict()}
 
     def settle(self, user_id: int) -> tuple[bool, dict]:
-        with self._lock:
-            rnd = self._current(user_id)
+        with self._state.session(user_id) as rec:
+            rnd = self._current(rec)
             if rnd.state not in {"result_revealed", "settling"}:
                 return False, {"error": "invalid_state", "state": rnd.to_dict()}
             if not rnd.result_pocket:
@@ -334,10 +465,7 @@ class RouletteManager:
                 return True, {"state": rnd.to_dict(), "total_stake": total_stake, "total_payout": 0, "net_delta": 0}
             rnd.state = "settling"
             total_stake = rnd.total_bet()
-            total_payout = 0
-            for bet in rnd.bets:
-                if _wins(bet.bet_type, bet.selection, rnd.result_pocket):
-                    total_payout += bet.amount * (_ratio(bet.bet_type) + 1)
+            total_payout = settle_bets([(bet.key, bet.amount) for bet in rnd.bets], rnd.result_pocket)
             net_delta = total_payout - total_stake
             rnd.state = "finished"
             rnd.settled = True
@@ -358,8 +486,8 @@ class RouletteManager:
         }
 
     def mark_stake_locked(self, user_id: int) -> dict:
-        with self._lock:
-            rnd = self._current(user_id)
+        with self._state.session(user_id) as rec:
+            rnd = self._current(rec)
             rnd.stake_locked = True
             rnd.updated_at = time.time()
             return rnd.to_dict()
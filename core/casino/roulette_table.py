@@ -0,0 +1,227 @@
+import logging
+import secrets
+import threading
+import time
+from typing import Callable
+
+from core.casino.roulette import (
+    BETTING_TIMER_SECONDS,
+    MAX_BET,
+    MAX_TOTAL_BET_PER_ROUND,
+    RESULT_DISPLAY_SECONDS,
+    Bet,
+    _validate_bet,
+    color_of,
+    draw_pocket,
+    settle_bets,
+)
+from core.casino.rng import SEEDS
+
+
+# Public tables share one wheel: the scheduler thread opens betting, spins
+# once when the timer runs out and hands every player's bets to a single
+# settle callback. Table state lives in this process; readers block on the
+# table condition and wake whenever the version changes. Stakes are also kept
+# in roulette_table_stakes so a round lost with its process gets refunded.
+# Because each process spins its own wheel, tables are only started (and the
+# table endpoints only served) on deployments that run a single worker.
+
+log = logging.getLogger(__name__)
+
+TABLE_IDS = ("1",)
+TICK_SECONDS = 0.25
+TABLE_HISTORY = 20
+# A round lasts BETTING_TIMER_SECONDS + RESULT_DISPLAY_SECONDS; stakes older
+# than this belong to a table whose process is gone.
+STAKE_STALE_SECONDS = 3600
+
+Settler = Callable[[str, str, str, list[dict]], bool]
+
+
+class RouletteTable:
+    def __init__(self, table_id: str) -> None:
+        self.table_id = str(table_id)
+        self.version = 0
+        self.history: list[str] = []
+        self._cond = threading.Condition()
+        with self._cond:
+            self._open_round(time.time())
+
+    def _bump(self) -> None:
+        self.version += 1
+        self._cond.notify_all()
+
+    def _open_round(self, now: float) -> None:
+        self.round_id = secrets.token_hex(10)
+        self.phase = "betting_open"
+        self.betting_open_until = now + BETTING_TIMER_SECONDS
+        self.result_pocket = ""
+        self.seed = {"seed_hash": "", "nonce": 0}
+        self.result_until = 0.0
+        self.bets: dict[int, list[Bet]] = {}
+        self.idempotency: set[tuple[int, str]] = set()
+        self.payouts: dict[int, int] = {}
+        self.settled = False
+        self._bump()
+
+    def _check(self, user_id: int, bet_type: str, selection: list[str], amount: int) -> tuple[str, str]:
+        if self.phase != "betting_open" or time.time() >= self.betting_open_until:
+            return "", "betting_closed"
+        key, err = _validate_bet(bet_type, selection, int(amount))
+        if err:
+            return "", err
+        mine = self.bets.get(int(user_id), [])
+        if sum(b.amount for b in mine) + int(amount) > MAX_TOTAL_BET_PER_ROUND:
+            return "", "max_total_bet"
+        if sum(b.amount for b in mine if b.key == key) + int(amount) > MAX_BET:
+            return "", "max_bet"
+        return key, ""
+
+    def check_bet(self, user_id: int, bet_type: str, selection: list[str], amount: int) -> tuple[str, str, str]:
+        with self._cond:
+            key, err = self._check(user_id, bet_type, selection, amount)
+            return self.round_id, key, err
+
+    def place_bet(self, user_id: int, round_id: str, bet_type: str, selection: list[str], amount: int, idempotency_key: str) -> tuple[bool, dict]:
+        uid = int(user_id)
+        with self._cond:
+            if self.round_id != round_id:
+                return False, {"error": "betting_closed", "state": self.state(uid)}
+            if idempotency_key and (uid, idempotency_key) in self.idempotency:
+                return True, {"state": self.state(uid)}
+            key, err = self._check(uid, bet_type, selection, amount)
+            if err:
+                return False, {"error": err, "state": self.state(uid)}
+            selection = key.partition(":")[2].split(",") if ":" in key else []
+            self.bets.setdefault(uid, []).append(Bet(bet_id=secrets.token_hex(8), bet_type=bet_type, selection=selection, amount=int(amount), key=key))
+            if idempotency_key:
+                self.idempotency.add((uid, idempotency_key))
+            self._bump()
+            return True, {"state": self.state(uid)}
+
+    def _take(self, user_id: int, count: int) -> tuple[bool, dict]:
+        uid = int(user_id)
+        with self._cond:
+            if self.phase != "betting_open" or time.time() >= self.betting_open_until:
+                return False, {"error": "betting_closed", "state": self.state(uid)}
+            mine = self.bets.get(uid, [])
+            taken = mine[-count:] if count else list(mine)
+            del mine[len(mine) - len(taken):]
+            if taken:
+                self._bump()
+            return True, {"state": self.state(uid), "round_id": self.round_id, "refund": sum(b.amount for b in taken)}
+
+    def undo(self, user_id: int) -> tuple[bool, dict]:
+        return self._take(user_id, 1)
+
+    def clear(self, user_id: int) -> tuple[bool, dict]:
+        return self._take(user_id, 0)
+
+    def state(self, user_id: int = 0) -> dict:
+        mine = self.bets.get(int(user_id), [])
+        now = time.time()
+        return {
+            "table_id": self.table_id,
+            "round_id": self.round_id,
+            "version": self.version,
+            "state": self.phase,
+            "betting_open_until": self.betting_open_until,
+            "remaining_seconds": max(0, int(self.betting_open_until - now)) if self.phase == "betting_open" else 0,
+            "result_pocket": self.result_pocket,
+            "result_color": color_of(self.result_pocket) if self.result_pocket else "",
+            "seed_hash": self.seed["seed_hash"],
+            "nonce": self.seed["nonce"],
+            "history": list(self.history),
+            "players": sum(1 for bets in self.bets.values() if bets),
+            "table_total_bet": sum(b.amount for bets in self.bets.values() for b in bets),
+            "bets": [{"bet_id": b.bet_id, "bet_type": b.bet_type, "selection": b.selection, "amount": b.amount} for b in mine],
+            "total_bet": sum(b.amount for b in mine),
+            "settled": bool(self.settled),
+            "payout": int(self.payouts.get(int(user_id), 0)),
+        }
+
+    def snapshot(self, user_id: int = 0) -> dict:
+        with self._cond:
+            return self.state(user_id)
+
+    def wait(self, version: int, timeout: float) -> int:
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def tick(self, now: float, settle: Settler) -> None:
+        with self._cond:
+            if self.phase == "betting_open" and now >= self.betting_open_until:
+                self.phase = "result_revealed"
+                rng, self.seed = SEEDS.round()
+                self.result_pocket = draw_pocket(rng)
+                self.result_until = now + RESULT_DISPLAY_SECONDS
+                self.history = ([self.result_pocket] + self.history)[:TABLE_HISTORY]
+                self._bump()
+            if self.phase != "result_revealed":
+                return
+            if self.settled:
+                if now >= self.result_until:
+                    self._open_round(now)
+                return
+            round_id = self.round_id
+            pocket = self.result_pocket
+            rows = []
+            for uid, bets in self.bets.items():
+                if not bets:
+                    continue
+                stake = sum(b.amount for b in bets)
+                payout = settle_bets([(b.key, b.amount) for b in bets], pocket)
+                rows.append({"user_id": uid, "stake": stake, "payout": payout})
+
+        # Ledger writes happen outside the table lock; a failed batch is
+        # retried on the next tick and the round stays on its result.
+        if rows and not settle(self.table_id, round_id, pocket, rows):
+            return
+        with self._cond:
+            if self.round_id == round_id:
+                self.payouts = {r["user_id"]: r["payout"] for r in rows}
+                self.settled = True
+                self._bump()
+
+
+class TableScheduler:
+    def __init__(self, table_ids=TABLE_IDS) -> None:
+        self.tables = {str(tid): RouletteTable(tid) for tid in table_ids}
+        self._settle: Settler | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def running(self) -> bool:
+        return self._settle is not None
+
+    def get(self, table_id: str) -> RouletteTable | None:
+        if not self.running():
+            return None
+        return self.tables.get(str(table_id))
+
+    def tick(self, now: float | None = None) -> None:
+        if self._settle is None:
+            return
+        at = time.time() if now is None else now
+        for table in self.tables.values():
+            try:
+                table.tick(at, self._settle)
+            except Exception:
+                log.exception("roulette table %s tick failed", table.table_id)
+
+    def _loop(self) -> None:
+        while True:
+            self.tick()
+            time.sleep(TICK_SECONDS)
+
+    def start(self, settle: Settler) -> None:
+        with self._lock:
+            self._settle = settle
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name="roulette-tables", daemon=True)
+            self._thread.start()
+
+
+TABLES = TableScheduler()
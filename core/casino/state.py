@@ -0,0 +1,127 @@
+import json
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Callable, Iterator
+
+from core.database import connect
+
+
+# Locking model
+# -------------
+# Every manager operation runs inside StateTable.session(user_id), which holds
+# the stripe lock for (namespace, user_id) for the whole load/mutate/store
+# cycle. Users hashing to different stripes never wait on each other; one user
+# is always serialized, so a game object is never touched outside its lock.
+# Managers must not call back into the same table while a session is open, and
+# settlement callbacks (ledger writes) run between sessions, never inside one.
+# The sqlite backend additionally takes BEGIN IMMEDIATE on the state database,
+# which serializes writers across processes for the duration of one row write.
+
+STATE_DB = "casino/state"
+LOCK_STRIPES = 256
+
+Encoder = Callable[[dict], dict]
+Decoder = Callable[[dict], dict]
+
+
+def pack(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=True, separators=(",", ":")).encode("ascii")
+
+
+def unpack(raw: Any) -> dict:
+    if not raw:
+        return {}
+    try:
+        data = json.loads(bytes(raw).decode("ascii"))
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class LockStripes:
+    def __init__(self, count: int = LOCK_STRIPES) -> None:
+        self._locks = [Lock() for _ in range(max(1, int(count)))]
+
+    def __call__(self, namespace: str, user_id: int) -> Lock:
+        return self._locks[hash((namespace, int(user_id))) % len(self._locks)]
+
+
+class MemoryStateBackend:
+    # Records live as plain Python objects; codecs are never used.
+    def __init__(self, stripes: int = LOCK_STRIPES) -> None:
+        self._rows: dict[tuple[str, int], dict] = {}
+        self._locks = LockStripes(stripes)
+
+    @contextmanager
+    def session(self, namespace: str, user_id: int, encode: Encoder, decode: Decoder, readonly: bool = False) -> Iterator[dict]:
+        with self._locks(namespace, user_id):
+            yield self._rows.setdefault((namespace, int(user_id)), {})
+
+
+class SqliteStateBackend:
+    # One packed-JSON row per (namespace, user). Writers hold BEGIN IMMEDIATE
+    # on the state database for the load/mutate/store cycle of a single row, so
+    # several worker processes can share it and open rounds survive a restart.
+    def __init__(self, name: str = STATE_DB, stripes: int = LOCK_STRIPES) -> None:
+        self._name = name
+        self._locks = LockStripes(stripes)
+
+    @contextmanager
+    def session(self, namespace: str, user_id: int, encode: Encoder, decode: Decoder, readonly: bool = False) -> Iterator[dict]:
+        uid = int(user_id)
+        if readonly:
+            with connect(self._name) as db:
+                row = db.execute("SELECT payload FROM casino_state WHERE namespace = ? AND user_id = ?", (namespace, uid)).fetchone()
+            yield decode(unpack(row[0])) if row else {}
+            return
+        with self._locks(namespace, uid), connect(self._name) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT payload FROM casino_state WHERE namespace = ? AND user_id = ?", (namespace, uid)).fetchone()
+                rec = decode(unpack(row[0])) if row else {}
+                yield rec
+                db.execute(
+                    """
+                    INSERT INTO casino_state (namespace, user_id, payload, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(namespace, user_id) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at
+                    """,
+                    (namespace, uid, pack(encode(rec)), time.time()),
+                )
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+
+_BACKEND: MemoryStateBackend | SqliteStateBackend = MemoryStateBackend()
+
+
+def backend_from_name(name: str) -> MemoryStateBackend | SqliteStateBackend:
+    kind = str(name or "").strip().lower()
+    if kind == "sqlite":
+        return SqliteStateBackend()
+    if kind in {"", "memory"}:
+        return MemoryStateBackend()
+    raise ValueError(f"unknown casino state backend: {name}")
+
+
+def use_backend(backend: MemoryStateBackend | SqliteStateBackend) -> None:
+    global _BACKEND
+    _BACKEND = backend
+
+
+def current_backend() -> MemoryStateBackend | SqliteStateBackend:
+    return _BACKEND
+
+
+class StateTable:
+    def __init__(self, namespace: str, encode: Encoder, decode: Decoder, backend=None) -> None:
+        self.namespace = namespace
+        self._encode = encode
+        self._decode = decode
+        self._backend = backend
+
+    def session(self, user_id: int, readonly: bool = False):
+        backend = self._backend or _BACKEND
+        return backend.session(self.namespace, int(user_id), self._encode, self._decode, readonly=readonly)
@@ -10,4 +10,7 @@ def load():
         "debug": os.getenv("DEBUG", "false").lower() == "true",
         "baseurl": os.getenv("BASEURL", "http://fluxnet.hidenfree.com:24705"),
         "secret": os.getenv("SECRET", "devsecret"),
+        "casino_state": os.getenv("CASINO_STATE_BACKEND", "memory"),
+        "roulette_tables": os.getenv("ROULETTE_TABLES", "false").lower() == "true",
+        "casino_admins": [int(x) for x in os.getenv("CASINO_ADMINS", "").split(",") if x.strip().isdigit()],
     }
@@ -2,9 +2,14 @@ import json
 import secrets
 import sqlite3
 import string
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from random import Random
+from typing import Callable
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 
@@ -125,15 +130,74 @@ def setup() -> None:
             END;
             """
         )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, id, amount)")
+        # Closed months move to casino/ledger_YYYY_MM archives (see
+        # archiveledgermonth). Rows may only be deleted once their id range is
+        # a sealed partition, and references of archived rows stay reserved in
+        # ledger_archived_refs so retries cannot apply them twice.
         db.execute(
             """
-            CREATE TRIGGER IF NOT EXISTS trg_ledger_no_delete
+            CREATE TABLE IF NOT EXISTS ledger_partitions (
+                tbl TEXT NOT NULL,
+                month TEXT NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                rows INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                sealed INTEGER NOT NULL DEFAULT 0,
+                archived_at REAL,
+                PRIMARY KEY(tbl, month)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ledger_archived_refs (
+                user_id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                reference_id TEXT NOT NULL,
+                month TEXT NOT NULL,
+                PRIMARY KEY(user_id, type, reference_id)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS xp_archived_refs (
+                user_id INTEGER NOT NULL,
+                reference_id TEXT NOT NULL,
+                month TEXT NOT NULL,
+                PRIMARY KEY(user_id, reference_id)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute("DROP TRIGGER IF EXISTS trg_ledger_no_delete")
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_ledger_sealed_delete
             BEFORE DELETE ON ledger
+            WHEN NOT EXISTS (
+                SELECT 1 FROM ledger_partitions p
+                WHERE p.tbl = 'ledger' AND p.sealed = 1 AND OLD.id BETWEEN p.first_id AND p.last_id
+            )
             BEGIN
                 SELECT RAISE(ABORT, 'ledger is immutable');
             END;
             """
         )
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_ledger_archived_ref
+            BEFORE INSERT ON ledger
+            WHEN NEW.reference_id IS NOT NULL AND NEW.reference_id <> '' AND EXISTS (
+                SELECT 1 FROM ledger_archived_refs a
+                WHERE a.user_id = NEW.user_id AND a.type = NEW.type AND a.reference_id = NEW.reference_id
+            )
+            BEGIN
+                SELECT RAISE(ABORT, 'UNIQUE constraint failed: ledger archived reference');
+            END;
+            """
+        )
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS user_level (
@@ -164,6 +228,31 @@ def setup() -> None:
             WHERE reference_id IS NOT NULL AND reference_id <> ''
             """
         )
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_xp_ledger_sealed_delete
+            BEFORE DELETE ON xp_ledger
+            WHEN NOT EXISTS (
+                SELECT 1 FROM ledger_partitions p
+                WHERE p.tbl = 'xp_ledger' AND p.sealed = 1 AND OLD.id BETWEEN p.first_id AND p.last_id
+            )
+            BEGIN
+                SELECT RAISE(ABORT, 'xp ledger is immutable');
+            END;
+            """
+        )
+        db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_xp_ledger_archived_ref
+            BEFORE INSERT ON xp_ledger
+            WHEN NEW.reference_id IS NOT NULL AND NEW.reference_id <> '' AND EXISTS (
+                SELECT 1 FROM xp_archived_refs a WHERE a.user_id = NEW.user_id AND a.reference_id = NEW.reference_id
+            )
+            BEGIN
+                SELECT RAISE(ABORT, 'UNIQUE constraint failed: xp ledger archived reference');
+            END;
+            """
+        )
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS casino_games (
@@ -175,6 +264,63 @@ def setup() -> None:
             )
             """
         )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_casino_games_user ON casino_games(user_id, id)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_wallets_balance ON wallets(balance DESC, user_id)")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS casino_rollup (
+                grain TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                games INTEGER NOT NULL DEFAULT 0,
+                wins INTEGER NOT NULL DEFAULT 0,
+                losses INTEGER NOT NULL DEFAULT 0,
+                net INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY(grain, bucket, user_id)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_casino_rollup_user ON casino_rollup(user_id, grain, bucket)")
+        db.execute("DROP TABLE IF EXISTS casino_win_buckets")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS casino_leaderboard (
+                period TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                PRIMARY KEY(period, user_id)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_casino_leaderboard_rank ON casino_leaderboard(period, amount DESC)")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS casino_leaderboard_watermark (
+                period TEXT PRIMARY KEY,
+                bucket INTEGER NOT NULL
+            )
+            """
+        )
+        if not db.execute("SELECT 1 FROM casino_rollup LIMIT 1").fetchone():
+            _backfillrollup(db)
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS casino_user_metrics (
+                user_id INTEGER PRIMARY KEY,
+                wins_total INTEGER NOT NULL DEFAULT 0,
+                net_total INTEGER NOT NULL DEFAULT 0,
+                games_total INTEGER NOT NULL DEFAULT 0,
+                roulette_games INTEGER NOT NULL DEFAULT 0,
+                blackjack_games INTEGER NOT NULL DEFAULT 0,
+                multiplier_games INTEGER NOT NULL DEFAULT 0,
+                case_opened INTEGER NOT NULL DEFAULT 0,
+                max_single_win INTEGER NOT NULL DEFAULT 0,
+                profitable_games INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        if not db.execute("SELECT 1 FROM casino_user_metrics LIMIT 1").fetchone():
+            _rebuildcasinometrics(db)
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS casino_actions (
@@ -190,28 +336,110 @@ def setup() -> None:
             )
             """
         )
-    with connect("casino/rewards") as db:
         db.execute(
             """
-            CREATE TABLE IF NOT EXISTS user_daily_rewards (
+            CREATE TABLE IF NOT EXISTS case_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                case_id TEXT NOT NULL,
+                round_id TEXT NOT NULL,
+                item_index INTEGER NOT NULL,
+                payout INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        if not hascolumn(db, "case_history", "seed_hash"):
+            db.execute("ALTER TABLE case_history ADD COLUMN seed_hash TEXT NOT NULL DEFAULT ''")
+        if not hascolumn(db, "case_history", "nonce"):
+            db.execute("ALTER TABLE case_history ADD COLUMN nonce INTEGER NOT NULL DEFAULT 0")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_case_history_user ON case_history(user_id, case_id, id)")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS casino_seeds (
+                seed_hash TEXT PRIMARY KEY,
+                server_seed TEXT NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        if not hascolumn(db, "casino_seeds", "retired_at"):
+            db.execute("ALTER TABLE casino_seeds ADD COLUMN retired_at REAL")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS casino_seed_holds (
+                holder TEXT PRIMARY KEY,
+                seed_hash TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_casino_seed_holds_seed ON casino_seed_holds(seed_hash)")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS roulette_table_stakes (
+                table_id TEXT NOT NULL,
+                round_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                stake INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY(table_id, round_id, user_id)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_roulette_table_stakes_updated ON roulette_table_stakes(updated_at)")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS case_top_wins (
+                user_id INTEGER NOT NULL,
+                case_id TEXT NOT NULL,
+                history_id INTEGER NOT NULL,
+                payout INTEGER NOT NULL,
+                PRIMARY KEY(user_id, case_id, history_id)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_case_top_wins_rank ON case_top_wins(user_id, case_id, payout DESC, history_id DESC)")
+    with connect("casino/state") as db:
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS casino_state (
+                namespace TEXT NOT NULL,
                 user_id INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY(namespace, user_id)
+            ) WITHOUT ROWID
+            """
+        )
+    with connect("casino/player") as db:
+        # One row per user for the week being claimed; amounts are derived
+        # from (user, week) by _week_rewards and never stored.
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_reward_claims (
+                user_id INTEGER PRIMARY KEY,
                 week_start_date TEXT NOT NULL,
-                rewards_day1 INTEGER NOT NULL,
-                rewards_day2 INTEGER NOT NULL,
-                rewards_day3 INTEGER NOT NULL,
-                rewards_day4 INTEGER NOT NULL,
-                rewards_day5 INTEGER NOT NULL,
-                rewards_day6 INTEGER NOT NULL,
-                rewards_day7 INTEGER NOT NULL,
-                bonus_day7 INTEGER NOT NULL,
                 claimed_days INTEGER NOT NULL DEFAULT 0,
                 last_claim_date TEXT NOT NULL DEFAULT '',
-                streak_count INTEGER NOT NULL DEFAULT 0,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY(user_id, week_start_date)
+                streak_count INTEGER NOT NULL DEFAULT 0
             )
             """
         )
+        legacy = DBROOT / "casino" / "rewards.db"
+        if legacy.exists() and not db.execute("SELECT 1 FROM daily_reward_claims LIMIT 1").fetchone():
+            db.execute("ATTACH DATABASE ? AS rewards", (str(legacy),))
+            if db.execute("SELECT 1 FROM rewards.sqlite_master WHERE type = 'table' AND name = 'user_daily_rewards'").fetchone():
+                db.execute(
+                    """
+                    INSERT OR IGNORE INTO daily_reward_claims (user_id, week_start_date, claimed_days, last_claim_date, streak_count)
+                    SELECT r.user_id, r.week_start_date, r.claimed_days, r.last_claim_date, r.streak_count
+                    FROM rewards.user_daily_rewards r
+                    WHERE r.week_start_date = (SELECT MAX(week_start_date) FROM rewards.user_daily_rewards x WHERE x.user_id = r.user_id)
+                    """
+                )
+            db.commit()
+            db.execute("DETACH DATABASE rewards")
 
     with connect("casino/achievements") as db:
         db.execute(
@@ -281,6 +509,31 @@ def setup() -> None:
             )
             """
         )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_friendships_userb ON friendships(userb)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_requests_receiver ON requests(receiver, status)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_blocks_blocked ON blocks(blocked)")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS friend_suggestions (
+                userid INTEGER NOT NULL,
+                candidate INTEGER NOT NULL,
+                score INTEGER NOT NULL,
+                mutuals INTEGER NOT NULL DEFAULT 0,
+                servers INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (userid, candidate)
+            ) WITHOUT ROWID
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS suggestion_state (
+                userid INTEGER PRIMARY KEY,
+                marks INTEGER NOT NULL DEFAULT 0,
+                computedmarks INTEGER NOT NULL DEFAULT -1,
+                computedat REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
 
     with connect("dm") as db:
         db.execute(
@@ -483,6 +736,7 @@ def setup() -> None:
             )
             """
         )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_members_user ON members(userid, status)")
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS voicepresence (
@@ -515,6 +769,41 @@ def setup() -> None:
             db.execute("ALTER TABLE servers ADD COLUMN writeperms TEXT NOT NULL DEFAULT ''")
         if not hascolumn(db, "servers", "shareperms"):
             db.execute("ALTER TABLE servers ADD COLUMN shareperms TEXT NOT NULL DEFAULT ''")
+        if not hascolumn(db, "roles", "slot"):
+            db.execute("ALTER TABLE roles ADD COLUMN slot INTEGER")
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_roles_slot ON roles(serverid, slot)")
+        for table in ("servers", "channels"):
+            for col in ACL_MASKS:
+                if not hascolumn(db, table, col):
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {col} BLOB")
+        _migrateacls(db)
+        _serverdirectorysetup(db)
+
+    with connect("search") as db:
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_docs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                scopeid INTEGER NOT NULL,
+                channelid INTEGER NOT NULL DEFAULT 0,
+                sender INTEGER NOT NULL,
+                entryid INTEGER NOT NULL,
+                createdat TEXT DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(kind, entryid)
+            )
+            """
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_search_docs_scope ON search_docs(kind, scopeid, channelid)")
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(body, tokenize='unicode61 remove_diacritics 2')")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_state (
+                kind TEXT PRIMARY KEY,
+                lastid INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
 
 
 def savevisitor(token: str, language: str, useragent: str, ip: str) -> None:
@@ -587,6 +876,59 @@ def applyledger(user_id: int, amount: int, tx_type: str, description: str, refer
         return False
 
 
+def hasledgerentry(user_id: int, tx_type: str, reference_id: str) -> bool:
+    key = (int(user_id), str(tx_type), str(reference_id))
+    with connect("casino/player") as db:
+        if db.execute("SELECT 1 FROM ledger WHERE user_id = ? AND type = ? AND reference_id = ?", key).fetchone():
+            return True
+        return db.execute(
+            "SELECT 1 FROM ledger_archived_refs WHERE user_id = ? AND type = ? AND reference_id = ?",
+            key,
+        ).fetchone() is not None
+
+
+LEDGER_CHUNK_ROWS = 5000
+
+LedgerRow = tuple[int, int, str, str, str | None]
+
+
+def applyledgermany(rows: list[LedgerRow], chunk: int = LEDGER_CHUNK_ROWS) -> list[bool]:
+    # rows are (user_id, amount, type, description, reference_id). Each chunk
+    # is one transaction; a row whose (user, type, reference) is already in
+    # the ledger is a no-op. Returns one applied flag per input row.
+    batch = [(int(u), int(a), str(t), str(d), ref) for u, a, t, d, ref in rows]
+    if any(row[1] == 0 for row in batch):
+        raise ValueError("amount cannot be zero")
+    applied: list[bool] = []
+    size = max(1, int(chunk))
+    with connect("casino/player") as db:
+        for start in range(0, len(batch), size):
+            part = batch[start:start + size]
+            deltas: dict[int, int] = {}
+            flags = []
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for row in part:
+                    try:
+                        db.execute("INSERT INTO ledger (user_id, amount, type, description, reference_id) VALUES (?, ?, ?, ?, ?)", row)
+                    except sqlite3.IntegrityError:
+                        flags.append(False)
+                        continue
+                    flags.append(True)
+                    deltas[row[0]] = deltas.get(row[0], 0) + row[1]
+                db.executemany("INSERT OR IGNORE INTO wallets (user_id, balance) VALUES (?, 0)", [(uid,) for uid in deltas])
+                db.executemany(
+                    "UPDATE wallets SET balance = balance + ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+                    [(delta, uid) for uid, delta in deltas.items() if delta],
+                )
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            applied.extend(flags)
+    return applied
+
+
 def walletbalance(user_id: int) -> int:
     with connect("casino/player") as db:
         _ensurewallet(db, user_id)
@@ -608,126 +950,628 @@ def syncwallet(user_id: int) -> int:
     return balance
 
 
-def ensurelevel(user_id: int) -> None:
+# Ledger partitions
+# -----------------
+# ledger and xp_ledger keep recent months hot in casino/player. A closed month
+# is copied into casino/ledger_YYYY_MM (append-only there too), sealed in
+# ledger_partitions by id range, and then deleted from the hot table. For the
+# money ledger every user's archived rows are replaced, in the same
+# transaction, by one carry_forward row worth their sum, so SUM(ledger) per
+# user never changes. Archived references stay in *_archived_refs for
+# LEDGER_REF_HORIZON_DAYS (signup grants forever).
+
+LEDGER_ARCHIVE_PREFIX = "casino/ledger_"
+LEDGER_REF_HORIZON_DAYS = 400
+LEDGER_PERMANENT_REF_TYPES = ("initial_grant",)
+LEDGER_COPY_CHUNK = 5000
+TX_CARRY_FORWARD = "carry_forward"
+
+_LEDGER_TABLES = {
+    "ledger": ("user_id, amount, type, description, reference_id, created_at", "ledger_archived_refs", "user_id, type, reference_id"),
+    "xp_ledger": ("user_id, amount, reason, reference_id, created_at", "xp_archived_refs", "user_id, reference_id"),
+}
+
+
+def ledgerarchivename(month: str) -> str:
+    return LEDGER_ARCHIVE_PREFIX + str(month).replace("-", "_")
+
+
+def _ledgerarchivesetup(db: sqlite3.Connection) -> None:
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            description TEXT NOT NULL,
+            reference_id TEXT,
+            created_at TEXT
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS xp_ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            reference_id TEXT,
+            created_at TEXT
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_xp_ledger_user ON xp_ledger(user_id, id)")
+    for table in ("ledger", "xp_ledger"):
+        for event in ("UPDATE", "DELETE"):
+            db.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_no_{event.lower()}
+                BEFORE {event} ON {table}
+                BEGIN
+                    SELECT RAISE(ABORT, 'archived ledger is immutable');
+                END;
+                """
+            )
+
+
+def _monthbounds(month: str) -> tuple[str, str]:
+    year, mon = (int(x) for x in str(month).split("-"))
+    nxt = f"{year + 1:04d}-01" if mon == 12 else f"{year:04d}-{mon + 1:02d}"
+    return f"{year:04d}-{mon:02d}-01 00:00:00", f"{nxt}-01 00:00:00"
+
+
+def ledgerpartitions(table: str = "ledger") -> list[dict]:
+    with connect("casino/player") as db:
+        rows = db.execute(
+            "SELECT month, first_id, last_id, rows, total, sealed, archived_at FROM ledger_partitions WHERE tbl = ? ORDER BY first_id",
+            (str(table),),
+        ).fetchall()
+    return [
+        {"month": r[0], "first_id": int(r[1]), "last_id": int(r[2]), "rows": int(r[3]), "total": int(r[4]), "sealed": bool(r[5]), "archived_at": r[6]}
+        for r in rows
+    ]
+
+
+def nextledgermonth(table: str = "ledger") -> str:
+    # The oldest month that still has rows above the last sealed partition.
     with connect("casino/player") as db:
-        db.execute("INSERT OR IGNORE INTO user_level (user_id, level, xp, total_xp) VALUES (?, 1, 0, 0)", (int(user_id),))
+        last = db.execute("SELECT COALESCE(MAX(last_id), 0) FROM ledger_partitions WHERE tbl = ?", (table,)).fetchone()[0]
+        row = db.execute(f"SELECT created_at FROM {table} WHERE id > ? ORDER BY id LIMIT 1", (int(last),)).fetchone()
+    return str(row[0])[:7] if row and row[0] else ""
+
+
+def _sealledgermonth(table: str, month: str) -> dict | None:
+    columns, refs, refcols = _LEDGER_TABLES[table]
+    with connect("casino/player") as db:
+        sealed = db.execute(
+            "SELECT first_id, last_id, rows, total FROM ledger_partitions WHERE tbl = ? AND month = ?",
+            (table, month),
+        ).fetchone()
+        if sealed:
+            return {"first_id": int(sealed[0]), "last_id": int(sealed[1]), "rows": int(sealed[2]), "total": int(sealed[3])}
+        _, end = _monthbounds(month)
+        first = int(db.execute("SELECT COALESCE(MAX(last_id), 0) FROM ledger_partitions WHERE tbl = ?", (table,)).fetchone()[0]) + 1
+        # The partition ends just before the first row of a later month, so
+        # it is always a contiguous id range.
+        later = db.execute(f"SELECT MIN(id) FROM {table} WHERE id >= ? AND created_at >= ?", (first, end)).fetchone()[0]
+        if later is None:
+            later = int(db.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]) + 1
+        last = int(later) - 1
+        if last < first:
+            return None
+        count, total = db.execute(f"SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM {table} WHERE id BETWEEN ? AND ?", (first, last)).fetchone()
+
+    # Copy first; the archive insert is idempotent by id, so a crash before
+    # sealing simply repeats it on the next run.
+    with connect(ledgerarchivename(month)) as archive, connect("casino/player") as db:
+        _ledgerarchivesetup(archive)
+        cursor = first - 1
+        while cursor < last:
+            chunk = db.execute(
+                f"SELECT id, {columns} FROM {table} WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                (cursor, last, LEDGER_COPY_CHUNK),
+            ).fetchall()
+            if not chunk:
+                break
+            marks = ",".join("?" for _ in range(len(chunk[0])))
+            archive.executemany(f"INSERT OR IGNORE INTO {table} (id, {columns}) VALUES ({marks})", chunk)
+            archive.commit()
+            cursor = int(chunk[-1][0])
+        copied = archive.execute(f"SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM {table} WHERE id BETWEEN ? AND ?", (first, last)).fetchone()
+    if (int(copied[0]), int(copied[1])) != (int(count), int(total)):
+        raise RuntimeError(f"{table} {month}: archive has {copied[0]} rows / {copied[1]}, expected {count} / {total}")
+
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                f"""
+                INSERT OR IGNORE INTO {refs} ({refcols}, month)
+                SELECT {refcols}, ? FROM {table}
+                WHERE id BETWEEN ? AND ? AND reference_id IS NOT NULL AND reference_id <> ''
+                """,
+                (month, first, last),
+            )
+            db.execute(
+                "INSERT INTO ledger_partitions (tbl, month, first_id, last_id, rows, total, sealed) VALUES (?, ?, ?, ?, ?, ?, 1)",
+                (table, month, first, last, int(count), int(total)),
+            )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+    return {"first_id": first, "last_id": last, "rows": int(count), "total": int(total)}
+
+
+def archiveledgermonth(table: str, month: str, users_per_tx: int = 200) -> dict:
+    if table not in _LEDGER_TABLES:
+        raise ValueError(f"unknown ledger table: {table}")
+    part = _sealledgermonth(table, month)
+    if part is None:
+        return {"table": table, "month": month, "rows": 0, "moved": 0}
+    first, last = part["first_id"], part["last_id"]
+    moved = 0
+    with connect("casino/player") as db:
+        users = [int(r[0]) for r in db.execute(f"SELECT DISTINCT user_id FROM {table} WHERE id BETWEEN ? AND ?", (first, last))]
+        step = max(1, int(users_per_tx))
+        for start in range(0, len(users), step):
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for uid in users[start:start + step]:
+                    if table == "ledger":
+                        total = db.execute(
+                            "SELECT COALESCE(SUM(amount), 0) FROM ledger WHERE user_id = ? AND id BETWEEN ? AND ?",
+                            (uid, first, last),
+                        ).fetchone()[0]
+                        if int(total):
+                            db.execute(
+                                "INSERT OR IGNORE INTO ledger (user_id, amount, type, description, reference_id) VALUES (?, ?, ?, ?, ?)",
+                                (uid, int(total), TX_CARRY_FORWARD, f"opening balance carried from {month}", f"carry:{month}"),
+                            )
+                    moved += db.execute(f"DELETE FROM {table} WHERE user_id = ? AND id BETWEEN ? AND ?", (uid, first, last)).rowcount
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        left = db.execute(f"SELECT COUNT(*) FROM {table} WHERE id BETWEEN ? AND ?", (first, last)).fetchone()[0]
+        if int(left) == 0:
+            db.execute("UPDATE ledger_partitions SET archived_at = ? WHERE tbl = ? AND month = ?", (time.time(), table, month))
+            db.commit()
+    return {"table": table, "month": month, "rows": part["rows"], "moved": moved, "remaining": int(left)}
+
+
+def pruneledgerrefs(horizon_days: int = LEDGER_REF_HORIZON_DAYS) -> int:
+    cutoff = datetime.fromtimestamp(time.time() - int(horizon_days) * 86400, timezone.utc).strftime("%Y-%m")
+    marks = ",".join("?" for _ in LEDGER_PERMANENT_REF_TYPES)
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
+        removed = db.execute(
+            f"DELETE FROM ledger_archived_refs WHERE month < ? AND type NOT IN ({marks})",
+            (cutoff, *LEDGER_PERMANENT_REF_TYPES),
+        ).rowcount
+        removed += db.execute("DELETE FROM xp_archived_refs WHERE month < ?", (cutoff,)).rowcount
+        db.execute("COMMIT")
+    return int(removed)
+
+
+def archivedledgerrows(month: str, user_id: int, table: str = "ledger"):
+    columns = _LEDGER_TABLES[table][0]
+    target = path(ledgerarchivename(month))
+    if not target.exists():
+        return []
+    with sqlite3.connect(f"file:{target}?mode=ro", uri=True) as db:
+        return db.execute(f"SELECT id, {columns} FROM {table} WHERE user_id = ? ORDER BY id", (int(user_id),)).fetchall()
 
 
 def levelstate(user_id: int):
     with connect("casino/player") as db:
-        db.execute("INSERT OR IGNORE INTO user_level (user_id, level, xp, total_xp) VALUES (?, 1, 0, 0)", (int(user_id),))
         return db.execute(
             "SELECT level, xp, total_xp, updated_at FROM user_level WHERE user_id = ?",
             (int(user_id),),
         ).fetchone()
 
 
+def levelstates(user_ids: list[int]) -> dict[int, int]:
+    ids = sorted({int(u) for u in user_ids})
+    out: dict[int, int] = {}
+    with connect("casino/player") as db:
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ",".join("?" for _ in chunk)
+            for uid, total_xp in db.execute(f"SELECT user_id, total_xp FROM user_level WHERE user_id IN ({marks})", chunk):
+                out[int(uid)] = int(total_xp)
+    return out
+
+
+# Level and in-level xp are a function of total_xp; callers pass the resolver
+# from core.leveling so the curve lives in one place.
+LevelResolver = Callable[[int], tuple[int, int]]
+
+
+def _applyxp(
+    db: sqlite3.Connection,
+    user_id: int,
+    value: int,
+    reason: str,
+    reference_id: str | None,
+    resolve: LevelResolver,
+) -> tuple[bool, int, int, int]:
+    uid = int(user_id)
+    try:
+        db.execute(
+            "INSERT INTO xp_ledger (user_id, amount, reason, reference_id) VALUES (?, ?, ?, ?)",
+            (uid, value, str(reason), reference_id),
+        )
+    except sqlite3.IntegrityError:
+        row = db.execute("SELECT total_xp FROM user_level WHERE user_id = ?", (uid,)).fetchone()
+        total_xp = int(row[0]) if row else 0
+        return (False, *resolve(total_xp), total_xp)
+
+    row = db.execute(
+        """
+        INSERT INTO user_level (user_id, level, xp, total_xp) VALUES (?, 1, 0, ?)
+        ON CONFLICT(user_id) DO UPDATE SET total_xp = total_xp + excluded.total_xp
+        RETURNING total_xp
+        """,
+        (uid, value),
+    ).fetchone()
+    total_xp = int(row[0])
+    level, xp = resolve(total_xp)
+    db.execute(
+        "UPDATE user_level SET level = ?, xp = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+        (level, xp, uid),
+    )
+    return True, level, xp, total_xp
+
+
 def applyxp(
     user_id: int,
     amount: int,
     reason: str,
-    reference_id: str | None = None,
-    max_level: int = 100,
-    base_xp: int = 100,
-    step_xp: int = 50,
+    reference_id: str | None,
+    resolve: LevelResolver,
 ) -> tuple[bool, int, int, int]:
     value = int(amount)
     if value <= 0:
         raise ValueError("amount must be positive")
     with connect("casino/player") as db:
         db.execute("BEGIN IMMEDIATE")
-        db.execute("INSERT OR IGNORE INTO user_level (user_id, level, xp, total_xp) VALUES (?, 1, 0, 0)", (int(user_id),))
+        result = _applyxp(db, user_id, value, reason, reference_id, resolve)
+        db.execute("COMMIT" if result[0] else "ROLLBACK")
+        return result
+
+
+def applyxpmany(rows: list[tuple[int, int, str, str | None]], resolve: LevelResolver) -> dict[int, tuple[int, int, int]]:
+    # rows are (user_id, amount, reason, reference_id). Grants whose reference
+    # is already in xp_ledger are skipped; every user touched is written once
+    # with its final total. Returns {user_id: (level, xp, total_xp)} for users
+    # that gained xp.
+    gained: dict[int, int] = {}
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
         try:
-            db.execute(
-                "INSERT INTO xp_ledger (user_id, amount, reason, reference_id) VALUES (?, ?, ?, ?)",
-                (int(user_id), value, str(reason), reference_id),
-            )
-        except sqlite3.IntegrityError:
-            row = db.execute("SELECT level, xp, total_xp FROM user_level WHERE user_id = ?", (int(user_id),)).fetchone()
+            for uid, amount, reason, ref in rows:
+                value = int(amount)
+                if value <= 0:
+                    continue
+                try:
+                    db.execute(
+                        "INSERT INTO xp_ledger (user_id, amount, reason, reference_id) VALUES (?, ?, ?, ?)",
+                        (int(uid), value, str(reason), ref),
+                    )
+                except sqlite3.IntegrityError:
+                    continue
+                gained[int(uid)] = gained.get(int(uid), 0) + value
+            out: dict[int, tuple[int, int, int]] = {}
+            for uid, value in gained.items():
+                total_xp = int(db.execute(
+                    """
+                    INSERT INTO user_level (user_id, level, xp, total_xp) VALUES (?, 1, 0, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET total_xp = total_xp + excluded.total_xp
+                    RETURNING total_xp
+                    """,
+                    (uid, value),
+                ).fetchone()[0])
+                level, xp = resolve(total_xp)
+                db.execute(
+                    "UPDATE user_level SET level = ?, xp = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
+                    (level, xp, uid),
+                )
+                out[uid] = (level, xp, total_xp)
+        except BaseException:
             db.execute("ROLLBACK")
-            return False, int(row[0]), int(row[1]), int(row[2])
-
-        row = db.execute("SELECT level, xp, total_xp FROM user_level WHERE user_id = ?", (int(user_id),)).fetchone()
-        level = int(row[0]) if row else 1
-        xp = int(row[1]) if row else 0
-        total_xp = int(row[2]) if row else 0
-        xp += value
-        total_xp += value
-
-        while level < int(max_level):
-            required = int(base_xp) + (int(level) - 1) * int(step_xp)
-            if xp < required:
-                break
-            xp -= required
-            level += 1
+            raise
+        db.execute("COMMIT")
+    return out
 
-        db.execute(
-            "UPDATE user_level SET level = ?, xp = ?, total_xp = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
-            (level, xp, total_xp, int(user_id)),
-        )
+
+def settlecasinoround(
+    game_name: str,
+    rows: list[dict],
+    payout_type: str,
+    description: str,
+    xp_reason: str,
+    resolve: LevelResolver,
+) -> int:
+    # One transaction for a whole shared round. Rows whose xp or payout
+    # reference is already in a ledger were settled before and are skipped
+    # entirely, so a rerun of the batch never counts a game twice.
+    settled = 0
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for row in rows:
+                uid = int(row["user_id"])
+                stake = int(row.get("stake", 0))
+                payout = int(row.get("payout", 0))
+                ref = str(row["reference_id"])
+                xp = int(row.get("xp", 0))
+                if xp > 0 and not _applyxp(db, uid, xp, xp_reason, ref, resolve)[0]:
+                    continue
+                if payout > 0 and not _applyledger(db, uid, payout, payout_type, description, f"{ref}:payout"):
+                    continue
+                _recordcasinogame(db, uid, game_name, payout - stake)
+                settled += 1
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
         db.execute("COMMIT")
-        return True, level, xp, total_xp
+    return settled
 
 
-def casinosummary(user_id: int):
+# Table bets live in the table's process until the round settles, so every
+# stake debit and refund also moves the user's open stake for that round in
+# the same transaction. Rows left behind by a process that died mid-round are
+# refunded by refundroulettetablestakes unless the round was settled (its xp
+# entry exists) before the process went away.
+def roulettetablestake(user_id: int, amount: int, tx_type: str, description: str, reference_id: str, table_id: str, round_id: str) -> bool:
     with connect("casino/player") as db:
-        row = db.execute(
-            """
-            SELECT
-                COALESCE(SUM(CASE WHEN delta_amount > 0 THEN delta_amount ELSE 0 END), 0) AS total_win_amount,
-                COALESCE(SUM(CASE WHEN delta_amount < 0 THEN -delta_amount ELSE 0 END), 0) AS total_lose_amount
-            FROM casino_games
-            WHERE user_id = ?
-            """,
-            (int(user_id),),
-        ).fetchone()
-    wins = int(row[0]) if row else 0
-    loses = int(row[1]) if row else 0
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            applied = _applyledger(db, user_id, amount, tx_type, description, reference_id)
+            if applied:
+                db.execute(
+                    """
+                    INSERT INTO roulette_table_stakes (table_id, round_id, user_id, stake, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(table_id, round_id, user_id) DO UPDATE SET stake = stake + excluded.stake, updated_at = excluded.updated_at
+                    """,
+                    (str(table_id), str(round_id), int(user_id), -int(amount), time.time()),
+                )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+    return applied
+
+
+def clearroulettetablestakes(table_id: str, round_id: str) -> None:
+    with connect("casino/player") as db:
+        db.execute("DELETE FROM roulette_table_stakes WHERE table_id = ? AND round_id = ?", (str(table_id), str(round_id)))
+        db.commit()
+
+
+def refundroulettetablestakes(older_than: float) -> int:
+    refunded = 0
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(
+                "SELECT table_id, round_id, user_id, stake FROM roulette_table_stakes WHERE updated_at < ?",
+                (time.time() - float(older_than),),
+            ).fetchall()
+            for table_id, round_id, uid, stake in rows:
+                ref = f"roulette_table:{table_id}:{round_id}"
+                settled = db.execute("SELECT 1 FROM xp_ledger WHERE user_id = ? AND reference_id = ?", (uid, ref)).fetchone()
+                if stake > 0 and not settled and _applyledger(db, uid, stake, "roulette_refund", "roulette table round refund", f"{ref}:restart"):
+                    refunded += 1
+                db.execute("DELETE FROM roulette_table_stakes WHERE table_id = ? AND round_id = ? AND user_id = ?", (table_id, round_id, uid))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+    return refunded
+
+
+def casinosummary(user_id: int):
+    totals = casinorollup(0, time.time(), user_id)
+    wins = totals["wins"]
+    loses = totals["losses"]
     ratio = round((wins / loses), 2) if loses > 0 else (float(wins) if wins > 0 else 0.0)
     return wins, loses, ratio
 
 
-def casinoleaderboard(period: str, limit: int = 5):
-    where = ""
-    if period == "daily":
-        where = "AND created_at >= datetime('now', '-1 day')"
-    elif period == "weekly":
-        where = "AND created_at >= datetime('now', '-7 day')"
-    elif period == "monthly":
-        where = "AND created_at >= datetime('now', '-30 day')"
-    with connect("accounts") as db:
-        db.execute("ATTACH DATABASE ? AS casino_player", (str(path("casino/player")),))
-        rows = db.execute(
+# casino_rollup keeps one row per (grain, bucket, user). Grain 'h' buckets are
+# epoch hours, grain 'd' buckets are epoch days. Hours older than
+# ROLLUP_HOURLY_DAYS are folded into days by compaction. A window [start, end)
+# in hours counts every hour bucket inside it and every day bucket whose first
+# hour is inside it, so windows reaching past the hourly range are day-aligned.
+ROLLUP_HOURLY_DAYS = 8
+LEADERBOARD_PERIODS = {"daily": 24, "weekly": 24 * 7, "monthly": 24 * 30}
+ROLLUP_COLUMNS = ("games", "wins", "losses", "net")
+
+
+def _hourbucket(when: float | None = None) -> int:
+    return int((time.time() if when is None else when) // 3600)
+
+
+def _rollupwhere(start: int, end: int) -> tuple[str, tuple[int, int, int, int]]:
+    return (
+        "((grain = 'h' AND bucket >= ? AND bucket < ?) OR (grain = 'd' AND bucket >= ? AND bucket < ?))",
+        (int(start), int(end), -(-int(start) // 24), -(-int(end) // 24)),
+    )
+
+
+def _rolluprecord(db: sqlite3.Connection, user_id: int, delta_amount: int, hour: int) -> None:
+    delta = int(delta_amount)
+    db.execute(
+        """
+        INSERT INTO casino_rollup (grain, bucket, user_id, games, wins, losses, net) VALUES ('h', ?, ?, 1, ?, ?, ?)
+        ON CONFLICT(grain, bucket, user_id) DO UPDATE SET
+            games = games + 1,
+            wins = wins + excluded.wins,
+            losses = losses + excluded.losses,
+            net = net + excluded.net
+        """,
+        (int(hour), int(user_id), max(0, delta), max(0, -delta), delta),
+    )
+
+
+def _compactrollup(db: sqlite3.Connection, now: int) -> int:
+    limit = (int(now) - ROLLUP_HOURLY_DAYS * 24) // 24 * 24
+    db.execute(
+        """
+        INSERT INTO casino_rollup (grain, bucket, user_id, games, wins, losses, net)
+        SELECT 'd', bucket / 24, user_id, SUM(games), SUM(wins), SUM(losses), SUM(net)
+        FROM casino_rollup WHERE grain = 'h' AND bucket < ?
+        GROUP BY bucket / 24, user_id
+        ON CONFLICT(grain, bucket, user_id) DO UPDATE SET
+            games = games + excluded.games,
+            wins = wins + excluded.wins,
+            losses = losses + excluded.losses,
+            net = net + excluded.net
+        """,
+        (limit,),
+    )
+    return int(db.execute("DELETE FROM casino_rollup WHERE grain = 'h' AND bucket < ?", (limit,)).rowcount)
+
+
+def compactcasinorollup() -> int:
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
+        folded = _compactrollup(db, _hourbucket())
+        db.execute("COMMIT")
+    return folded
+
+
+def _backfillrollup(db: sqlite3.Connection) -> None:
+    now = _hourbucket()
+    db.execute("DELETE FROM casino_rollup")
+    db.execute("DELETE FROM casino_leaderboard")
+    db.execute(
+        """
+        INSERT INTO casino_rollup (grain, bucket, user_id, games, wins, losses, net)
+        SELECT 'h', CAST(strftime('%s', created_at) AS INTEGER) / 3600 AS b, user_id, COUNT(*),
+            SUM(CASE WHEN delta_amount > 0 THEN delta_amount ELSE 0 END),
+            SUM(CASE WHEN delta_amount < 0 THEN -delta_amount ELSE 0 END),
+            SUM(delta_amount)
+        FROM casino_games
+        GROUP BY b, user_id
+        """
+    )
+    _compactrollup(db, now)
+    for period, hours in LEADERBOARD_PERIODS.items():
+        cutoff = now - hours + 1
+        where, args = _rollupwhere(cutoff, now + 1)
+        db.execute(
             f"""
-            SELECT a.username, COALESCE(SUM(CASE WHEN g.delta_amount > 0 THEN g.delta_amount ELSE 0 END), 0) AS total_win
-            FROM casino_player.casino_games g
-            JOIN accounts a ON a.id = g.user_id
-            WHERE 1=1 {where}
-            GROUP BY g.user_id, a.username
-            HAVING total_win > 0
-            ORDER BY total_win DESC, a.username ASC
-            LIMIT ?
+            INSERT INTO casino_leaderboard (period, user_id, amount)
+            SELECT ?, user_id, SUM(wins) AS total FROM casino_rollup WHERE {where} GROUP BY user_id HAVING total > 0
             """,
-            (int(limit),),
+            (period, *args),
+        )
+        db.execute("INSERT OR REPLACE INTO casino_leaderboard_watermark (period, bucket) VALUES (?, ?)", (period, cutoff))
+
+
+def _expireleaderboard(db: sqlite3.Connection, now: int) -> None:
+    # Each period covers the rollup window [watermark, now]. Buckets that left
+    # the window since the last call are subtracted instead of re-aggregating.
+    marks = dict(db.execute("SELECT period, bucket FROM casino_leaderboard_watermark").fetchall())
+    moved = False
+    for period, hours in LEADERBOARD_PERIODS.items():
+        cutoff = now - hours + 1
+        mark = int(marks.get(period, cutoff))
+        if mark >= cutoff:
+            continue
+        moved = True
+        where, args = _rollupwhere(mark, cutoff)
+        for uid, amount in db.execute(
+            f"SELECT user_id, SUM(wins) FROM casino_rollup WHERE {where} GROUP BY user_id",
+            args,
+        ).fetchall():
+            db.execute(
+                "UPDATE casino_leaderboard SET amount = amount - ? WHERE period = ? AND user_id = ?",
+                (int(amount), period, int(uid)),
+            )
+        db.execute("DELETE FROM casino_leaderboard WHERE period = ? AND amount <= 0", (period,))
+        db.execute("INSERT OR REPLACE INTO casino_leaderboard_watermark (period, bucket) VALUES (?, ?)", (period, cutoff))
+    if moved:
+        _compactrollup(db, now)
+
+
+def casinorollup(start: float, end: float, user_id: int | None = None) -> dict[str, int]:
+    where, args = _rollupwhere(int(start // 3600), -(-int(end) // 3600))
+    sums = ", ".join(f"COALESCE(SUM({c}), 0)" for c in ROLLUP_COLUMNS)
+    with connect("casino/player") as db:
+        if user_id is None:
+            row = db.execute(f"SELECT {sums}, COUNT(DISTINCT user_id) FROM casino_rollup WHERE {where}", args).fetchone()
+        else:
+            row = db.execute(f"SELECT {sums}, COUNT(DISTINCT user_id) FROM casino_rollup WHERE user_id = ? AND {where}", (int(user_id), *args)).fetchone()
+    out = {c: int(row[i]) for i, c in enumerate(ROLLUP_COLUMNS)}
+    out["players"] = int(row[-1])
+    return out
+
+
+def casinorollupusers(start: float, end: float, order: str = "net", limit: int = 10) -> list[dict]:
+    column = order if order in ROLLUP_COLUMNS else "net"
+    where, args = _rollupwhere(int(start // 3600), -(-int(end) // 3600))
+    sums = ", ".join(f"SUM({c}) AS {c}" for c in ROLLUP_COLUMNS)
+    with connect("casino/player") as db:
+        rows = db.execute(
+            f"SELECT user_id, {sums} FROM casino_rollup WHERE {where} GROUP BY user_id ORDER BY {column} DESC, user_id ASC LIMIT ?",
+            (*args, int(limit)),
         ).fetchall()
-    return [{"username": r[0], "amount": int(r[1])} for r in rows]
+    return [{"user_id": int(r[0]), **{c: int(r[i + 1]) for i, c in enumerate(ROLLUP_COLUMNS)}} for r in rows]
 
 
-def casinorichest(limit: int = 5):
-    with connect("accounts") as db:
-        db.execute("ATTACH DATABASE ? AS casino_player", (str(path("casino/player")),))
+def _leaderboardstale(db: sqlite3.Connection, now: int) -> bool:
+    marks = dict(db.execute("SELECT period, bucket FROM casino_leaderboard_watermark").fetchall())
+    return any(int(marks.get(p, 0)) < now - hours + 1 for p, hours in LEADERBOARD_PERIODS.items())
+
+
+def _rankbyname(rows: list[tuple[int, int]], limit: int) -> list[tuple[str, int]]:
+    # rows hold every user tied with the last place, so ordering by username
+    # afterwards gives the same result as a full ORDER BY amount, username.
+    names = {r[0]: r[1] for r in accountsbasic([uid for uid, _ in rows])}
+    ranked = sorted(((names[uid], amount) for uid, amount in rows if uid in names), key=lambda r: (-r[1], r[0]))
+    return ranked[: int(limit)]
+
+
+def casinoleaderboard(period: str, limit: int = 5):
+    if period not in LEADERBOARD_PERIODS:
+        return []
+    now = _hourbucket()
+    with connect("casino/player") as db:
+        if _leaderboardstale(db, now):
+            db.execute("BEGIN IMMEDIATE")
+            _expireleaderboard(db, now)
+            db.execute("COMMIT")
+        floor = db.execute(
+            "SELECT amount FROM casino_leaderboard WHERE period = ? AND amount > 0 ORDER BY amount DESC LIMIT 1 OFFSET ?",
+            (period, max(0, int(limit) - 1)),
+        ).fetchone()
         rows = db.execute(
-            """
-            SELECT a.username, w.balance
-            FROM casino_player.wallets w
-            JOIN accounts a ON a.id = w.user_id
-            WHERE EXISTS (SELECT 1 FROM casino_player.casino_games g WHERE g.user_id = w.user_id)
-            ORDER BY w.balance DESC, a.username ASC
-            LIMIT ?
-            """,
-            (int(limit),),
+            "SELECT user_id, amount FROM casino_leaderboard WHERE period = ? AND amount >= ? ORDER BY amount DESC",
+            (period, int(floor[0]) if floor else 1),
         ).fetchall()
-    return [{"username": r[0], "balance": int(r[1])} for r in rows]
+    return [{"username": name, "amount": int(amount)} for name, amount in _rankbyname(rows, limit)]
+
+
+def casinorichest(limit: int = 5):
+    with connect("casino/player") as db:
+        query = """
+            SELECT w.user_id, w.balance FROM wallets w
+            WHERE EXISTS (SELECT 1 FROM casino_games g WHERE g.user_id = w.user_id) {extra}
+            ORDER BY w.balance DESC
+        """
+        floor = db.execute(query.format(extra="") + " LIMIT 1 OFFSET ?", (max(0, int(limit) - 1),)).fetchone()
+        if floor:
+            rows = db.execute(query.format(extra="AND w.balance >= ?"), (int(floor[1]),)).fetchall()
+        else:
+            rows = db.execute(query.format(extra=""), ()).fetchall()
+    return [{"username": name, "balance": int(balance)} for name, balance in _rankbyname(rows, limit)]
 
 
 def casinolastgames(user_id: int, limit: int = 10):
@@ -745,12 +1589,146 @@ def casinolastgames(user_id: int, limit: int = 10):
     return [{"game_name": r[0], "delta_amount": int(r[1]), "created_at": r[2]} for r in rows]
 
 
-def recordcasinogame(user_id: int, game_name: str, delta_amount: int) -> None:
+def _recordcasinogame(db: sqlite3.Connection, user_id: int, game_name: str, delta_amount: int) -> None:
+    db.execute(
+        "INSERT INTO casino_games (user_id, game_name, delta_amount) VALUES (?, ?, ?)",
+        (int(user_id), str(game_name), int(delta_amount)),
+    )
+    _bumpcasinometrics(db, user_id, game_name, delta_amount)
+    now = _hourbucket()
+    _rolluprecord(db, user_id, delta_amount, now)
+    if int(delta_amount) <= 0:
+        return
+    _expireleaderboard(db, now)
+    for period in LEADERBOARD_PERIODS:
+        db.execute(
+            """
+            INSERT INTO casino_leaderboard (period, user_id, amount) VALUES (?, ?, ?)
+            ON CONFLICT(period, user_id) DO UPDATE SET amount = amount + excluded.amount
+            """,
+            (period, int(user_id), int(delta_amount)),
+        )
+
+
+def recordcasinogame(user_id: int, game_name: str, delta_amount: int) -> None:
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
+        _recordcasinogame(db, user_id, game_name, delta_amount)
+        db.execute("COMMIT")
+
+
+def addcasehistory(user_id: int, case_id: str, round_id: str, item_index: int, payout: int, top_k: int = 10, seed_hash: str = "", nonce: int = 0) -> int:
+    uid = int(user_id)
+    with connect("casino/player") as db:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = db.execute(
+                "INSERT INTO case_history (user_id, case_id, round_id, item_index, payout, created_at, seed_hash, nonce) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (uid, str(case_id), str(round_id), int(item_index), int(payout), time.time(), str(seed_hash), int(nonce)),
+            )
+            hid = int(cur.lastrowid)
+            floor = db.execute(
+                "SELECT payout, history_id FROM case_top_wins WHERE user_id = ? AND case_id = ? ORDER BY payout DESC, history_id DESC LIMIT 1 OFFSET ?",
+                (uid, str(case_id), max(0, int(top_k) - 1)),
+            ).fetchone()
+            if not floor or int(payout) >= int(floor[0]):
+                db.execute(
+                    "INSERT INTO case_top_wins (user_id, case_id, history_id, payout) VALUES (?, ?, ?, ?)",
+                    (uid, str(case_id), hid, int(payout)),
+                )
+                if floor:
+                    db.execute(
+                        "DELETE FROM case_top_wins WHERE user_id = ? AND case_id = ? AND history_id = ?",
+                        (uid, str(case_id), int(floor[1])),
+                    )
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+    return hid
+
+
+def casehistory(user_id: int, case_id: str, limit: int = 10, before_id: int = 0):
+    with connect("casino/player") as db:
+        if int(before_id) > 0:
+            return db.execute(
+                """
+                SELECT id, round_id, item_index, payout, created_at, seed_hash, nonce FROM case_history
+                WHERE user_id = ? AND case_id = ? AND id < ?
+                ORDER BY id DESC LIMIT ?
+                """,
+                (int(user_id), str(case_id), int(before_id), int(limit)),
+            ).fetchall()
+        return db.execute(
+            "SELECT id, round_id, item_index, payout, created_at, seed_hash, nonce FROM case_history WHERE user_id = ? AND case_id = ? ORDER BY id DESC LIMIT ?",
+            (int(user_id), str(case_id), int(limit)),
+        ).fetchall()
+
+
+def casetopwins(user_id: int, case_id: str, limit: int = 3):
+    with connect("casino/player") as db:
+        return db.execute(
+            """
+            SELECT h.id, h.round_id, h.item_index, h.payout, h.created_at, h.seed_hash, h.nonce
+            FROM case_top_wins t
+            JOIN case_history h ON h.id = t.history_id
+            WHERE t.user_id = ? AND t.case_id = ?
+            ORDER BY t.payout DESC, t.history_id DESC
+            LIMIT ?
+            """,
+            (int(user_id), str(case_id), int(limit)),
+        ).fetchall()
+
+
+# Server seeds are stored when they go live and marked retired when the
+# process that drew from them rotates away. Seeds of a process that died
+# without rotating count as retired once they are older than the rotation
+# age, since no live SeedManager draws from a seed that old. State that keeps
+# drawing from an old seed later (a blackjack shoe) holds it in
+# casino_seed_holds under one row per holder, and a held seed stays secret.
+def savecasinoseed(seed_hash: str, server_seed: str) -> None:
     with connect("casino/player") as db:
         db.execute(
-            "INSERT INTO casino_games (user_id, game_name, delta_amount) VALUES (?, ?, ?)",
-            (int(user_id), str(game_name), int(delta_amount)),
+            "INSERT OR IGNORE INTO casino_seeds (seed_hash, server_seed, created_at) VALUES (?, ?, ?)",
+            (str(seed_hash), str(server_seed), time.time()),
         )
+        db.commit()
+
+
+def retirecasinoseed(seed_hash: str) -> None:
+    with connect("casino/player") as db:
+        db.execute("UPDATE casino_seeds SET retired_at = ? WHERE seed_hash = ? AND retired_at IS NULL", (time.time(), str(seed_hash)))
+        db.commit()
+
+
+def holdcasinoseed(holder: str, seed_hash: str) -> None:
+    with connect("casino/player") as db:
+        if seed_hash:
+            db.execute(
+                """
+                INSERT INTO casino_seed_holds (holder, seed_hash, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(holder) DO UPDATE SET seed_hash = excluded.seed_hash, updated_at = excluded.updated_at
+                """,
+                (str(holder), str(seed_hash), time.time()),
+            )
+        else:
+            db.execute("DELETE FROM casino_seed_holds WHERE holder = ?", (str(holder),))
+        db.commit()
+
+
+def casinoseed(seed_hash: str, max_age: float) -> tuple[str, bool]:
+    # (server seed or "", whether it is retired and unheld).
+    with connect("casino/player") as db:
+        row = db.execute(
+            """
+            SELECT server_seed,
+                   (retired_at IS NOT NULL OR created_at < ?)
+                   AND NOT EXISTS (SELECT 1 FROM casino_seed_holds WHERE seed_hash = casino_seeds.seed_hash)
+            FROM casino_seeds WHERE seed_hash = ?
+            """,
+            (time.time() - float(max_age), str(seed_hash)),
+        ).fetchone()
+    return (str(row[0]), bool(row[1])) if row else ("", False)
 
 
 CASINO_ACHIEVEMENTS = [
@@ -773,40 +1751,102 @@ def _achievement_reward(level: int) -> int:
     return 10 + max(0, int(level) - 1) * 10
 
 
-def _casino_metrics(user_id: int) -> dict[str, int]:
+CASINO_METRICS = (
+    "wins_total",
+    "net_total",
+    "games_total",
+    "roulette_games",
+    "blackjack_games",
+    "multiplier_games",
+    "case_opened",
+    "max_single_win",
+    "profitable_games",
+)
+
+
+def _rebuildcasinometrics(db: sqlite3.Connection, user_id: int | None = None) -> int:
+    where = "WHERE user_id = ?" if user_id is not None else ""
+    args = (int(user_id),) if user_id is not None else ()
+    db.execute(f"DELETE FROM casino_user_metrics {where}", args)
+    cur = db.execute(
+        f"""
+        INSERT INTO casino_user_metrics ({', '.join(("user_id",) + CASINO_METRICS)})
+        SELECT
+            user_id,
+            COALESCE(SUM(CASE WHEN delta_amount > 0 THEN delta_amount ELSE 0 END), 0),
+            COALESCE(SUM(delta_amount), 0),
+            COUNT(*),
+            COALESCE(SUM(CASE WHEN game_name = 'roulette' THEN 1 ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN game_name = 'blackjack' THEN 1 ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN game_name = 'multiplier' THEN 1 ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN game_name LIKE 'case:%' THEN 1 ELSE 0 END), 0),
+            COALESCE(MAX(CASE WHEN delta_amount > 0 THEN delta_amount ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN delta_amount > 0 THEN 1 ELSE 0 END), 0)
+        FROM casino_games
+        {where}
+        GROUP BY user_id
+        """,
+        args,
+    )
+    return int(cur.rowcount)
+
+
+def rebuildcasinometrics(user_id: int | None = None) -> int:
     with connect("casino/player") as db:
-        row = db.execute(
-            """
-            SELECT
-                COALESCE(SUM(CASE WHEN delta_amount > 0 THEN delta_amount ELSE 0 END), 0),
-                COALESCE(SUM(delta_amount), 0),
-                COALESCE(COUNT(*), 0),
-                COALESCE(SUM(CASE WHEN game_name = 'roulette' THEN 1 ELSE 0 END), 0),
-                COALESCE(SUM(CASE WHEN game_name = 'blackjack' THEN 1 ELSE 0 END), 0),
-                COALESCE(SUM(CASE WHEN game_name = 'multiplier' THEN 1 ELSE 0 END), 0),
-                COALESCE(SUM(CASE WHEN game_name LIKE 'case:%' THEN 1 ELSE 0 END), 0),
-                COALESCE(MAX(CASE WHEN delta_amount > 0 THEN delta_amount ELSE 0 END), 0),
-                COALESCE(SUM(CASE WHEN delta_amount > 0 THEN 1 ELSE 0 END), 0)
-            FROM casino_games
-            WHERE user_id = ?
-            """,
-            (int(user_id),),
-        ).fetchone()
-    balance = int(syncwallet(int(user_id)))
-    wins_total = int(row[0] if row else 0)
-    net_profit = max(0, int(row[1] if row else 0))
-    return {
-        "wins_total": wins_total,
-        "net_profit": net_profit,
-        "games_total": int(row[2] if row else 0),
-        "roulette_games": int(row[3] if row else 0),
-        "blackjack_games": int(row[4] if row else 0),
-        "multiplier_games": int(row[5] if row else 0),
-        "case_opened": int(row[6] if row else 0),
-        "max_single_win": int(row[7] if row else 0),
-        "profitable_games": int(row[8] if row else 0),
-        "balance": balance,
-    }
+        db.execute("BEGIN IMMEDIATE")
+        count = _rebuildcasinometrics(db, user_id)
+        db.execute("COMMIT")
+    return count
+
+
+def _bumpcasinometrics(db: sqlite3.Connection, user_id: int, game_name: str, delta_amount: int) -> None:
+    delta = int(delta_amount)
+    win = max(0, delta)
+    game = str(game_name)
+    db.execute(
+        """
+        INSERT INTO casino_user_metrics
+            (user_id, wins_total, net_total, games_total, roulette_games, blackjack_games, multiplier_games, case_opened, max_single_win, profitable_games)
+        VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            wins_total = wins_total + excluded.wins_total,
+            net_total = net_total + excluded.net_total,
+            games_total = games_total + 1,
+            roulette_games = roulette_games + excluded.roulette_games,
+            blackjack_games = blackjack_games + excluded.blackjack_games,
+            multiplier_games = multiplier_games + excluded.multiplier_games,
+            case_opened = case_opened + excluded.case_opened,
+            max_single_win = MAX(max_single_win, excluded.max_single_win),
+            profitable_games = profitable_games + excluded.profitable_games
+        """,
+        (
+            int(user_id),
+            win,
+            delta,
+            int(game == "roulette"),
+            int(game == "blackjack"),
+            int(game == "multiplier"),
+            int(game.startswith("case:")),
+            win,
+            int(delta > 0),
+        ),
+    )
+
+
+def _casino_metrics(db: sqlite3.Connection, user_id: int) -> dict[str, int]:
+    row = db.execute(
+        f"""
+        SELECT {', '.join('m.' + c for c in CASINO_METRICS)}, w.balance
+        FROM (SELECT ? AS user_id) u
+        LEFT JOIN casino_user_metrics m ON m.user_id = u.user_id
+        LEFT JOIN wallets w ON w.user_id = u.user_id
+        """,
+        (int(user_id),),
+    ).fetchone()
+    metrics = {name: int(row[idx] or 0) for idx, name in enumerate(CASINO_METRICS)}
+    metrics["net_profit"] = max(0, metrics.pop("net_total"))
+    metrics["balance"] = int(row[-1] or 0)
+    return metrics
 
 
 def _ensure_casino_achievement_row(db: sqlite3.Connection, user_id: int) -> dict[str, int]:
@@ -824,11 +1864,7 @@ def _ensure_casino_achievement_row(db: sqlite3.Connection, user_id: int) -> dict
     return levels
 
 
-def casinoachievementstate(user_id: int) -> dict:
-    metrics = _casino_metrics(int(user_id))
-    with connect("casino/player") as db:
-        db.execute("ATTACH DATABASE ? AS casino_ach", (str(path("casino/achievements")),))
-        levels = _ensure_casino_achievement_row(db, int(user_id))
+def _achievementstate(metrics: dict[str, int], levels: dict[str, int]) -> dict:
     items = []
     for item in CASINO_ACHIEVEMENTS:
         key = item["key"]
@@ -851,22 +1887,30 @@ def casinoachievementstate(user_id: int) -> dict:
     return {"achievements": items}
 
 
+def casinoachievementstate(user_id: int) -> dict:
+    with connect("casino/player") as db:
+        db.execute("ATTACH DATABASE ? AS casino_ach", (str(path("casino/achievements")),))
+        metrics = _casino_metrics(db, int(user_id))
+        levels = _ensure_casino_achievement_row(db, int(user_id))
+    return _achievementstate(metrics, levels)
+
+
 def claimcasinoachievement(user_id: int, achievement_key: str) -> dict:
     key = str(achievement_key or "").strip().lower()
     target_item = next((a for a in CASINO_ACHIEVEMENTS if a["key"] == key), None)
     if not target_item:
         return {"ok": False, "error": "invalid_achievement", "state": casinoachievementstate(int(user_id))}
-    metrics = _casino_metrics(int(user_id))
     with connect("casino/player") as db:
         db.execute("ATTACH DATABASE ? AS casino_ach", (str(path("casino/achievements")),))
         db.execute("BEGIN IMMEDIATE")
+        metrics = _casino_metrics(db, int(user_id))
         levels = _ensure_casino_achievement_row(db, int(user_id))
         level = int(levels.get(key, 1))
         target = _achievement_target(int(target_item["base_target"]), level)
         progress_total = int(metrics.get(str(target_item["metric"]), 0))
         if progress_total < target:
             db.execute("ROLLBACK")
-            return {"ok": False, "error": "not_ready", "state": casinoachievementstate(int(user_id))}
+            return {"ok": False, "error": "not_ready", "state": _achievementstate(metrics, levels)}
         reward = _achievement_reward(level)
         ref = f"casino_achievement:{key}:sv{level}"
         applied = _applyledger(
@@ -879,13 +1923,15 @@ def claimcasinoachievement(user_id: int, achievement_key: str) -> dict:
         )
         if not applied:
             db.execute("ROLLBACK")
-            return {"ok": False, "error": "idempotent", "state": casinoachievementstate(int(user_id))}
+            return {"ok": False, "error": "idempotent", "state": _achievementstate(metrics, levels)}
         db.execute(
             f"UPDATE casino_ach.casino_achievement_progress SET {_achievement_column(key)} = ?, updated_at = CURRENT_TIMESTAMP WHERE user_id = ?",
             (int(level) + 1, int(user_id)),
         )
         db.execute("COMMIT")
-    return {"ok": True, "claimed_amount": int(reward), "state": casinoachievementstate(int(user_id))}
+    levels[key] = int(level) + 1
+    metrics["balance"] += int(reward)
+    return {"ok": True, "claimed_amount": int(reward), "state": _achievementstate(metrics, levels)}
 
 
 def getcasinoaction(user_id: int, game_name: str, action_name: str, idempotency_key: str):
@@ -933,62 +1979,42 @@ def _week_start(day: datetime) -> datetime:
     return (day - timedelta(days=day.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
 
 
-def _week_rewards(user_id: int, week_start_text: str) -> tuple[list[int], int]:
+@lru_cache(maxsize=8192)
+def _week_rewards(user_id: int, week_start_text: str) -> tuple[tuple[int, ...], int]:
     seed = f"{int(user_id)}:{week_start_text}"
     rng = Random(seed)
-    rewards = [rng.randint(100, 2000) for _ in range(7)]
+    rewards = tuple(rng.randint(100, 2000) for _ in range(7))
     bonus = rng.randint(1000, 3000)
     return rewards, bonus
 
 
-def _ensure_reward_row(db: sqlite3.Connection, user_id: int, week_start_text: str):
-    row = db.execute(
-        """
-        SELECT rewards_day1, rewards_day2, rewards_day3, rewards_day4, rewards_day5, rewards_day6, rewards_day7,
-               bonus_day7, claimed_days, last_claim_date, streak_count
-        FROM casino.user_daily_rewards
-        WHERE user_id = ? AND week_start_date = ?
-        """,
-        (int(user_id), week_start_text),
-    ).fetchone()
-    if row:
-        return row
-    rewards, bonus = _week_rewards(user_id, week_start_text)
-    db.execute(
-        """
-        INSERT INTO casino.user_daily_rewards (
-            user_id, week_start_date, rewards_day1, rewards_day2, rewards_day3, rewards_day4, rewards_day5, rewards_day6, rewards_day7, bonus_day7
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (int(user_id), week_start_text, rewards[0], rewards[1], rewards[2], rewards[3], rewards[4], rewards[5], rewards[6], bonus),
-    )
-    return (rewards[0], rewards[1], rewards[2], rewards[3], rewards[4], rewards[5], rewards[6], bonus, 0, "", 0)
-
-
-def dailyrewardstate(user_id: int):
+def _dailyrewardweek() -> tuple[str, str, int]:
     now = _turkey_now()
-    today_text = now.date().isoformat()
     start = _week_start(now)
-    week_start_text = start.date().isoformat()
-    day_index = (now.date() - start.date()).days + 1
-    with connect("casino/player") as db:
-        db.execute("ATTACH DATABASE ? AS casino", (str(path("casino/rewards")),))
-        row = _ensure_reward_row(db, int(user_id), week_start_text)
-        rewards = [int(row[0]), int(row[1]), int(row[2]), int(row[3]), int(row[4]), int(row[5]), int(row[6])]
-        bonus = int(row[7])
-        claimed_days = int(row[8])
-        last_claim_date = row[9] or ""
-        streak_count = int(row[10] or 0)
-        days = []
-        for i, amount in enumerate(rewards, start=1):
-            bit = 1 << (i - 1)
-            claimed = bool(claimed_days & bit)
-            state = "future"
-            if claimed:
-                state = "claimed"
-            elif i == day_index:
-                state = "today"
-            days.append({"day": i, "amount": amount, "claimed": claimed, "state": state})
+    return now.date().isoformat(), start.date().isoformat(), (now.date() - start.date()).days + 1
+
+
+def _dailyrewardclaims(db: sqlite3.Connection, user_id: int, week_start_text: str) -> tuple[int, str, int]:
+    row = db.execute(
+        "SELECT week_start_date, claimed_days, last_claim_date, streak_count FROM daily_reward_claims WHERE user_id = ?",
+        (int(user_id),),
+    ).fetchone()
+    if not row or row[0] != week_start_text:
+        return 0, "", 0
+    return int(row[1]), str(row[2] or ""), int(row[3] or 0)
+
+
+def _dailyrewardpayload(user_id: int, today_text: str, week_start_text: str, day_index: int, claimed_days: int, last_claim_date: str, streak_count: int) -> dict:
+    rewards, bonus = _week_rewards(int(user_id), week_start_text)
+    days = []
+    for i, amount in enumerate(rewards, start=1):
+        claimed = bool(claimed_days & (1 << (i - 1)))
+        state = "future"
+        if claimed:
+            state = "claimed"
+        elif i == day_index:
+            state = "today"
+        days.append({"day": i, "amount": amount, "claimed": claimed, "state": state})
     can_claim = 1 <= day_index <= 7 and not bool(claimed_days & (1 << (day_index - 1))) and last_claim_date != today_text
     return {
         "week_start_date": week_start_text,
@@ -1002,39 +2028,29 @@ def dailyrewardstate(user_id: int):
     }
 
 
+def dailyrewardstate(user_id: int):
+    today_text, week_start_text, day_index = _dailyrewardweek()
+    with connect("casino/player") as db:
+        claimed_days, last_claim_date, streak_count = _dailyrewardclaims(db, int(user_id), week_start_text)
+    return _dailyrewardpayload(int(user_id), today_text, week_start_text, day_index, claimed_days, last_claim_date, streak_count)
+
+
 def claimdailyreward(user_id: int):
-    now = _turkey_now()
-    today_text = now.date().isoformat()
-    start = _week_start(now)
-    week_start_text = start.date().isoformat()
-    day_index = (now.date() - start.date()).days + 1
+    today_text, week_start_text, day_index = _dailyrewardweek()
     if day_index < 1 or day_index > 7:
         return {"ok": False, "error": "invalid_day"}
     with connect("casino/player") as db:
-        db.execute("ATTACH DATABASE ? AS casino", (str(path("casino/rewards")),))
         db.execute("BEGIN IMMEDIATE")
-        row = _ensure_reward_row(db, int(user_id), week_start_text)
-        rewards = [int(row[0]), int(row[1]), int(row[2]), int(row[3]), int(row[4]), int(row[5]), int(row[6])]
-        bonus = int(row[7])
-        claimed_days = int(row[8])
-        last_claim_date = row[9] or ""
-        streak_count = int(row[10] or 0)
+        claimed_days, last_claim_date, streak_count = _dailyrewardclaims(db, int(user_id), week_start_text)
         bit = 1 << (day_index - 1)
         if claimed_days & bit or last_claim_date == today_text:
             db.execute("ROLLBACK")
             return {"ok": False, "error": "already_claimed"}
 
+        rewards, bonus = _week_rewards(int(user_id), week_start_text)
         amount = rewards[day_index - 1]
-        prev = today_text
-        if last_claim_date:
-            try:
-                prev = (datetime.fromisoformat(today_text) - timedelta(days=1)).date().isoformat()
-            except Exception:
-                prev = ""
-        if last_claim_date == prev:
-            streak_count = min(7, streak_count + 1)
-        else:
-            streak_count = 1
+        yesterday = (datetime.fromisoformat(today_text) - timedelta(days=1)).date().isoformat()
+        streak_count = min(7, streak_count + 1) if last_claim_date == yesterday else 1
         if day_index == 7 and streak_count >= 7:
             amount += bonus
 
@@ -1047,14 +2063,18 @@ def claimdailyreward(user_id: int):
         claimed_days |= bit
         db.execute(
             """
-            UPDATE casino.user_daily_rewards
-            SET claimed_days = ?, last_claim_date = ?, streak_count = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = ? AND week_start_date = ?
+            INSERT INTO daily_reward_claims (user_id, week_start_date, claimed_days, last_claim_date, streak_count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                week_start_date = excluded.week_start_date,
+                claimed_days = excluded.claimed_days,
+                last_claim_date = excluded.last_claim_date,
+                streak_count = excluded.streak_count
             """,
-            (claimed_days, today_text, streak_count, int(user_id), week_start_text),
+            (int(user_id), week_start_text, claimed_days, today_text, streak_count),
         )
         db.execute("COMMIT")
-    state = dailyrewardstate(int(user_id))
+    state = _dailyrewardpayload(int(user_id), today_text, week_start_text, day_index, claimed_days, today_text, streak_count)
     return {"ok": True, "claimed_amount": int(amount), "state": state}
 
 
@@ -1149,34 +2169,112 @@ def tactics_rank_set(user_id: int, rp: int, eternal_stars: int) -> None:
         )
 
 
-def arefriends(a: int, b: int) -> bool:
-    x, y = pair(a, b)
-    with connect("social") as db:
-        row = db.execute("SELECT 1 FROM friendships WHERE usera = ? AND userb = ?", (x, y)).fetchone()
-    return bool(row)
+# Per-user view of social.db: friends and blocks both ways as {user: row id}
+# so the list helpers keep their newest-first order, and pending requests in
+# and out. Every write goes through the helpers below and drops the entries
+# of both users it touched; entries also expire after SOCIAL_CACHE_TTL so a
+# second process writing the same file is picked up eventually. A load that
+# raced with a write is returned but not kept.
+SOCIAL_CACHE_USERS = 20000
+SOCIAL_CACHE_TTL = 300.0
+
 
+class SocialEntry:
+    __slots__ = ("friends", "blocking", "blockedby", "incoming", "outgoing", "loadedat")
 
-def isblocked(a: int, b: int) -> bool:
+    def __init__(self, friends: dict, blocking: dict, blockedby: set, incoming: dict, outgoing: set) -> None:
+        self.friends = friends
+        self.blocking = blocking
+        self.blockedby = blockedby
+        self.incoming = incoming
+        self.outgoing = outgoing
+        self.loadedat = time.monotonic()
+
+
+_SOCIAL: OrderedDict[int, SocialEntry] = OrderedDict()
+_SOCIAL_LOCK = threading.Lock()
+_SOCIAL_WRITES = 0
+
+
+def _loadsocial(user: int) -> SocialEntry:
     with connect("social") as db:
-        row = db.execute("SELECT 1 FROM blocks WHERE blocker = ? AND blocked = ?", (a, b)).fetchone()
-    return bool(row)
+        friends = db.execute(
+            "SELECT CASE WHEN usera = ? THEN userb ELSE usera END, id FROM friendships WHERE usera = ? OR userb = ?",
+            (user, user, user),
+        ).fetchall()
+        blocking = db.execute("SELECT blocked, id FROM blocks WHERE blocker = ?", (user,)).fetchall()
+        blockedby = db.execute("SELECT blocker FROM blocks WHERE blocked = ?", (user,)).fetchall()
+        incoming = db.execute("SELECT sender, id FROM requests WHERE receiver = ? AND status = 'pending'", (user,)).fetchall()
+        outgoing = db.execute("SELECT receiver FROM requests WHERE sender = ? AND status = 'pending'", (user,)).fetchall()
+    return SocialEntry(
+        dict(friends),
+        dict(blocking),
+        {r[0] for r in blockedby},
+        dict(incoming),
+        {r[0] for r in outgoing},
+    )
+
+
+def socialentry(user: int) -> SocialEntry:
+    user = int(user)
+    now = time.monotonic()
+    with _SOCIAL_LOCK:
+        entry = _SOCIAL.get(user)
+        if entry is not None and now - entry.loadedat < SOCIAL_CACHE_TTL:
+            _SOCIAL.move_to_end(user)
+            return entry
+        writes = _SOCIAL_WRITES
+    entry = _loadsocial(user)
+    with _SOCIAL_LOCK:
+        if writes == _SOCIAL_WRITES:
+            _SOCIAL[user] = entry
+            _SOCIAL.move_to_end(user)
+            while len(_SOCIAL) > SOCIAL_CACHE_USERS:
+                _SOCIAL.popitem(last=False)
+    return entry
+
+
+def forgetsocial(*users: int) -> None:
+    global _SOCIAL_WRITES
+    with _SOCIAL_LOCK:
+        _SOCIAL_WRITES += 1
+        for user in users:
+            _SOCIAL.pop(int(user), None)
+
+
+def relationships(user: int, others: list[int]) -> dict[int, str]:
+    # One of "blocked" (either direction), "friend", "sent", "incoming" or
+    # "none" for every id in others, from a single cached entry.
+    entry = socialentry(user)
+    out = {}
+    for other in others:
+        other = int(other)
+        if other in entry.blocking or other in entry.blockedby:
+            out[other] = "blocked"
+        elif other in entry.friends:
+            out[other] = "friend"
+        elif other in entry.outgoing:
+            out[other] = "sent"
+        elif other in entry.incoming:
+            out[other] = "incoming"
+        else:
+            out[other] = "none"
+    return out
+
+
+def arefriends(a: int, b: int) -> bool:
+    return int(b) in socialentry(a).friends
 
 
 def blockedids(blocker: int):
-    with connect("social") as db:
-        rows = db.execute("SELECT blocked FROM blocks WHERE blocker = ? ORDER BY id DESC", (blocker,)).fetchall()
-    return [r[0] for r in rows]
+    blocking = socialentry(blocker).blocking
+    return sorted(blocking, key=blocking.get, reverse=True)
 
 
 def unblockuser(blocker: int, blocked: int) -> None:
     with connect("social") as db:
         db.execute("DELETE FROM blocks WHERE blocker = ? AND blocked = ?", (blocker, blocked))
-
-
-def requeststatus(a: int, b: int) -> str:
-    with connect("social") as db:
-        row = db.execute("SELECT status FROM requests WHERE sender = ? AND receiver = ?", (a, b)).fetchone()
-    return row[0] if row else ""
+    forgetsocial(blocker, blocked)
 
 
 def sendrequest(sender: int, receiver: int) -> None:
@@ -1185,17 +2283,22 @@ def sendrequest(sender: int, receiver: int) -> None:
             "INSERT OR REPLACE INTO requests (id, sender, receiver, status) VALUES ((SELECT id FROM requests WHERE sender = ? AND receiver = ?), ?, ?, 'pending')",
             (sender, receiver, sender, receiver),
         )
+    forgetsocial(sender, receiver)
 
 
-def pendingreceived(receiver: int):
+def revokerequest(sender: int, receiver: int) -> None:
     with connect("social") as db:
-        return db.execute("SELECT id, sender FROM requests WHERE receiver = ? AND status = 'pending' ORDER BY id DESC", (receiver,)).fetchall()
+        db.execute("DELETE FROM requests WHERE sender = ? AND receiver = ? AND status = 'pending'", (sender, receiver))
+    forgetsocial(sender, receiver)
+
+
+def pendingreceived(receiver: int):
+    incoming = socialentry(receiver).incoming
+    return sorted(((rid, sender) for sender, rid in incoming.items()), reverse=True)
 
 
 def pendingsent(sender: int):
-    with connect("social") as db:
-        rows = db.execute("SELECT receiver FROM requests WHERE sender = ? AND status = 'pending'", (sender,)).fetchall()
-    return {r[0] for r in rows}
+    return set(socialentry(sender).outgoing)
 
 
 def acceptrequest(requestid: int, receiver: int) -> None:
@@ -1207,40 +2310,123 @@ def acceptrequest(requestid: int, receiver: int) -> None:
         x, y = pair(sender, receiver)
         db.execute("INSERT OR IGNORE INTO friendships (usera, userb) VALUES (?, ?)", (x, y))
         db.execute("UPDATE requests SET status = 'accepted' WHERE id = ?", (requestid,))
+        _marksuggestions(db, [sender, receiver])
+    forgetsocial(sender, receiver)
 
 
 def rejectrequest(requestid: int, receiver: int) -> None:
     with connect("social") as db:
-        db.execute("UPDATE requests SET status = 'rejected' WHERE id = ? AND receiver = ? AND status = 'pending'", (requestid, receiver))
+        row = db.execute(
+            "UPDATE requests SET status = 'rejected' WHERE id = ? AND receiver = ? AND status = 'pending' RETURNING sender",
+            (requestid, receiver),
+        ).fetchone()
+    if row:
+        forgetsocial(row[0], receiver)
 
 
 def removefriend(a: int, b: int) -> None:
     x, y = pair(a, b)
     with connect("social") as db:
+        _marksuggestions(db, [a, b])
         db.execute("DELETE FROM friendships WHERE usera = ? AND userb = ?", (x, y))
+    forgetsocial(a, b)
 
 
 def blockuser(blocker: int, blocked: int) -> None:
     x, y = pair(blocker, blocked)
     with connect("social") as db:
+        _marksuggestions(db, [blocker, blocked])
         db.execute("INSERT OR IGNORE INTO blocks (blocker, blocked) VALUES (?, ?)", (blocker, blocked))
         db.execute("DELETE FROM friendships WHERE usera = ? AND userb = ?", (x, y))
         db.execute("DELETE FROM requests WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)", (blocker, blocked, blocked, blocker))
+    forgetsocial(blocker, blocked)
 
 
 def friendids(user: int):
+    friends = socialentry(user).friends
+    return sorted(friends, key=friends.get, reverse=True)
+
+
+def friendcount(user: int) -> int:
+    return len(socialentry(user).friends)
+
+
+# Stored friend suggestions are the top rows of a ranking over mutual friends
+# and shared servers. A friendship change bumps marks for both users and all
+# of their friends, whose mutual counts moved; server joins and leaves bump
+# only the member that moved and everyone else catches up after maxage.
+def _marksuggestions(db: sqlite3.Connection, users: list[int]) -> None:
+    for user in {int(u) for u in users}:
+        db.execute(
+            """
+            INSERT INTO suggestion_state (userid, marks)
+            SELECT uid, 1 FROM (
+                SELECT ? AS uid
+                UNION SELECT CASE WHEN usera = ? THEN userb ELSE usera END FROM friendships WHERE usera = ? OR userb = ?
+            ) WHERE true
+            ON CONFLICT(userid) DO UPDATE SET marks = marks + 1
+            """,
+            (user, user, user, user),
+        )
+
+
+def marksuggestions(users: list[int]) -> None:
+    if not users:
+        return
+    with connect("social") as db:
+        db.executemany(
+            "INSERT INTO suggestion_state (userid, marks) VALUES (?, 1) ON CONFLICT(userid) DO UPDATE SET marks = marks + 1",
+            [(int(u),) for u in set(users)],
+        )
+
+
+def friendsuggestions(user: int, maxage: float):
+    # (rows, marks): rows is None when the stored list is missing or stale and
+    # marks is what savefriendsuggestions must be given back.
     with connect("social") as db:
+        state = db.execute("SELECT marks, computedmarks, computedat FROM suggestion_state WHERE userid = ?", (user,)).fetchone()
+        marks = int(state[0]) if state else 0
+        if not state or state[0] != state[1] or time.time() - float(state[2]) > maxage:
+            return None, marks
         rows = db.execute(
-            "SELECT CASE WHEN usera = ? THEN userb ELSE usera END AS fid FROM friendships WHERE usera = ? OR userb = ? ORDER BY id DESC",
-            (user, user, user),
+            "SELECT candidate, score, mutuals, servers FROM friend_suggestions WHERE userid = ? ORDER BY score DESC, candidate DESC",
+            (user,),
         ).fetchall()
-    return [r[0] for r in rows]
+    return rows, marks
 
 
-def friendcount(user: int) -> int:
+def savefriendsuggestions(user: int, rows: list[tuple[int, int, int, int]], marks: int) -> None:
     with connect("social") as db:
-        row = db.execute("SELECT COUNT(*) FROM friendships WHERE usera = ? OR userb = ?", (user, user)).fetchone()
-    return row[0]
+        db.execute("DELETE FROM friend_suggestions WHERE userid = ?", (user,))
+        db.executemany(
+            "INSERT INTO friend_suggestions (userid, candidate, score, mutuals, servers) VALUES (?, ?, ?, ?, ?)",
+            [(user, int(c), int(s), int(m), int(n)) for c, s, m, n in rows],
+        )
+        db.execute(
+            """
+            INSERT INTO suggestion_state (userid, marks, computedmarks, computedat) VALUES (?, ?, ?, ?)
+            ON CONFLICT(userid) DO UPDATE SET computedmarks = excluded.computedmarks, computedat = excluded.computedat
+            """,
+            (user, marks, marks, time.time()),
+        )
+
+
+def servercomembers(userid: int, maxmembers: int) -> dict[int, int]:
+    # Other active members of the user's servers with the number of servers
+    # shared, skipping servers bigger than maxmembers.
+    with connect("servers") as db:
+        rows = db.execute(
+            """
+            SELECT o.userid, COUNT(*)
+            FROM members m
+            JOIN members o ON o.serverid = m.serverid AND o.status = 'active' AND o.userid != m.userid
+            WHERE m.userid = ? AND m.status = 'active'
+              AND (SELECT COUNT(*) FROM members c WHERE c.serverid = m.serverid AND c.status = 'active') <= ?
+            GROUP BY o.userid
+            """,
+            (userid, maxmembers),
+        ).fetchall()
+    return {int(u): int(n) for u, n in rows}
 
 
 def conversation(a: int, b: int) -> int:
@@ -1254,6 +2440,15 @@ def conversation(a: int, b: int) -> int:
     return row2[0]
 
 
+def dmconversations(user: int) -> list[tuple[int, int]]:
+    with connect("dm") as db:
+        rows = db.execute(
+            "SELECT id, CASE WHEN usera = ? THEN userb ELSE usera END FROM conversations WHERE usera = ? OR userb = ? ORDER BY id DESC",
+            (user, user, user),
+        ).fetchall()
+    return [(int(cid), int(peer)) for cid, peer in rows]
+
+
 def dmpeers(user: int):
     with connect("dm") as db:
         rows = db.execute(
@@ -1285,7 +2480,9 @@ def addtext(convid: int, sender: int, body: str) -> None:
         db.execute("INSERT INTO items (body) VALUES (?)", (body,))
         ref = db.execute("SELECT last_insert_rowid()").fetchone()[0]
     with connect("dm") as db:
-        db.execute("INSERT INTO entries (conversationid, sender, kind, refid, readat) VALUES (?, ?, 'text', ?, '')", (convid, sender, ref))
+        cur = db.execute("INSERT INTO entries (conversationid, sender, kind, refid, readat) VALUES (?, ?, 'text', ?, '')", (convid, sender, ref))
+        entryid = cur.lastrowid
+    indexmessages([(SEARCH_DM, convid, 0, sender, entryid, body, None)])
 
 
 def addfile(convid: int, sender: int, kind: str, relpath: str, size: int) -> None:
@@ -1397,6 +2594,104 @@ def _generate_unique_joincode(db: sqlite3.Connection, preferred: str = "", exclu
     return _random_joincode(12)
 
 
+# Per-process generation of each server's roles, members and channel ACLs.
+# The write helpers below bump it and core.permissions keys its compiled
+# masks on it, so the first permission check after an edit recompiles.
+_SERVERACL: dict[int, int] = {}
+_SERVERACL_LOCK = threading.Lock()
+
+
+def touchserveracl(serverid: int) -> None:
+    with _SERVERACL_LOCK:
+        _SERVERACL[int(serverid)] = _SERVERACL.get(int(serverid), 0) + 1
+
+
+def serveraclversion(serverid: int) -> int:
+    return _SERVERACL.get(int(serverid), 0)
+
+
+def serveracl(serverid: int):
+    # Everything a permission check reads, in one connection: the server's
+    # owner and ACL strings, roles, active members and channel ACL strings.
+    with connect("servers") as db:
+        server = db.execute(
+            "SELECT ownerid, visibleperms, writeperms, shareperms, visiblemask, writemask, sharemask FROM servers WHERE id = ?",
+            (serverid,),
+        ).fetchone()
+        if not server:
+            return None
+        roles = db.execute("SELECT id, perms, slot FROM roles WHERE serverid = ?", (serverid,)).fetchall()
+        members = db.execute("SELECT userid, roleid FROM members WHERE serverid = ? AND status = 'active'", (serverid,)).fetchall()
+        channels = db.execute(
+            "SELECT id, visibleperms, writeperms, shareperms, visiblemask, writemask, sharemask FROM channels WHERE serverid = ?",
+            (serverid,),
+        ).fetchall()
+    return server, roles, members, channels
+
+
+# Channel and server ACLs are bitsets over per-server role slots, stored as
+# little-endian BLOBs next to the comma-separated role-id columns they came
+# from. NULL allows every role; slot 0 is members without a role (role id 0)
+# and every role gets the lowest free slot from 1 up when it is created.
+# The text columns are still written so older readers keep working, and a
+# row with text but no mask (written by an older build) is converted by
+# setup and read through the text meanwhile.
+ACL_COLUMNS = ("visibleperms", "writeperms", "shareperms")
+ACL_MASKS = ("visiblemask", "writemask", "sharemask")
+
+
+def aclmask(slots) -> bytes:
+    mask = 0
+    for slot in slots:
+        mask |= 1 << int(slot)
+    return mask.to_bytes(max(1, (mask.bit_length() + 7) // 8), "little")
+
+
+def aclbits(blob) -> int | None:
+    return None if blob is None else int.from_bytes(blob, "little")
+
+
+def aclroleids(text: str) -> list[int]:
+    return [int(p) for p in (text or "").split(",") if p.strip().isdigit()]
+
+
+def aclfromtext(slots: dict[int, int], text: str) -> bytes | None:
+    ids = aclroleids(text)
+    if not ids:
+        return None
+    return aclmask(slots[i] for i in ids if i in slots)
+
+
+def _roleslots(db: sqlite3.Connection, serverid: int) -> dict[int, int]:
+    rows = db.execute("SELECT id, slot FROM roles WHERE serverid = ? AND slot IS NOT NULL", (serverid,)).fetchall()
+    return {0: 0, **{int(rid): int(slot) for rid, slot in rows}}
+
+
+def _allocateroleslot(db: sqlite3.Connection, serverid: int) -> int:
+    used = {int(r[0]) for r in db.execute("SELECT slot FROM roles WHERE serverid = ? AND slot IS NOT NULL", (serverid,))}
+    slot = 1
+    while slot in used:
+        slot += 1
+    return slot
+
+
+def _migrateacls(db: sqlite3.Connection) -> None:
+    for sid, rid in db.execute("SELECT serverid, id FROM roles WHERE slot IS NULL ORDER BY id").fetchall():
+        db.execute("UPDATE roles SET slot = ? WHERE id = ?", (_allocateroleslot(db, sid), rid))
+    pending = " OR ".join(f"({text} != '' AND {mask} IS NULL)" for text, mask in zip(ACL_COLUMNS, ACL_MASKS))
+    sets = ", ".join(f"{mask} = ?" for mask in ACL_MASKS)
+    cols = ", ".join(ACL_COLUMNS)
+    slots: dict[int, dict[int, int]] = {}
+    for row in db.execute(f"SELECT id, id, {cols} FROM servers WHERE {pending}").fetchall():
+        sid = int(row[1])
+        slots.setdefault(sid, _roleslots(db, sid))
+        db.execute(f"UPDATE servers SET {sets} WHERE id = ?", (*(aclfromtext(slots[sid], text) for text in row[2:]), row[0]))
+    for row in db.execute(f"SELECT id, serverid, {cols} FROM channels WHERE {pending}").fetchall():
+        sid = int(row[1])
+        slots.setdefault(sid, _roleslots(db, sid))
+        db.execute(f"UPDATE channels SET {sets} WHERE id = ?", (*(aclfromtext(slots[sid], text) for text in row[2:]), row[0]))
+
+
 def servercreate(ownerid: int, name: str, avatar: str, visibility: str, joinmode: str, joincode: str) -> int:
     with connect("servers") as db:
         code = _generate_unique_joincode(db, preferred=joincode)
@@ -1406,6 +2701,7 @@ def servercreate(ownerid: int, name: str, avatar: str, visibility: str, joinmode
         )
         sid = db.execute("SELECT last_insert_rowid()").fetchone()[0]
         db.execute("INSERT OR IGNORE INTO members (serverid, userid, roleid, status) VALUES (?, ?, 0, 'active')", (sid, ownerid))
+    touchserveracl(sid)
     return sid
 
 
@@ -1433,10 +2729,143 @@ def serverlist(userid: int):
             "SELECT s.id, s.name, s.avatar, s.visibility FROM servers s JOIN members m ON m.serverid = s.id WHERE m.userid = ? AND m.status = 'active' ORDER BY s.id DESC",
             (userid,),
         ).fetchall()
-        publics = db.execute(
-            "SELECT id, name, avatar, visibility FROM servers WHERE visibility = 'public' ORDER BY id DESC LIMIT 50"
+    publics, _ = serverdirectory("", "members", "", 50)
+    return mine, [row[:4] for row in publics]
+
+
+# Public server discovery. servers_fts is an external-content FTS5 index over
+# servers.name and server_stats holds the active member count and the time
+# and count of channel entries; triggers keep both in step with the tables
+# they mirror, so no write path has to remember them.
+DIRECTORY_SORTS = {"members": "st.members", "active": "st.lastentryat"}
+DIRECTORY_MAX = 100
+
+
+def _serverdirectorysetup(db: sqlite3.Connection) -> None:
+    db.execute("CREATE INDEX IF NOT EXISTS idx_servers_joincode ON servers(lower(joincode))")
+    fresh = not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'servers_fts'").fetchone()
+    db.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS servers_fts USING fts5(
+            name, content='servers', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """
+    )
+    db.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_servers_fts_insert AFTER INSERT ON servers BEGIN
+            INSERT INTO servers_fts (rowid, name) VALUES (new.id, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_servers_fts_delete AFTER DELETE ON servers BEGIN
+            INSERT INTO servers_fts (servers_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            DELETE FROM server_stats WHERE serverid = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_servers_fts_update AFTER UPDATE OF name ON servers BEGIN
+            INSERT INTO servers_fts (servers_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO servers_fts (rowid, name) VALUES (new.id, new.name);
+        END;
+        """
+    )
+    if fresh:
+        db.execute("INSERT INTO servers_fts (servers_fts) VALUES ('rebuild')")
+
+    fresh = not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'server_stats'").fetchone()
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS server_stats (
+            serverid INTEGER PRIMARY KEY,
+            members INTEGER NOT NULL DEFAULT 0,
+            entries INTEGER NOT NULL DEFAULT 0,
+            lastentryat TEXT NOT NULL DEFAULT ''
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_server_stats_members ON server_stats(members, serverid)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_server_stats_active ON server_stats(lastentryat, serverid)")
+    db.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_server_stats_member_insert AFTER INSERT ON members WHEN new.status = 'active' BEGIN
+            INSERT INTO server_stats (serverid, members) VALUES (new.serverid, 1)
+            ON CONFLICT(serverid) DO UPDATE SET members = members + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_server_stats_member_delete AFTER DELETE ON members WHEN old.status = 'active' BEGIN
+            UPDATE server_stats SET members = members - 1 WHERE serverid = old.serverid;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_server_stats_member_status AFTER UPDATE OF status ON members WHEN (old.status = 'active') != (new.status = 'active') BEGIN
+            INSERT INTO server_stats (serverid, members) VALUES (new.serverid, CASE WHEN new.status = 'active' THEN 1 ELSE 0 END)
+            ON CONFLICT(serverid) DO UPDATE SET members = members + CASE WHEN new.status = 'active' THEN 1 ELSE -1 END;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_server_stats_entry AFTER INSERT ON entries BEGIN
+            INSERT INTO server_stats (serverid, entries, lastentryat) VALUES (new.serverid, 1, COALESCE(new.createdat, CURRENT_TIMESTAMP))
+            ON CONFLICT(serverid) DO UPDATE SET entries = entries + 1, lastentryat = excluded.lastentryat;
+        END;
+        """
+    )
+    if fresh:
+        db.execute(
+            """
+            INSERT INTO server_stats (serverid, members, entries, lastentryat)
+            SELECT s.id,
+                   (SELECT COUNT(*) FROM members m WHERE m.serverid = s.id AND m.status = 'active'),
+                   (SELECT COUNT(*) FROM entries e WHERE e.serverid = s.id),
+                   COALESCE((SELECT MAX(createdat) FROM entries e WHERE e.serverid = s.id), '')
+            FROM servers s
+            """
+        )
+
+
+def _ftsquery(text: str) -> str:
+    # Every word of the user's text as a quoted prefix term, all required.
+    words = [w for w in "".join(ch if ch.isalnum() else " " for ch in str(text or "")).split() if w]
+    return " ".join('"' + w.replace('"', '""') + '"*' for w in words[:8])
+
+
+def serverdirectory(query: str, sort: str, cursor: str, limit: int):
+    # Public servers as (id, name, avatar, visibility, members, lastentryat),
+    # best first by sort, plus the cursor for the next page ("" at the end).
+    # The cursor is the sort value and id of the last row handed out.
+    column = DIRECTORY_SORTS.get(sort, DIRECTORY_SORTS["members"])
+    limit = max(1, min(DIRECTORY_MAX, int(limit)))
+    where = ["s.visibility = 'public'"]
+    params: list = []
+    match = _ftsquery(query)
+    if match:
+        where.append("s.id IN (SELECT rowid FROM servers_fts WHERE servers_fts MATCH ?)")
+        params.append(match)
+    if cursor:
+        value, _, last = str(cursor).rpartition(":")
+        if last.isdigit():
+            where.append(f"({column}, s.id) < (?, ?)")
+            params.extend([int(value) if column == "st.members" and value.lstrip("-").isdigit() else value, int(last)])
+    with connect("servers") as db:
+        rows = db.execute(
+            f"""
+            SELECT s.id, s.name, s.avatar, s.visibility, COALESCE(st.members, 0), COALESCE(st.lastentryat, '')
+            FROM servers s JOIN server_stats st ON st.serverid = s.id
+            WHERE {" AND ".join(where)}
+            ORDER BY {column} DESC, s.id DESC
+            LIMIT ?
+            """,
+            (*params, limit + 1),
         ).fetchall()
-    return mine, publics
+    more = len(rows) > limit
+    rows = rows[:limit]
+    nextcursor = ""
+    if more:
+        last = rows[-1]
+        nextcursor = f"{last[4] if column == 'st.members' else last[5]}:{last[0]}"
+    return rows, nextcursor
+
+
+def serverbyjoincode(code: str):
+    code = str(code or "").strip()
+    if not code:
+        return None
+    with connect("servers") as db:
+        return db.execute(
+            "SELECT id, ownerid, name, avatar, visibility, joinmode, joincode, visibleperms, writeperms, shareperms FROM servers WHERE lower(joincode) = lower(?)",
+            (code,),
+        ).fetchone()
 
 
 def serverismember(serverid: int, userid: int) -> bool:
@@ -1455,7 +2884,14 @@ def serverjoinrequest(serverid: int, userid: int) -> None:
 
 def serverjoin(serverid: int, userid: int) -> None:
     with connect("servers") as db:
-        db.execute("INSERT OR REPLACE INTO members (id, serverid, userid, roleid, status) VALUES ((SELECT id FROM members WHERE serverid = ? AND userid = ?), ?, ?, 0, 'active')", (serverid, userid, serverid, userid))
+        # An upsert, not INSERT OR REPLACE: the replace delete would skip the
+        # server_stats member trigger.
+        db.execute(
+            "INSERT INTO members (serverid, userid, roleid, status) VALUES (?, ?, 0, 'active') ON CONFLICT(serverid, userid) DO UPDATE SET roleid = 0, status = 'active'",
+            (serverid, userid),
+        )
+    touchserveracl(serverid)
+    marksuggestions([userid])
 
 
 def serverpending(serverid: int):
@@ -1473,6 +2909,8 @@ def serveraccept(joinid: int, ownerid: int) -> None:
             return
         db.execute("UPDATE joins SET status = 'accepted' WHERE id = ?", (joinid,))
         db.execute("INSERT OR IGNORE INTO members (serverid, userid, roleid, status) VALUES (?, ?, 0, 'active')", (row[0], row[1]))
+    touchserveracl(row[0])
+    marksuggestions([row[1]])
 
 
 def serverreject(joinid: int, ownerid: int) -> None:
@@ -1490,13 +2928,19 @@ def serverroles(serverid: int):
 
 def servercreaterole(serverid: int, name: str, perms: str) -> int:
     with connect("servers") as db:
-        db.execute("INSERT INTO roles (serverid, name, perms) VALUES (?, ?, ?)", (serverid, name, perms))
-        return db.execute("SELECT last_insert_rowid()").fetchone()[0]
+        db.execute(
+            "INSERT INTO roles (serverid, name, perms, slot) VALUES (?, ?, ?, ?)",
+            (serverid, name, perms, _allocateroleslot(db, serverid)),
+        )
+        roleid = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+    touchserveracl(serverid)
+    return roleid
 
 
 def serverupdaterole(roleid: int, serverid: int, name: str, perms: str) -> None:
     with connect("servers") as db:
         db.execute("UPDATE roles SET name = ?, perms = ? WHERE id = ? AND serverid = ?", (name, perms, roleid, serverid))
+    touchserveracl(serverid)
 
 
 def servermembers(serverid: int):
@@ -1507,6 +2951,7 @@ def servermembers(serverid: int):
 def serverassignrole(serverid: int, userid: int, roleid: int) -> None:
     with connect("servers") as db:
         db.execute("UPDATE members SET roleid = ? WHERE serverid = ? AND userid = ?", (roleid, serverid, userid))
+    touchserveracl(serverid)
 
 
 def servermemberrole(serverid: int, userid: int) -> int:
@@ -1541,19 +2986,26 @@ def serverchannels(serverid: int):
 
 def servercreatechannel(serverid: int, categoryid: int, name: str, kind: str, contentmode: str, visibleperms: str, writeperms: str, shareperms: str) -> int:
     with connect("servers") as db:
+        slots = _roleslots(db, serverid)
+        masks = [aclfromtext(slots, text) for text in (visibleperms, writeperms, shareperms)]
         db.execute(
-            "INSERT INTO channels (serverid, categoryid, name, kind, contentmode, visibleperms, writeperms, shareperms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (serverid, categoryid, name, kind, contentmode, visibleperms, writeperms, shareperms),
+            "INSERT INTO channels (serverid, categoryid, name, kind, contentmode, visibleperms, writeperms, shareperms, visiblemask, writemask, sharemask) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (serverid, categoryid, name, kind, contentmode, visibleperms, writeperms, shareperms, *masks),
         )
-        return db.execute("SELECT last_insert_rowid()").fetchone()[0]
+        channelid = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+    touchserveracl(serverid)
+    return channelid
 
 
 def serverupdatechannel(serverid: int, channelid: int, categoryid: int, name: str, kind: str, contentmode: str, visibleperms: str, writeperms: str, shareperms: str) -> None:
     with connect("servers") as db:
+        slots = _roleslots(db, serverid)
+        masks = [aclfromtext(slots, text) for text in (visibleperms, writeperms, shareperms)]
         db.execute(
-            "UPDATE channels SET categoryid = ?, name = ?, kind = ?, contentmode = ?, visibleperms = ?, writeperms = ?, shareperms = ? WHERE id = ? AND serverid = ?",
-            (categoryid, name, kind, contentmode, visibleperms, writeperms, shareperms, channelid, serverid),
+            "UPDATE channels SET categoryid = ?, name = ?, kind = ?, contentmode = ?, visibleperms = ?, writeperms = ?, shareperms = ?, visiblemask = ?, writemask = ?, sharemask = ? WHERE id = ? AND serverid = ?",
+            (categoryid, name, kind, contentmode, visibleperms, writeperms, shareperms, *masks, channelid, serverid),
         )
+    touchserveracl(serverid)
 
 
 def serverchannel(serverid: int, channelid: int):
@@ -1574,10 +3026,129 @@ def serverentries(serverid: int, channelid: int, limit: int = 200):
 
 def addserverentry(serverid: int, channelid: int, sender: int, kind: str, body: str, path: str, size: int) -> None:
     with connect("servers") as db:
-        db.execute(
+        cur = db.execute(
             "INSERT INTO entries (serverid, channelid, sender, kind, body, path, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
             (serverid, channelid, sender, kind, body, path, size),
         )
+        entryid = cur.lastrowid
+    if kind == "text" and body:
+        indexmessages([(SEARCH_CHANNEL, serverid, channelid, sender, entryid, body, None)])
+
+
+def memberserverids(userid: int) -> list[int]:
+    with connect("servers") as db:
+        rows = db.execute("SELECT serverid FROM members WHERE userid = ? AND status = 'active'", (userid,)).fetchall()
+    return [int(r[0]) for r in rows]
+
+
+# Message search lives in its own search.db: search_docs says where each
+# message is (a DM conversation, or a server and channel) and search_fts
+# holds its text under the same rowid. New messages are indexed right after
+# they are stored; a failed index write only leaves the message out until
+# tools/search_rebuild.py, which walks both histories from the watermark in
+# search_state, picks it up. Callers pass the conversations and channels the
+# reader may see, so filtering happens in the same query as ranking.
+SEARCH_DM = "dm"
+SEARCH_CHANNEL = "channel"
+SEARCH_MAX_RESULTS = 50
+SEARCH_MARK = ("\x02", "\x03")
+
+
+def _indexmessages(db: sqlite3.Connection, rows) -> int:
+    added = 0
+    for kind, scopeid, channelid, sender, entryid, body, createdat in rows:
+        cur = db.execute(
+            "INSERT OR IGNORE INTO search_docs (kind, scopeid, channelid, sender, entryid, createdat) VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+            (kind, int(scopeid), int(channelid), int(sender), int(entryid), createdat),
+        )
+        if cur.rowcount:
+            db.execute("INSERT INTO search_fts (rowid, body) VALUES (?, ?)", (cur.lastrowid, body))
+            added += 1
+    return added
+
+
+def indexmessages(rows) -> int:
+    # rows are (kind, scope id, channel id, sender, entry id, body, createdat)
+    # with createdat None for now.
+    try:
+        with connect("search") as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                added = _indexmessages(db, rows)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+    except sqlite3.OperationalError:
+        return 0
+    return added
+
+
+def searchwatermark(kind: str) -> int:
+    with connect("search") as db:
+        row = db.execute("SELECT lastid FROM search_state WHERE kind = ?", (kind,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def indexmessagebatch(kind: str, rows, lastid: int) -> int:
+    # One rebuild batch and its watermark in a single short write transaction.
+    with connect("search") as db:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            added = _indexmessages(db, rows)
+            db.execute(
+                "INSERT INTO search_state (kind, lastid) VALUES (?, ?) ON CONFLICT(kind) DO UPDATE SET lastid = MAX(lastid, excluded.lastid)",
+                (kind, int(lastid)),
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return added
+
+
+def unindexmessages(kind: str, scopeid: int, channelid: int | None = None) -> None:
+    where = "kind = ? AND scopeid = ?" + ("" if channelid is None else " AND channelid = ?")
+    params = (kind, int(scopeid)) + (() if channelid is None else (int(channelid),))
+    with connect("search") as db:
+        db.execute(f"DELETE FROM search_fts WHERE rowid IN (SELECT id FROM search_docs WHERE {where})", params)
+        db.execute(f"DELETE FROM search_docs WHERE {where}", params)
+
+
+def searchmessages(query: str, conversations: list[int], channels: list[int], limit: int, page: int):
+    # Best matches first as (kind, scope id, channel id, sender, entry id,
+    # createdat, snippet) among the given DM conversations and channels, plus
+    # whether another page follows. Pages are counted in the clamped page size.
+    # Matches in the snippet are wrapped in SEARCH_MARK.
+    match = _ftsquery(query)
+    if not match or not (conversations or channels):
+        return [], False
+    limit = max(1, min(SEARCH_MAX_RESULTS, int(limit)))
+    with connect("search") as db:
+        rows = db.execute(
+            """
+            SELECT d.kind, d.scopeid, d.channelid, d.sender, d.entryid, d.createdat,
+                   snippet(search_fts, 0, ?, ?, '…', 12)
+            FROM search_fts f JOIN search_docs d ON d.id = f.rowid
+            WHERE search_fts MATCH ?
+              AND ((d.kind = ? AND d.scopeid IN (SELECT value FROM json_each(?)))
+                OR (d.kind = ? AND d.channelid IN (SELECT value FROM json_each(?))))
+            ORDER BY f.rank, d.id DESC
+            LIMIT ? OFFSET ?
+            """,
+            (
+                SEARCH_MARK[0],
+                SEARCH_MARK[1],
+                match,
+                SEARCH_DM,
+                json.dumps([int(c) for c in conversations]),
+                SEARCH_CHANNEL,
+                json.dumps([int(c) for c in channels]),
+                limit + 1,
+                max(0, int(page)) * limit,
+            ),
+        ).fetchall()
+    return rows[:limit], len(rows) > limit
 
 
 def voiceping(serverid: int, channelid: int, userid: int, when: str) -> None:
@@ -1,4 +1,6 @@
-from core.database import applyledger, syncwallet, walletbalance
+import threading
+
+from core.database import applyledger, applyledgermany, hasledgerentry, syncwallet, walletbalance
 
 
 INITIAL_GRANT_GOLD = 1000
@@ -9,9 +11,48 @@ TX_PURCHASE = "purchase"
 TX_ADJUSTMENT = "adjustment"
 
 
+# Users whose signup grant is known to be in the ledger. Ledger rows are
+# immutable, so once seen a user never needs the write transaction again; the
+# set is per process and warms through the indexed read below.
+_INITIALIZED: set[int] = set()
+_INITIALIZED_LOCK = threading.Lock()
+
+
+def _mark_initialized(user_id: int) -> None:
+    with _INITIALIZED_LOCK:
+        _INITIALIZED.add(int(user_id))
+
+
 def initialize_user_economy(user_id: int, reference_id: str | None = None) -> bool:
-    ref = reference_id or f"signup:{int(user_id)}:initial_grant"
-    return applyledger(int(user_id), INITIAL_GRANT_GOLD, TX_INITIAL_GRANT, "signup bonus", ref)
+    uid = int(user_id)
+    if reference_id:
+        return applyledger(uid, INITIAL_GRANT_GOLD, TX_INITIAL_GRANT, "signup bonus", reference_id)
+    if uid in _INITIALIZED:
+        return False
+    ref = f"signup:{uid}:initial_grant"
+    if hasledgerentry(uid, TX_INITIAL_GRANT, ref):
+        _mark_initialized(uid)
+        return False
+    applied = applyledger(uid, INITIAL_GRANT_GOLD, TX_INITIAL_GRANT, "signup bonus", ref)
+    _mark_initialized(uid)
+    return applied
+
+
+def grant_many(rows: list[tuple[int, int, str, str, str | None]], initialize: bool = True) -> tuple[list[int], list[int]]:
+    # rows are (user_id, amount, tx_type, description, reference_id). With
+    # initialize, every user's signup grant rides in the same batch. Returns
+    # the indices of rows that were applied and of rows already in the ledger.
+    seed = []
+    if initialize:
+        for uid in dict.fromkeys(int(r[0]) for r in rows):
+            seed.append((uid, INITIAL_GRANT_GOLD, TX_INITIAL_GRANT, "signup bonus", f"signup:{uid}:initial_grant"))
+    flags = applyledgermany(seed + list(rows))
+    for row in seed:
+        _mark_initialized(row[0])
+    flags = flags[len(seed):]
+    applied = [i for i, ok in enumerate(flags) if ok]
+    skipped = [i for i, ok in enumerate(flags) if not ok]
+    return applied, skipped
 
 
 def get_balance(user_id: int) -> int:
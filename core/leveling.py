@@ -1,4 +1,6 @@
-from core.database import applyxp, ensurelevel, levelstate
+from bisect import bisect_right
+
+from core.database import applyxp, applyxpmany, levelstate, levelstates
 
 
 MAX_LEVEL = 100
@@ -13,14 +15,31 @@ def required_xp(level: int) -> int:
     return BASE_XP + (lv - 1) * STEP_XP
 
 
+# LEVEL_FLOOR[n] is the total xp needed to reach level n + 1, so the level for
+# a total is the number of floors at or below it.
+LEVEL_FLOOR = tuple(sum(required_xp(lv) for lv in range(1, n + 1)) for n in range(MAX_LEVEL))
+
+
+def resolve_level(total_xp: int) -> tuple[int, int]:
+    total = max(0, int(total_xp))
+    level = bisect_right(LEVEL_FLOOR, total)
+    return level, total - LEVEL_FLOOR[level - 1]
+
+
+def _level_dict(total_xp: int) -> dict:
+    level, xp = resolve_level(total_xp)
+    next_need = 0 if level >= MAX_LEVEL else required_xp(level)
+    return {"level": level, "xp": xp, "total_xp": int(total_xp), "next_level_xp": next_need}
+
+
 def get_level(user_id: int) -> dict:
-    ensurelevel(int(user_id))
     row = levelstate(int(user_id))
-    level = int(row[0]) if row else 1
-    xp = int(row[1]) if row else 0
-    total_xp = int(row[2]) if row else 0
-    next_need = 0 if level >= MAX_LEVEL else required_xp(level)
-    return {"level": level, "xp": xp, "total_xp": total_xp, "next_level_xp": next_need}
+    return _level_dict(int(row[2]) if row else 0)
+
+
+def get_levels(user_ids: list[int]) -> dict[int, dict]:
+    totals = levelstates(user_ids)
+    return {int(uid): _level_dict(totals.get(int(uid), 0)) for uid in user_ids}
 
 
 def add_xp(user_id: int, amount: int, reason: str, reference_id: str | None = None) -> dict:
@@ -29,9 +48,7 @@ def add_xp(user_id: int, amount: int, reason: str, reference_id: str | None = No
         amount=int(amount),
         reason=str(reason),
         reference_id=reference_id,
-        max_level=MAX_LEVEL,
-        base_xp=BASE_XP,
-        step_xp=STEP_XP,
+        resolve=resolve_level,
     )
     next_need = 0 if level >= MAX_LEVEL else required_xp(level)
     return {
@@ -41,3 +58,10 @@ def add_xp(user_id: int, amount: int, reason: str, reference_id: str | None = No
         "total_xp": int(total_xp),
         "next_level_xp": int(next_need),
     }
+
+
+def add_xp_many(grants: list[tuple[int, int, str, str | None]]) -> dict[int, dict]:
+    # grants are (user_id, amount, reason, reference_id), applied in one
+    # transaction. Returns the new level state of every user that gained xp.
+    changed = applyxpmany([(int(u), int(a), str(r), ref) for u, a, r, ref in grants], resolve_level)
+    return {uid: _level_dict(total_xp) for uid, (_, _, total_xp) in changed.items()}
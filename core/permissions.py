@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from core.database import aclbits, aclroleids, serveracl, serveraclversion
+
+
+SERVER_PERMS = (
+    "invitelink",
+    "managechannels",
+    "deleteothers",
+    "kick",
+    "ban",
+    "timeout",
+    "voiceban",
+    "voicetimeout",
+    "unkick",
+    "unban",
+    "untimeout",
+    "manageroles",
+)
+SERVER_BITS = {key: 1 << i for i, key in enumerate(SERVER_PERMS)}
+SERVER_ALL = (1 << len(SERVER_PERMS)) - 1
+
+CHANNEL_VIEW = 1
+CHANNEL_WRITE = 2
+CHANNEL_SHARE = 4
+CHANNEL_ALL = CHANNEL_VIEW | CHANNEL_WRITE | CHANNEL_SHARE
+CHANNEL_MODES = {"view": CHANNEL_VIEW, "write": CHANNEL_WRITE, "share": CHANNEL_SHARE}
+
+PERMISSION_CACHE_SERVERS = 512
+# Edits in this process recompile through serveraclversion at once; the TTL
+# only bounds how long another process's edits can go unseen.
+PERMISSION_CACHE_TTL = 30.0
+
+
+def _aclbits(mask, text: str, slots: dict[int, int]) -> int | None:
+    # None allows every role. Rows without a mask yet are read from the text.
+    if mask is not None:
+        return aclbits(mask)
+    ids = aclroleids(text)
+    if not ids:
+        return None
+    bits = 0
+    for rid in ids:
+        if rid in slots:
+            bits |= 1 << slots[rid]
+    return bits
+
+
+def _rolemask(perms: str) -> int:
+    try:
+        data = json.loads(perms or "{}")
+    except Exception:
+        data = {}
+    mask = 0
+    for key, bit in SERVER_BITS.items():
+        if data.get(key):
+            mask |= bit
+    return mask
+
+
+class CompiledServer:
+    def __init__(self, serverid: int, version: int, acl) -> None:
+        server, roles, members, channels = acl
+        self.serverid = serverid
+        self.version = version
+        self.loadedat = time.monotonic()
+        self.ownerid = int(server[0])
+        self.members = {int(uid): int(rid) for uid, rid in members}
+        self.roles = {int(rid): _rolemask(perms) for rid, perms, _ in roles}
+        self.slots = {0: 0, **{int(rid): int(slot) for rid, _, slot in roles if slot is not None}}
+        self._server = tuple(_aclbits(mask, text, self.slots) for text, mask in zip(server[1:4], server[4:7]))
+        self._channels = {int(row[0]): tuple(_aclbits(mask, text, self.slots) for text, mask in zip(row[1:4], row[4:7])) for row in channels}
+        self._access: dict[int, dict[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def access(self, roleid: int) -> dict[int, int]:
+        # {channel id: CHANNEL_* mask} for one role, built on first use. A
+        # role without a slot only passes ACLs that allow every role.
+        masks = self._access.get(roleid)
+        if masks is None:
+            slot = self.slots.get(roleid)
+            bit = 0 if slot is None else 1 << slot
+
+            def allows(bits: int | None) -> bool:
+                return bits is None or bool(bits & bit)
+
+            svis, swri, ssha = self._server
+            server = (allows(svis), allows(swri), allows(ssha))
+            masks = {}
+            for cid, (cvis, cwri, csha) in self._channels.items():
+                if not (server[0] and allows(cvis)):
+                    masks[cid] = 0
+                    continue
+                masks[cid] = CHANNEL_VIEW | (CHANNEL_WRITE if server[1] and allows(cwri) else 0) | (CHANNEL_SHARE if server[2] and allows(csha) else 0)
+            with self._lock:
+                self._access[roleid] = masks
+        return masks
+
+    def has_channel(self, channelid: int) -> bool:
+        return int(channelid) in self._channels
+
+    def server_mask(self, userid: int) -> int:
+        if int(userid) == self.ownerid:
+            return SERVER_ALL
+        roleid = self.members.get(int(userid))
+        if roleid is None:
+            return 0
+        return self.roles.get(roleid, 0)
+
+    def channel_masks(self, userid: int) -> dict[int, int]:
+        if int(userid) == self.ownerid:
+            return dict.fromkeys(self._channels, CHANNEL_ALL)
+        roleid = self.members.get(int(userid))
+        if roleid is None:
+            return dict.fromkeys(self._channels, 0)
+        return self.access(roleid)
+
+
+_CACHE: OrderedDict[int, CompiledServer] = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def forget(serverid: int) -> None:
+    with _CACHE_LOCK:
+        _CACHE.pop(int(serverid), None)
+
+
+def compiled(serverid: int) -> CompiledServer | None:
+    sid = int(serverid)
+    version = serveraclversion(sid)
+    with _CACHE_LOCK:
+        entry = _CACHE.get(sid)
+        if entry is not None and entry.version == version and time.monotonic() - entry.loadedat < PERMISSION_CACHE_TTL:
+            _CACHE.move_to_end(sid)
+            return entry
+    acl = serveracl(sid)
+    if acl is None:
+        forget(sid)
+        return None
+    entry = CompiledServer(sid, version, acl)
+    with _CACHE_LOCK:
+        _CACHE[sid] = entry
+        _CACHE.move_to_end(sid)
+        while len(_CACHE) > PERMISSION_CACHE_SERVERS:
+            _CACHE.popitem(last=False)
+    return entry
+
+
+def _compiled_with(serverid: int, channelid: int) -> CompiledServer | None:
+    # A channel created by another process is not in a cached compile yet.
+    entry = compiled(serverid)
+    if entry is not None and not entry.has_channel(channelid):
+        forget(serverid)
+        entry = compiled(serverid)
+    return entry
+
+
+def has_server_perm(serverid: int, userid: int, key: str) -> bool:
+    entry = compiled(serverid)
+    return bool(entry and entry.server_mask(userid) & SERVER_BITS.get(key, 0))
+
+
+def channel_mask(serverid: int, channelid: int, userid: int) -> int:
+    entry = _compiled_with(serverid, channelid)
+    if entry is None:
+        return 0
+    return entry.channel_masks(userid).get(int(channelid), 0)
+
+
+def channel_masks(serverid: int, userid: int) -> dict[int, int]:
+    entry = compiled(serverid)
+    return entry.channel_masks(userid) if entry else {}
+
+
+def visible_channels(serverid: int, userid: int, channels: list) -> list:
+    # Channel rows (id first) the user can view, from one compiled lookup.
+    entry = compiled(serverid)
+    if entry is not None and any(not entry.has_channel(row[0]) for row in channels):
+        forget(serverid)
+        entry = compiled(serverid)
+    if entry is None:
+        return []
+    masks = entry.channel_masks(userid)
+    return [row for row in channels if masks.get(int(row[0]), 0) & CHANNEL_VIEW]
+
+
+def role_access(serverid: int, roleids: list[int]) -> dict[int, dict[int, int]]:
+    # {role id: {channel id: CHANNEL_* mask}} for many roles at once.
+    entry = compiled(serverid)
+    if entry is None:
+        return {int(rid): {} for rid in roleids}
+    return {int(rid): entry.access(int(rid)) for rid in roleids}
@@ -1,4 +1,5 @@
 import copy
+import html
 import json
 import random
 import shutil
@@ -20,7 +21,10 @@ from core.config import load
 from core.casino.blackjack import MANAGER as BLACKJACK
 from core.casino.multiplier import MANAGER as MULTIPLIER
 from core.casino.roulette import MANAGER as ROULETTE
-from core.casino.cs2case import MANAGER as CS2CASE
+from core.casino.roulette_table import STAKE_STALE_SECONDS as ROULETTE_STAKE_STALE_SECONDS, TABLES as ROULETTE_TABLES
+from core.casino.rng import SEED_MAX_AGE_SECONDS, SEEDS, verify_seed
+from core.casino.cs2case import CATALOG_JSON, CATALOG_VERSION, MANAGER as CS2CASE
+from core.casino.state import backend_from_name, use_backend
 from core.database import (
     acceptdmrequest,
     acceptrequest,
@@ -29,29 +33,30 @@ from core.database import (
     accountsbasic,
     addfile,
     addtext,
-    allaccounts,
     arefriends,
     blockedids,
     blockuser,
     conversation,
     createaccount,
     connect,
+    dmconversations,
     dmhistory,
     dmpermission,
     dmpeers,
     friendcount,
     friendids,
     heartbeat,
-    isblocked,
     latestentryid,
     markread,
+    memberserverids,
+    marksuggestions,
     pendingdmreceived,
     pendingreceived,
-    pendingsent,
     rejectrequest,
     rejectdmrequest,
+    relationships,
     removefriend,
-    requeststatus,
+    revokerequest,
     savevisitor,
     senddmrequest,
     sendvoicesignal,
@@ -60,7 +65,9 @@ from core.database import (
     serverbyid,
     servercategories,
     serverchannel,
+    serverbyjoincode,
     serverchannels,
+    serverdirectory,
     servercreate,
     servercreatecategory,
     servercreatechannel,
@@ -70,18 +77,27 @@ from core.database import (
     serverjoin,
     serverjoinrequest,
     serverlist,
-    servermemberrole,
     servermembers,
     serverpending,
     serverroles,
     serverupdatecategory,
     serverupdatechannel,
     serverupdaterole,
+    settlecasinoround,
+    savecasinoseed,
+    casinoseed,
+    retirecasinoseed,
     serverassignrole,
     addserverentry,
     applyledger,
+    hasledgerentry,
+    clearroulettetablestakes,
+    refundroulettetablestakes,
+    roulettetablestake,
     casinosummary,
     casinoleaderboard,
+    casinorollup,
+    casinorollupusers,
     casinorichest,
     casinolastgames,
     recordcasinogame,
@@ -94,19 +110,27 @@ from core.database import (
     getvoicesignals,
     getcasinoaction,
     savecasinoaction,
+    SEARCH_CHANNEL,
+    SEARCH_DM,
+    SEARCH_MARK,
+    searchmessages,
     setup,
+    touchserveracl,
     dailyrewardstate,
     casinoachievementstate,
     unblockuser,
+    unindexmessages,
     unreadcount,
     updateavatar,
     updatepassword,
     updateusername,
 )
-from core.economy import get_balance, initialize_user_economy, spend_gold
+from core.economy import get_balance, grant_many, initialize_user_economy, spend_gold
 from core.fearofabyss_backend import register_fearofabyss_backend
 from core.abysslegacy_backend import register_abysslegacy_backend
-from core.leveling import add_xp, get_level
+from core.leveling import add_xp, get_level, resolve_level
+from core.permissions import CHANNEL_MODES, CHANNEL_VIEW, channel_mask, channel_masks, has_server_perm, visible_channels
+from core.suggestions import suggest_friends
 from core.texts import language, texts
 
 
@@ -273,25 +297,21 @@ def smallavatar(raw: str) -> str:
 
 
 def socialcards(accountid: int):
-    sent = pendingsent(accountid)
+    received = pendingreceived(accountid)
+    senders = {row[0]: row for row in accountsbasic([sid for _, sid in received])}
     pending = []
-    for rid, sid in pendingreceived(accountid):
-        user = accountbyid(sid)
+    for rid, sid in received:
+        user = senders.get(sid)
         if user:
-            pending.append({"requestid": rid, "id": user[0], "username": user[1], "avatar": smallavatar(user[3])})
+            pending.append({"requestid": rid, "id": user[0], "username": user[1], "avatar": smallavatar(user[2])})
 
+    ranked = suggest_friends(accountid, 18)
+    status = relationships(accountid, [row[0] for row in ranked])
+    ties = {uid: (mutuals, servers) for uid, mutuals, servers in ranked}
     suggestions = []
-    for uid, uname, uava, _ in allaccounts(accountid, 18):
-        if isblocked(accountid, uid) or isblocked(uid, accountid):
-            continue
-        status = "none"
-        if arefriends(accountid, uid):
-            status = "friend"
-        elif uid in sent:
-            status = "sent"
-        elif requeststatus(uid, accountid) == "pending":
-            status = "incoming"
-        suggestions.append({"id": uid, "username": uname, "avatar": smallavatar(uava), "status": status})
+    for uid, uname, uava, _ in accountsbasic([uid for uid in ties if status[uid] not in ("blocked", "friend")]):
+        mutuals, servers = ties[uid]
+        suggestions.append({"id": uid, "username": uname, "avatar": smallavatar(uava), "status": status[uid], "mutuals": mutuals, "servers": servers})
         if len(suggestions) >= 8:
             break
 
@@ -411,43 +431,12 @@ def parseids(items) -> str:
 def hasserverperm(server, userid: int, key: str) -> bool:
     if not server:
         return False
-    if int(server[1]) == int(userid):
-        return True
-    roleid = servermemberrole(int(server[0]), int(userid))
-    if roleid < 0:
-        return False
-    for rid, _, perms in serverroles(int(server[0])):
-        if int(rid) == int(roleid):
-            try:
-                data = json.loads(perms or "{}")
-            except Exception:
-                data = {}
-            return bool(data.get(key))
-    return False
-
-
-def roleinlist(roleid: int, text: str) -> bool:
-    if not text:
-        return True
-    allowed = {p for p in text.split(",") if p}
-    return str(roleid) in allowed
+    return has_server_perm(int(server[0]), int(userid), key)
 
 
 def canchannel(server, channel, userid: int, mode: str) -> bool:
-    if int(server[1]) == int(userid):
-        return True
-    if not serverismember(int(server[0]), int(userid)):
-        return False
-    roleid = servermemberrole(int(server[0]), int(userid))
-    svis, swri, ssha = server[7], server[8], server[9]
-    cvis, cwri, csha = channel[5], channel[6], channel[7]
-    if mode == "view":
-        return roleinlist(roleid, svis) and roleinlist(roleid, cvis)
-    if mode == "write":
-        return roleinlist(roleid, svis) and roleinlist(roleid, cvis) and roleinlist(roleid, swri) and roleinlist(roleid, cwri)
-    if mode == "share":
-        return roleinlist(roleid, svis) and roleinlist(roleid, cvis) and roleinlist(roleid, ssha) and roleinlist(roleid, csha)
-    return False
+    bit = CHANNEL_MODES.get(mode, 0)
+    return bool(bit and channel_mask(int(server[0]), int(channel[0]), int(userid)) & bit)
 
 
 def saveservermedia(serverid: int, channelid: int, file) -> tuple[str, int, str]:
@@ -519,6 +508,7 @@ register_abysslegacy_backend(
     connect_obj=connect,
     applyledger_obj=applyledger,
     initialize_user_economy_obj=initialize_user_economy,
+    grant_many_obj=grant_many,
     spend_gold_obj=spend_gold,
     userlanguage_obj=userlanguage,
     currentaccount_obj=currentaccount,
@@ -593,6 +583,24 @@ def casinohome():
     )
 
 
+CASINO_ADMINS: set[int] = set()
+LEADERBOARD_TTL_SECONDS = 15
+LEADERBOARD_CACHE: dict[str, tuple[float, list]] = {}
+LEADERBOARD_LOCK = Lock()
+
+
+def cachedleaderboard(name: str) -> list:
+    now = time.time()
+    with LEADERBOARD_LOCK:
+        hit = LEADERBOARD_CACHE.get(name)
+        if hit and hit[0] > now:
+            return hit[1]
+    rows = casinorichest(5) if name == "richest" else casinoleaderboard(name, 5)
+    with LEADERBOARD_LOCK:
+        LEADERBOARD_CACHE[name] = (now + LEADERBOARD_TTL_SECONDS, rows)
+    return rows
+
+
 @app.route("/api/casino/profile")
 def apicasinoprofile():
     me = currentaccount()
@@ -601,10 +609,10 @@ def apicasinoprofile():
     initialize_user_economy(me[0])
     lvl = get_level(me[0])
     wins, loses, ratio = casinosummary(me[0])
-    daily = casinoleaderboard("daily", 5)
-    weekly = casinoleaderboard("weekly", 5)
-    monthly = casinoleaderboard("monthly", 5)
-    richest = casinorichest(5)
+    daily = cachedleaderboard("daily")
+    weekly = cachedleaderboard("weekly")
+    monthly = cachedleaderboard("monthly")
+    richest = cachedleaderboard("richest")
     games = casinolastgames(me[0], 10)
     return {
         "ok": True,
@@ -639,6 +647,61 @@ def apicasinoprofile():
     }
 
 
+@app.route("/api/casino/admin/analytics")
+def apicasinoanalytics():
+    me = currentaccount()
+    if not me:
+        return {"ok": False, "error": "unauthorized"}, 401
+    if int(me[0]) not in CASINO_ADMINS:
+        return {"ok": False, "error": "forbidden"}, 403
+    try:
+        hours = max(1, min(24 * 366, int(request.args.get("hours", "24"))))
+    except ValueError:
+        return {"ok": False, "error": "invalid_window"}, 400
+    order = str(request.args.get("order", "net") or "net")
+    end = time.time()
+    start = end - hours * 3600
+    top = casinorollupusers(start, end, order, 20)
+    names = {r[0]: r[1] for r in accountsbasic([row["user_id"] for row in top])}
+    return {
+        "ok": True,
+        "hours": hours,
+        "totals": casinorollup(start, end),
+        "top_users": [{**row, "username": names.get(row["user_id"], "")} for row in top],
+    }
+
+
+@app.route("/api/casino/seed")
+def apicasinoseed():
+    return {"ok": True, "seed_hash": SEEDS.current_hash()}
+
+
+@app.route("/api/casino/seed/<seedhash>")
+def apicasinoseedreveal(seedhash):
+    if not currentaccount():
+        return {"ok": False, "error": "unauthorized"}, 401
+    seedhash = str(seedhash or "").strip().lower()
+    if seedhash == SEEDS.current_hash():
+        return {"ok": False, "error": "seed_active"}, 409
+    server_seed, revealable = casinoseed(seedhash, SEED_MAX_AGE_SECONDS)
+    if not server_seed or not verify_seed(server_seed, seedhash):
+        return {"ok": False, "error": "not_found"}, 404
+    if not revealable:
+        return {"ok": False, "error": "seed_active"}, 409
+    return {"ok": True, "seed_hash": seedhash, "server_seed": server_seed}
+
+
+@app.route("/api/casino/admin/seed/rotate", methods=["POST"])
+def apicasinoseedrotate():
+    me = currentaccount()
+    if not me:
+        return {"ok": False, "error": "unauthorized"}, 401
+    if int(me[0]) not in CASINO_ADMINS:
+        return {"ok": False, "error": "forbidden"}, 403
+    previous = SEEDS.current_hash()
+    return {"ok": True, "previous_seed_hash": previous, "seed_hash": SEEDS.rotate()}
+
+
 @app.route("/casino/blackjack")
 def casinoblackjack():
     current = userlanguage()
@@ -728,7 +791,7 @@ def casinocaseopen(caseid: str):
         return redirect(url_for("casinocasehome"))
     content = texts(current)
     initialize_user_economy(account[0])
-    return render_template(viewfile("casino/case_open.html"), caseid=caseid, **navcontext(content, current))
+    return render_template(viewfile("casino/case_open.html"), caseid=caseid, catalogversion=CATALOG_VERSION, **navcontext(content, current))
 
 
 def caseconstants(userid: int, caseid: str) -> dict:
@@ -738,6 +801,29 @@ def caseconstants(userid: int, caseid: str) -> dict:
     return base
 
 
+def casecatalogfields(userid: int, caseid: str, clientversion: str) -> dict:
+    # Clients holding the current catalog only get its version back.
+    if str(clientversion or "") == CATALOG_VERSION:
+        return {"catalog_version": CATALOG_VERSION}
+    return {"catalog_version": CATALOG_VERSION, "constants": caseconstants(userid, caseid)}
+
+
+@app.route("/api/casino/case/catalog")
+def casinocasecatalog():
+    etag = f'"{CATALOG_VERSION}"'
+    if request.args.get("v") == CATALOG_VERSION:
+        cache = "public, max-age=31536000, immutable"
+    else:
+        cache = "public, no-cache"
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        resp = Response(status=304)
+    else:
+        resp = Response(CATALOG_JSON, mimetype="application/json")
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = cache
+    return resp
+
+
 @app.route("/api/casino/case/state")
 def casinocasestate():
     me = currentaccount()
@@ -749,13 +835,30 @@ def casinocasestate():
         return {"ok": False, "error": "invalid_case"}, 400
     return {
         "ok": True,
-        "constants": caseconstants(me[0], caseid),
+        **casecatalogfields(me[0], caseid, request.args.get("catalog", "")),
         "balance": int(get_balance(me[0])),
         "history": CS2CASE.history(me[0], caseid),
         "top_wins": CS2CASE.top_wins(me[0], caseid),
     }
 
 
+@app.route("/api/casino/case/history")
+def casinocasehistory():
+    me = currentaccount()
+    if not me:
+        return {"ok": False, "error": "unauthorized"}, 401
+    caseid = str(request.args.get("case", "afet") or "afet").strip().lower()
+    if caseid not in {"afet", "kristal"}:
+        return {"ok": False, "error": "invalid_case"}, 400
+    try:
+        limit = max(1, min(100, int(request.args.get("limit", "20"))))
+        before = max(0, int(request.args.get("before", "0")))
+    except ValueError:
+        return {"ok": False, "error": "invalid_page"}, 400
+    rows = CS2CASE.history(me[0], caseid, limit, before)
+    return {"ok": True, "rows": rows, "next_before": rows[-1]["history_id"] if len(rows) == limit else 0}
+
+
 @app.route("/api/casino/case/open", methods=["POST"])
 def casinocaseopenapi():
     me = currentaccount()
@@ -794,7 +897,7 @@ def casinocaseopenapi():
     ok, data = CS2CASE.open_case(me[0], caseid, idem, settle_cs2)
     if ok and not bool(data.get("idempotent_replay")):
         state = data.get("state", {})
-        price = int(CS2CASE.constants(caseid).get("case", {}).get("price", 0))
+        price = CS2CASE.price(caseid)
         payout = int(state.get("payout", 0))
         recordcasinogame(me[0], f"case:{caseid}", payout - price)
         # XP SISTEMI
@@ -805,7 +908,7 @@ def casinocaseopenapi():
     return {
         "ok": ok,
         **data,
-        "constants": caseconstants(me[0], caseid),
+        **casecatalogfields(me[0], caseid, payload.get("catalog_version", "")),
         "balance": int(get_balance(me[0])),
         "history": CS2CASE.history(me[0], caseid),
         "top_wins": CS2CASE.top_wins(me[0], caseid),
@@ -1184,6 +1287,140 @@ def roulettesettle():
     return response
 
 
+def _roulette_table_settle(table_id: str, round_id: str, pocket: str, rows: list[dict]) -> bool:
+    ref = f"roulette_table:{table_id}:{round_id}"
+    batch = [
+        {**row, "reference_id": ref, "xp": max(5, int(row["stake"]) // 50) + max(0, int(row["payout"]) // 100)}
+        for row in rows
+    ]
+    # Errors reach TableScheduler.tick, which logs them; the round keeps its
+    # result and the batch is retried on the next tick.
+    settlecasinoround("roulette", batch, "roulette_payout", "roulette payout", "casino_roulette", resolve_level)
+    clearroulettetablestakes(table_id, round_id)
+    return True
+
+
+def _roulette_table(tableid: str):
+    me = currentaccount()
+    if not me:
+        return None, None, ({"ok": False, "error": "unauthorized"}, 401)
+    table = ROULETTE_TABLES.get(tableid)
+    if not table:
+        return me, None, ({"ok": False, "error": "unknown_table"}, 404)
+    return me, table, None
+
+
+@app.route("/api/casino/roulette/tables")
+def roulettetables():
+    me = currentaccount()
+    if not me:
+        return {"ok": False, "error": "unauthorized"}, 401
+    if not ROULETTE_TABLES.running():
+        return {"ok": False, "error": "tables_disabled"}, 404
+    return {"ok": True, "tables": [t.snapshot(me[0]) for t in ROULETTE_TABLES.tables.values()], "constants": rouletteconstants(me[0])}
+
+
+@app.route("/api/casino/roulette/table/<tableid>/state")
+def roulettetablestate(tableid: str):
+    me, table, err = _roulette_table(tableid)
+    if err:
+        return err
+    initialize_user_economy(me[0])
+    return {"ok": True, "state": table.snapshot(me[0]), "constants": rouletteconstants(me[0]), "balance": int(get_balance(me[0]))}
+
+
+@app.route("/api/casino/roulette/table/<tableid>/stream")
+def roulettetablestream(tableid: str):
+    me, table, err = _roulette_table(tableid)
+    if err:
+        return Response("", status=err[1])
+    uid = int(me[0])
+
+    def gen():
+        version = -1
+        idle = 0
+        while idle < 55:
+            current = table.wait(version, 1.0)
+            if current != version:
+                version = current
+                payload = json.dumps({"type": "state", "state": table.snapshot(uid)})
+                yield f"data: {payload}\n\n"
+                idle = 0
+            else:
+                idle += 1
+                yield "data: {\"type\":\"ping\"}\n\n"
+
+    return Response(gen(), mimetype="text/event-stream")
+
+
+@app.route("/api/casino/roulette/table/<tableid>/place", methods=["POST"])
+def roulettetableplace(tableid: str):
+    me, table, err = _roulette_table(tableid)
+    if err:
+        return err
+    payload = _jsonpayload()
+    idem = _idem_from(payload)
+    if not idem:
+        return {"ok": False, "error": "missing_idempotency"}, 400
+    bet_type = str(payload.get("bet_type", "")).strip()
+    selection = payload.get("selection", [])
+    if not isinstance(selection, list):
+        selection = []
+    try:
+        amount = int(payload.get("amount", 0) or 0)
+    except Exception:
+        amount = 0
+    round_id, _, check = table.check_bet(me[0], bet_type, selection, amount)
+    if check:
+        return {"ok": False, "error": check, "state": table.snapshot(me[0]), "balance": int(get_balance(me[0]))}, 400
+    if int(get_balance(me[0])) < amount:
+        return {"ok": False, "error": "insufficient_balance", "state": table.snapshot(me[0]), "balance": int(get_balance(me[0]))}, 400
+    debit_ref = f"roulette_table:{table.table_id}:{round_id}:place:{idem}"
+    if not roulettetablestake(me[0], -amount, "roulette_bet", "roulette bet placed", debit_ref, table.table_id, round_id):
+        # The key was already debited by an earlier request, which places
+        # (or refunds) its own bet. A replay never places one, since its
+        # amount need not match what was debited.
+        if hasledgerentry(me[0], "roulette_refund", f"{debit_ref}:refund"):
+            return {"ok": False, "error": "bet_refunded", "state": table.snapshot(me[0]), "balance": int(get_balance(me[0]))}, 409
+        return {"ok": True, "idempotent_replay": True, "state": table.snapshot(me[0]), "balance": int(get_balance(me[0]))}, 200
+    ok, data = table.place_bet(me[0], round_id, bet_type, selection, amount, idem)
+    if not ok:
+        roulettetablestake(me[0], amount, "roulette_refund", "roulette bet rejected refund", f"{debit_ref}:refund", table.table_id, round_id)
+    return {"ok": ok, **data, "balance": int(get_balance(me[0]))}, 200 if ok else 400
+
+
+def _roulette_table_take(tableid: str, action: str):
+    me, table, err = _roulette_table(tableid)
+    if err:
+        return err
+    payload = _jsonpayload()
+    idem = _idem_from(payload)
+    if not idem:
+        return {"ok": False, "error": "missing_idempotency"}, 400
+    replay = _casino_action_replay(me[0], f"roulette_table:{table.table_id}", action, idem)
+    if replay:
+        return replay
+    ok, data = table.undo(me[0]) if action == "undo" else table.clear(me[0])
+    refund = int(data.pop("refund", 0) or 0)
+    round_id = str(data.pop("round_id", "") or "")
+    if ok and refund > 0:
+        roulettetablestake(me[0], refund, "roulette_refund", f"roulette {action} refund", f"roulette_table:{table.table_id}:{round_id}:{action}:{idem}", table.table_id, round_id)
+    code = 200 if ok else 400
+    response = {"ok": ok, **data, "balance": int(get_balance(me[0]))}
+    _casino_action_store(me[0], f"roulette_table:{table.table_id}", action, idem, code, response)
+    return response, code
+
+
+@app.route("/api/casino/roulette/table/<tableid>/undo", methods=["POST"])
+def roulettetableundo(tableid: str):
+    return _roulette_table_take(tableid, "undo")
+
+
+@app.route("/api/casino/roulette/table/<tableid>/clear", methods=["POST"])
+def roulettetableclear(tableid: str):
+    return _roulette_table_take(tableid, "clear")
+
+
 def blackjacklimits(userid: int) -> dict:
     level = int(get_level(userid).get("level", 1))
     balance = int(get_balance(userid))
@@ -1765,7 +2002,7 @@ def eventstream():
 @app.route("/social/request/<int:target>", methods=["POST"])
 def socialrequest(target: int):
     me = currentaccount()
-    if me and me[0] != target and not isblocked(me[0], target) and not isblocked(target, me[0]) and not arefriends(me[0], target):
+    if me and me[0] != target and relationships(me[0], [target])[target] not in ("blocked", "friend"):
         sendrequest(me[0], target)
         emit(me[0], target)
     return redirect(url_for("home"))
@@ -1775,9 +2012,7 @@ def socialrequest(target: int):
 def socialrevoke(target: int):
     me = currentaccount()
     if me:
-        from core.database import connect
-        with connect("social") as db:
-            db.execute("DELETE FROM friend_requests WHERE senderid = ? AND receiverid = ?", (me[0], target))
+        revokerequest(me[0], target)
         emit(me[0], target)
     return redirect(url_for("home"))
 
@@ -1907,6 +2142,13 @@ def run() -> None:
     setup()
     settings = load()
     app.secret_key = settings["secret"]
+    use_backend(backend_from_name(settings["casino_state"]))
+    CASINO_ADMINS.update(settings["casino_admins"])
+    SEEDS.on_new_seed(lambda digest, seed: savecasinoseed(digest, seed.hex()))
+    SEEDS.on_retire_seed(retirecasinoseed)
+    refundroulettetablestakes(ROULETTE_STAKE_STALE_SECONDS)
+    if settings["roulette_tables"]:
+        ROULETTE_TABLES.start(_roulette_table_settle)
     app.run(host=settings["host"], port=settings["port"], debug=settings["debug"], threaded=True)
 
 
@@ -1973,13 +2215,7 @@ def servers():
             if sid.isdigit():
                 target = serverbyid(int(sid))
             elif code:
-                from core.database import connect
-
-                with connect("servers") as db:
-                    target = db.execute(
-                        "SELECT id, ownerid, name, avatar, visibility, joinmode, joincode, visibleperms, writeperms, shareperms FROM servers WHERE lower(joincode) = lower(?)",
-                        (code,),
-                    ).fetchone()
+                target = serverbyjoincode(code)
             if not target:
                 error = content.get("errorservernotfound", "Server not found")
             else:
@@ -1994,6 +2230,50 @@ def servers():
     return render_template(viewfile("servers.html"), mine=mine, publics=publics, error=error, **navcontext(content, current))
 
 
+@app.route("/api/servers/directory")
+def apiserverdirectory():
+    me = currentaccount()
+    if not me:
+        return {"ok": False, "error": "unauthorized"}, 401
+    rows, cursor = serverdirectory(
+        request.args.get("q", ""),
+        request.args.get("sort", "members"),
+        request.args.get("cursor", ""),
+        request.args.get("limit", 20, type=int),
+    )
+    servers = [{"id": r[0], "name": r[1], "avatar": smallavatar(r[2]), "members": r[4], "lastactivity": r[5]} for r in rows]
+    return {"ok": True, "servers": servers, "cursor": cursor}
+
+
+def searchsnippet(text: str) -> str:
+    return html.escape(text or "").replace(SEARCH_MARK[0], "<mark>").replace(SEARCH_MARK[1], "</mark>")
+
+
+@app.route("/api/search")
+def apisearch():
+    me = currentaccount()
+    if not me:
+        return {"ok": False, "error": "unauthorized"}, 401
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", 20, type=int)
+    page = max(0, request.args.get("page", 0, type=int))
+    peers = dict(dmconversations(me[0]))
+    channels = []
+    for sid in memberserverids(me[0]):
+        channels.extend(cid for cid, mask in channel_masks(sid, me[0]).items() if mask & CHANNEL_VIEW)
+    rows, more = searchmessages(query, list(peers), channels, limit, page)
+    results = []
+    for kind, scopeid, channelid, sender, entryid, createdat, snippet in rows:
+        item = {"kind": kind, "id": entryid, "sender": sender, "createdat": createdat, "snippet": searchsnippet(snippet)}
+        if kind == SEARCH_DM:
+            item["peer"] = peers.get(scopeid, 0)
+        else:
+            item["serverid"] = scopeid
+            item["channelid"] = channelid
+        results.append(item)
+    return {"ok": True, "results": results, "page": page, "more": more}
+
+
 # --- DAVET LİNKİ (URL) İLE SUNUCUYA KATILMA ROTASI ---
 @app.route("/join/<code>", methods=["GET", "POST"])
 def join_by_code(code: str):
@@ -2005,15 +2285,10 @@ def join_by_code(code: str):
         return redirect(url_for("login"))
     content = texts(current)
 
-    from core.database import connect
-    with connect("servers") as db:
-        target = db.execute(
-            "SELECT id, name, avatar, joinmode FROM servers WHERE lower(joincode) = lower(?)",
-            (code,),
-        ).fetchone()
-
-    if not target:
+    row = serverbyjoincode(code)
+    if not row:
         return redirect(url_for("servers"))
+    target = (row[0], row[2], row[3], row[5])
 
     if request.method == "POST":
         action = request.form.get("action", "").strip().lower()
@@ -2109,6 +2384,8 @@ def serverleave(serverid: int):
             owner = db.execute("SELECT ownerid FROM servers WHERE id = ?", (serverid,)).fetchone()
             if owner and owner[0] != me[0]:
                 db.execute("DELETE FROM members WHERE serverid = ? AND userid = ?", (serverid, me[0]))
+        touchserveracl(serverid)
+        marksuggestions([me[0]])
         emit(me[0])
         emit_server(serverid)
     return redirect(url_for("servers"))
@@ -2153,8 +2430,12 @@ def serverdelete(serverid: int):
         db.execute("DELETE FROM categories WHERE serverid = ?", (serverid,))
         db.execute("DELETE FROM roles WHERE serverid = ?", (serverid,))
         db.execute("DELETE FROM joins WHERE serverid = ?", (serverid,))
+        memberids = [r[0] for r in db.execute("SELECT userid FROM members WHERE serverid = ?", (serverid,))]
         db.execute("DELETE FROM members WHERE serverid = ?", (serverid,))
         db.execute("DELETE FROM servers WHERE id = ? AND ownerid = ?", (serverid, me[0]))
+    touchserveracl(serverid)
+    unindexmessages(SEARCH_CHANNEL, serverid)
+    marksuggestions(memberids)
 
     # Remove server media folder if present.
     shutil.rmtree(MEDIA / "servers" / str(serverid), ignore_errors=True)
@@ -2179,6 +2460,8 @@ def deletechannel(serverid: int, channelid: int):
             from core.database import connect
             with connect("servers") as db:
                 db.execute("DELETE FROM channels WHERE id = ? AND serverid = ?", (channelid, serverid))
+            touchserveracl(serverid)
+            unindexmessages(SEARCH_CHANNEL, serverid, channelid)
             emit_server(serverid)
     return redirect(url_for("serverdetail", serverid=serverid))
 
@@ -2405,7 +2688,7 @@ def channelview(serverid: int, channelid: int):
                             error = content.get("errorupload", "Upload failed")
     entries = serverentries(serverid, channelid, 300)
     cats = servercategories(serverid)
-    chans = [c for c in serverchannels(serverid) if canchannel(server, c, me[0], "view")]
+    chans = visible_channels(serverid, me[0], serverchannels(serverid))
     users = {}
     for e in entries:
         if e[1] not in users:
@@ -2451,7 +2734,7 @@ def voicechannel(serverid: int, channelid: int):
 
     roles = serverroles(serverid)
     cats = servercategories(serverid)
-    chans = [c for c in serverchannels(serverid) if canchannel(server, c, me[0], "view")]
+    chans = visible_channels(serverid, me[0], serverchannels(serverid))
 
     voiceping(serverid, channelid, me[0], nowiso())
     cutoff = (datetime.now(timezone.utc) - VOICE_WINDOW).isoformat()
@@ -0,0 +1,52 @@
+from core.database import allaccounts, friendsuggestions, savefriendsuggestions, servercomembers, socialentry
+
+
+SUGGESTION_KEEP = 24
+SUGGESTION_MAX_AGE = 6 * 3600
+MUTUAL_WEIGHT = 3
+SERVER_WEIGHT = 1
+# Servers bigger than this say little about who someone knows and would make
+# every member a candidate for everyone else.
+SERVER_MAX_MEMBERS = 500
+
+
+def rank_candidates(user_id: int) -> list[tuple[int, int, int, int]]:
+    # (candidate, score, mutuals, servers), best first. Mutual counts are the
+    # sizes of friends(user) & friends(candidate), taken from the cached
+    # adjacency of each friend.
+    uid = int(user_id)
+    me = socialentry(uid)
+    mutuals: dict[int, int] = {}
+    for fid in me.friends:
+        for other in socialentry(fid).friends:
+            mutuals[other] = mutuals.get(other, 0) + 1
+    shared = servercomembers(uid, SERVER_MAX_MEMBERS)
+
+    skip = {uid} | me.friends.keys() | me.blocking.keys() | me.blockedby
+    ranked = []
+    for cand in (mutuals.keys() | shared.keys()) - skip:
+        m = mutuals.get(cand, 0)
+        s = shared.get(cand, 0)
+        ranked.append((cand, m * MUTUAL_WEIGHT + s * SERVER_WEIGHT, m, s))
+    ranked.sort(key=lambda r: (r[1], r[0]), reverse=True)
+    return ranked
+
+
+def suggest_friends(user_id: int, limit: int) -> list[tuple[int, int, int]]:
+    # (candidate, mutuals, servers) from the stored list, recomputed when a
+    # friendship or membership change marked it stale. Users with few ties are
+    # topped up with the newest accounts so the list is never empty.
+    uid = int(user_id)
+    rows, marks = friendsuggestions(uid, SUGGESTION_MAX_AGE)
+    if rows is None:
+        rows = rank_candidates(uid)[:SUGGESTION_KEEP]
+        savefriendsuggestions(uid, rows, marks)
+    out = [(int(c), int(m), int(s)) for c, _, m, s in rows[:limit]]
+    if len(out) < limit:
+        seen = {c for c, _, _ in out}
+        for row in allaccounts(uid, limit):
+            if row[0] not in seen:
+                out.append((int(row[0]), 0, 0))
+                if len(out) >= limit:
+                    break
+    return out
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core.casino.blackjack import SHOE_DECKS, SHOE_PENETRATION, BlackjackGame  # noqa: E402
+
+
+def simulate(hands: int, decks: int, penetration: float) -> dict:
+    game = BlackjackGame(soft17_stand=True, decks=decks, penetration=penetration)
+    results: dict[str, int] = {}
+    shuffles = 0
+    exhausted = 0
+    started = time.perf_counter()
+    for _ in range(hands):
+        if game.shoe.needs_shuffle():
+            shuffles += 1
+        ok, st = game.start_round(10)
+        while ok and game.phase == "player_turn":
+            total = st["player_total"]
+            ok, st = game.hit() if total < 17 else game.stand()
+        results[game.result] = results.get(game.result, 0) + 1
+        if game.message == "deck exhausted":
+            exhausted += 1
+    elapsed = time.perf_counter() - started
+    return {"hands": hands, "seconds": elapsed, "results": results, "shuffles": shuffles, "exhausted": exhausted}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate blackjack hands against the shoe and report throughput.")
+    parser.add_argument("--hands", type=int, default=1_000_000)
+    parser.add_argument("--decks", type=int, default=SHOE_DECKS)
+    parser.add_argument("--penetration", type=float, default=SHOE_PENETRATION)
+    args = parser.parse_args()
+
+    report = simulate(args.hands, args.decks, args.penetration)
+    rate = report["hands"] / report["seconds"] if report["seconds"] else 0.0
+    print(f"hands={report['hands']} decks={args.decks} {report['seconds']:.2f}s {rate:.0f} hands/s shuffles={report['shuffles']}")
+    for name, count in sorted(report["results"].items()):
+        print(f"  {name:<10} {count:>10} {count / report['hands']:.4f}")
+    if report["exhausted"]:
+        print(f"deck exhausted in {report['exhausted']} hands")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
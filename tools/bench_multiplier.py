@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import combinations_with_replacement
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core.casino import multiplier  # noqa: E402
+
+
+# Reference: the Decimal engine the integer tables replaced.
+def ref_fmt(val: Decimal) -> str:
+    norm = val.normalize()
+    text = format(norm, "f")
+    return text.rstrip("0").rstrip(".") if "." in text else text
+
+
+def ref_payout(bet_amount: int, total: Decimal) -> int:
+    return int((Decimal(int(bet_amount)) * total).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def ref_pick(target: float) -> Decimal:
+    upto = 0.0
+    for value, weight in multiplier.MULTIPLIER_WEIGHTS:
+        upto += float(weight)
+        if target <= upto:
+            return Decimal(value)
+    return Decimal(multiplier.MULTIPLIER_WEIGHTS[-1][0])
+
+
+def check(samples: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    errors: list[str] = []
+    count = len(multiplier.MULTIPLIER_MILLI)
+    bets = [multiplier.MIN_BET, multiplier.MAX_BET, 11, 99, 333, 999]
+    for combo in combinations_with_replacement(range(count), multiplier.PICK_COUNT):
+        total_ref = sum((Decimal(multiplier.MULTIPLIER_WEIGHTS[i][0]) for i in combo), Decimal("0"))
+        total_milli = sum(multiplier.MULTIPLIER_MILLI[i] for i in combo)
+        if ref_fmt(total_ref) != multiplier._fmt_milli(total_milli):
+            errors.append(f"total label {combo}")
+        for bet in bets + [rng.randint(multiplier.MIN_BET, multiplier.MAX_BET) for _ in range(4)]:
+            if ref_payout(bet, total_ref) != multiplier._compute_payout_int(bet, total_milli):
+                errors.append(f"payout bet={bet} picks={combo}")
+    for i, (value, _) in enumerate(multiplier.MULTIPLIER_WEIGHTS):
+        if ref_fmt(Decimal(value)) != multiplier.MULTIPLIER_LABELS[i]:
+            errors.append(f"label {value}")
+
+    class Fixed:
+        target = 0.0
+
+        def random(self) -> float:
+            return self.target
+
+    fixed = Fixed()
+    saved = multiplier.RNG
+    multiplier.RNG = fixed
+    try:
+        edges = [0.0, 1.0] + [c / multiplier.MULTIPLIER_TOTAL_WEIGHT for c in multiplier.MULTIPLIER_CUMULATIVE]
+        for u in edges + [rng.random() for _ in range(samples)]:
+            fixed.target = u
+            got = multiplier.MULTIPLIER_MILLI[multiplier._weighted_pick()]
+            want = ref_pick(u * multiplier.MULTIPLIER_TOTAL_WEIGHT)
+            if Decimal(got) / 1000 != want:
+                errors.append(f"pick u={u!r}")
+    finally:
+        multiplier.RNG = saved
+    return errors
+
+
+def bench(rounds: int) -> None:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        picks = [ref_pick(multiplier.RNG.random() * multiplier.MULTIPLIER_TOTAL_WEIGHT) for _ in range(multiplier.PICK_COUNT)]
+        total = sum(picks, Decimal("0"))
+        ref_payout(100, total)
+        [ref_fmt(p) for p in picks]
+        ref_fmt(total)
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        picks = [multiplier._weighted_pick() for _ in range(multiplier.PICK_COUNT)]
+        total = sum(multiplier.MULTIPLIER_MILLI[i] for i in picks)
+        multiplier._compute_payout_int(100, total)
+        [multiplier.MULTIPLIER_LABELS[i] for i in picks]
+        multiplier._fmt_milli(total)
+    fixed = time.perf_counter() - started
+    print(f"rounds={rounds}")
+    print(f"  decimal {legacy:.3f}s {rounds / legacy:.0f} rounds/s")
+    print(f"  integer {fixed:.3f}s {rounds / fixed:.0f} rounds/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the integer multiplier engine against the Decimal reference and benchmark it.")
+    parser.add_argument("--rounds", type=int, default=200000)
+    parser.add_argument("--samples", type=int, default=200000, help="Random draws compared against the reference pick")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    if args.check:
+        errors = check(args.samples, args.seed)
+        for err in errors[:20]:
+            print(err)
+        print(f"check: {len(errors)} mismatches")
+        if errors:
+            sys.exit(1)
+    bench(args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from itertools import combinations
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core.casino import roulette  # noqa: E402
+
+LEGACY_VALIDATORS = {
+    "straight": roulette._is_valid_straight,
+    "split": roulette._is_valid_split,
+    "street": roulette._is_valid_street,
+    "corner": roulette._is_valid_corner,
+    "sixline": roulette._is_valid_sixline,
+}
+
+
+def _legacy_valid(bet_type: str, selection: list[str]) -> bool:
+    if bet_type in roulette.OUTSIDE_BETS:
+        return True
+    check = LEGACY_VALIDATORS.get(bet_type)
+    return bool(check and check(selection))
+
+
+def check_variant(variant: str) -> list[str]:
+    roulette.ROULETTE_VARIANT = variant
+    pockets = roulette.wheel_pockets()
+    tokens = pockets + ["37", "-1", "x", "01"]
+    table = roulette.resolution_table()
+    errors: list[str] = []
+    seen: set[str] = set()
+    for bet_type, size in roulette.INSIDE_BETS.items():
+        for combo in combinations(tokens if size < 6 else pockets, size):
+            selection = list(combo)
+            legacy = _legacy_valid(bet_type, selection)
+            key = roulette.bet_key(bet_type, selection)
+            if legacy != (key in table):
+                errors.append(f"{variant} validity {bet_type} {selection}: legacy={legacy}")
+                continue
+            if not legacy:
+                continue
+            seen.add(key)
+            normalized = [roulette._normalize_num(s) for s in selection]
+            for pocket in pockets:
+                expected = roulette._ratio(bet_type) + 1 if roulette._wins(bet_type, normalized, pocket) else 0
+                if roulette.bet_payout(key, 1, pocket) != expected:
+                    errors.append(f"{variant} payout {key} pocket={pocket}")
+    for bet_type in roulette.OUTSIDE_BETS:
+        seen.add(bet_type)
+        for pocket in pockets:
+            expected = roulette._ratio(bet_type) + 1 if roulette._wins(bet_type, [], pocket) else 0
+            if roulette.bet_payout(bet_type, 1, pocket) != expected:
+                errors.append(f"{variant} payout {bet_type} pocket={pocket}")
+    if seen != set(table):
+        errors.append(f"{variant} table has {len(table)} keys, legacy accepts {len(seen)}")
+    return errors
+
+
+def _random_bets(chips: int) -> list[tuple[str, list[str], str, int]]:
+    keys = list(roulette.resolution_table())
+    out = []
+    for _ in range(chips):
+        key = random.choice(keys)
+        bet_type, _, rest = key.partition(":")
+        out.append((bet_type, rest.split(",") if rest else [], key, random.choice(roulette.CHIPS)))
+    return out
+
+
+def bench(rounds: int, chips: int) -> None:
+    pockets = roulette.wheel_pockets()
+    bets = _random_bets(chips)
+    results = [random.choice(pockets) for _ in range(rounds)]
+
+    started = time.perf_counter()
+    legacy_total = 0
+    for pocket in results:
+        placed = [(t, sel, amount) for t, sel, _, amount in bets if _legacy_valid(t, sel)]
+        for bet_type, selection, amount in placed:
+            if roulette._wins(bet_type, selection, pocket):
+                legacy_total += amount * (roulette._ratio(bet_type) + 1)
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    table_total = 0
+    for pocket in results:
+        placed = [(roulette.bet_key(t, sel), amount) for t, sel, _, amount in bets]
+        table_total += roulette.settle_bets(placed, pocket)
+    table = time.perf_counter() - started
+
+    started = time.perf_counter()
+    placed = [(key, amount) for _, _, key, amount in bets]
+    for pocket in results:
+        roulette.settle_bets(placed, pocket)
+    settle_only = time.perf_counter() - started
+
+    print(f"variant={roulette.ROULETTE_VARIANT} rounds={rounds} chips={chips}")
+    print(f"  legacy {legacy:.3f}s {rounds / legacy:.0f} rounds/s payout={legacy_total}")
+    print(f"  table  {table:.3f}s {rounds / table:.0f} rounds/s payout={table_total}")
+    print(f"  settle {settle_only:.3f}s {rounds / settle_only:.0f} rounds/s (stored keys)")
+    if legacy_total != table_total:
+        print("payout mismatch")
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark roulette validation/settlement and check the resolution tables.")
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--chips", type=int, default=300, help="Bets per round")
+    parser.add_argument("--variant", choices=["EU", "US"], default="EU")
+    parser.add_argument("--check", action="store_true", help="Exhaustively compare the tables with the legacy predicates")
+    args = parser.parse_args()
+
+    if args.check:
+        errors = check_variant("EU") + check_variant("US")
+        for err in errors[:20]:
+            print(err)
+        print(f"check: {len(errors)} mismatches")
+        if errors:
+            sys.exit(1)
+    roulette.ROULETTE_VARIANT = args.variant
+    bench(args.rounds, args.chips)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core import database  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild casino_user_metrics from the casino_games history.")
+    parser.add_argument("--user", type=int, default=0, help="Only rebuild this user id")
+    args = parser.parse_args()
+
+    database.setup()
+    count = database.rebuildcasinometrics(args.user or None)
+    print(f"rebuilt metrics for {count} users")
+
+
+if __name__ == "__main__":
+    main()
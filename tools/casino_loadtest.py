@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core import database  # noqa: E402
+
+
+# Drives the casino endpoints through the Flask test client against a fresh
+# database root, one thread per synthetic account. --seed fixes the bet mix
+# (not the game outcomes), so two runs issue the same request sequence and
+# branches can be compared on the printed numbers or the --json report.
+
+GRANT = 10_000_000
+FLOWS = ("multiplier", "case", "blackjack", "roulette", "profile")
+
+
+def _busy(exc: BaseException) -> bool:
+    text = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in text or "busy" in text)
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latency: dict[str, list[float]] = {}
+        self.status: dict[str, dict[int, int]] = {}
+        self.errors: dict[str, int] = {}
+        self.busy = 0
+        self.failures: list[str] = []
+
+    def add(self, name: str, seconds: float, code: int, error: str = "") -> None:
+        with self._lock:
+            self.latency.setdefault(name, []).append(seconds)
+            codes = self.status.setdefault(name, {})
+            codes[code] = codes.get(code, 0) + 1
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def fail(self, message: str, busy: bool = False) -> None:
+        with self._lock:
+            self.failures.append(message)
+            self.busy += int(busy)
+
+
+class Player:
+    def __init__(self, client, uid: int, rec: Recorder, rng: random.Random) -> None:
+        self.client = client
+        self.uid = uid
+        self.rec = rec
+        self.rng = rng
+        self.n = 0
+        with client.session_transaction() as sess:
+            sess["accountid"] = uid
+
+    def _idem(self) -> str:
+        self.n += 1
+        return f"load:{self.uid}:{self.n}"
+
+    def call(self, name: str, path: str, body: dict | None = None) -> dict:
+        started = time.perf_counter()
+        try:
+            if body is None:
+                resp = self.client.get(path)
+            else:
+                resp = self.client.post(path, json={**body, "idempotency_key": self._idem()})
+        except Exception as exc:
+            self.rec.add(name, time.perf_counter() - started, 500, type(exc).__name__)
+            self.rec.fail(f"{name} user={self.uid}: {exc}", _busy(exc))
+            return {}
+        data = resp.get_json(silent=True) or {}
+        self.rec.add(name, time.perf_counter() - started, resp.status_code, "" if resp.status_code < 400 else str(data.get("error", resp.status_code)))
+        return data
+
+    def multiplier(self) -> None:
+        self.call("multiplier/play", "/casino/multiplier/play", {"bet_amount": self.rng.choice([100, 250, 1000])})
+
+    def case(self) -> None:
+        self.call("case/open", "/api/casino/case/open", {"case": self.rng.choice(["afet", "kristal"])})
+
+    def blackjack(self) -> None:
+        data = self.call("blackjack/new", "/api/casino/blackjack/new", {"bet": self.rng.choice([100, 500])})
+        state = data.get("state") or {}
+        while data.get("ok") and state.get("phase") == "player_turn":
+            if int(state.get("player_total", 0)) < 17:
+                data = self.call("blackjack/hit", "/api/casino/blackjack/hit", {})
+            else:
+                data = self.call("blackjack/stand", "/api/casino/blackjack/stand", {})
+            state = data.get("state") or {}
+
+    def roulette(self) -> None:
+        self.call("roulette/start", "/api/casino/roulette/start", {})
+        self.call("roulette/place", "/api/casino/roulette/place", {"bet_type": "red", "selection": [], "amount": 100})
+        self.call("roulette/place", "/api/casino/roulette/place", {"bet_type": "straight", "selection": [str(self.rng.randrange(37))], "amount": 50})
+        self.call("roulette/lock", "/api/casino/roulette/lock", {})
+        self.call("roulette/spin", "/api/casino/roulette/spin", {})
+        self.call("roulette/settle", "/api/casino/roulette/settle", {})
+
+    def profile(self) -> None:
+        self.call("profile", "/api/casino/profile")
+
+    def run(self, rounds: int, flows: list[str]) -> None:
+        for _ in range(rounds):
+            order = list(flows)
+            self.rng.shuffle(order)
+            for flow in order:
+                getattr(self, flow)()
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+def make_accounts(count: int) -> list[int]:
+    ids = []
+    for n in range(count):
+        name = f"load{n:05d}"
+        database.createaccount(name, "x")
+        uid = int(database.accountbyname(name)[0])
+        database.applyledger(uid, GRANT, "reward", "load test grant", f"loadtest:{uid}:grant")
+        ids.append(uid)
+    return ids
+
+
+def check_ledger(ids: list[int]) -> list[str]:
+    problems = []
+    with database.connect("casino/player") as db:
+        rows = db.execute(
+            """
+            SELECT w.user_id, w.balance, COALESCE(SUM(l.amount), 0)
+            FROM wallets w LEFT JOIN ledger l ON l.user_id = w.user_id
+            GROUP BY w.user_id
+            """
+        ).fetchall()
+        dupes = db.execute(
+            "SELECT user_id, type, reference_id, COUNT(*) FROM ledger WHERE reference_id IS NOT NULL GROUP BY user_id, type, reference_id HAVING COUNT(*) > 1"
+        ).fetchall()
+    seen = {int(r[0]) for r in rows}
+    for uid, balance, total in rows:
+        if int(balance) != int(total):
+            problems.append(f"user={uid} wallet={balance} ledger={total}")
+        if int(total) < 0:
+            problems.append(f"user={uid} negative ledger balance {total}")
+    for uid in ids:
+        if uid not in seen:
+            problems.append(f"user={uid} has no wallet")
+    for row in dupes:
+        problems.append(f"duplicate ledger reference {row[:3]} x{row[3]}")
+    return problems
+
+
+def run(users: int, rounds: int, flows: list[str], seed: int) -> dict:
+    from core.server import app
+
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+    ids = make_accounts(users)
+    rec = Recorder()
+    players = [Player(app.test_client(), uid, rec, random.Random(seed * 100003 + uid)) for uid in ids]
+    workers = [threading.Thread(target=p.run, args=(rounds, flows)) for p in players]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    total = 0
+    for name in sorted(rec.latency):
+        values = sorted(rec.latency[name])
+        total += len(values)
+        endpoints[name] = {
+            "requests": len(values),
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p95_ms": _percentile(values, 95) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+            "status": {str(k): v for k, v in sorted(rec.status[name].items())},
+        }
+    return {
+        "users": users,
+        "rounds": rounds,
+        "seed": seed,
+        "seconds": elapsed,
+        "requests": total,
+        "requests_per_sec": total / elapsed if elapsed else 0.0,
+        "busy_errors": rec.busy,
+        "error_codes": dict(sorted(rec.errors.items())),
+        "failures": rec.failures[:20],
+        "endpoints": endpoints,
+        "ledger_problems": check_ledger(ids),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the casino endpoints in-process against a temporary database root.")
+    parser.add_argument("--users", type=int, default=20, help="Synthetic accounts, one client thread each")
+    parser.add_argument("--rounds", type=int, default=10, help="Rounds of every flow per user")
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"Comma separated subset of {','.join(FLOWS)}")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the request mix")
+    parser.add_argument("--json", default="", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    flows = [f.strip() for f in args.flows.split(",") if f.strip()]
+    unknown = [f for f in flows if f not in FLOWS]
+    if unknown:
+        parser.error(f"unknown flows: {','.join(unknown)}")
+
+    database.DBROOT = Path(tempfile.mkdtemp(prefix="flux-load-"))
+    database.setup()
+    report = run(args.users, args.rounds, flows, args.seed)
+
+    print(f"users={report['users']} rounds={report['rounds']} requests={report['requests']} {report['seconds']:.2f}s {report['requests_per_sec']:.0f} req/s busy={report['busy_errors']}")
+    for name, row in report["endpoints"].items():
+        codes = " ".join(f"{k}:{v}" for k, v in row["status"].items())
+        print(f"  {name:<18} n={row['requests']:>6} p50={row['p50_ms']:7.2f}ms p95={row['p95_ms']:7.2f}ms p99={row['p99_ms']:7.2f}ms  {codes}")
+    if report["error_codes"]:
+        print("  errors: " + " ".join(f"{k}={v}" for k, v in report["error_codes"].items()))
+    for line in report["failures"]:
+        print(f"  {line}")
+    problems = report["ledger_problems"]
+    print(f"ledger: {len(problems)} problems" if problems else "ledger: ok")
+    for line in problems[:20]:
+        print(f"  {line}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if problems or report["busy_errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core.casino.blackjack import CARD_FACES, SHOE_DECKS, shuffled_shoe  # noqa: E402
+from core.casino.cs2case import CASES, MANAGER as CASES_MANAGER  # noqa: E402
+from core.casino.multiplier import MULTIPLIER_LABELS, draw_picks  # noqa: E402
+from core.casino.rng import replay, seed_hash, verify_seed  # noqa: E402
+from core.casino.roulette import draw_pocket  # noqa: E402
+
+
+def replay_round(game: str, server_seed: str, nonce: int, case_id: str = "afet", decks: int = SHOE_DECKS) -> dict:
+    rng = replay(server_seed, nonce)
+    if game == "multiplier":
+        picks = draw_picks(rng)
+        return {"picks": picks, "labels": [MULTIPLIER_LABELS[i] for i in picks]}
+    if game == "case":
+        case = CASES[case_id]
+        winning, sequence = CASES_MANAGER.draw(case, rng)
+        return {"item_index": winning, "item": case["items"][winning]["id"], "sequence": sequence}
+    if game == "roulette":
+        return {"pocket": draw_pocket(rng)}
+    if game == "blackjack":
+        cards = shuffled_shoe(rng, decks)
+        return {"shoe": [CARD_FACES[c]["code"] for c in cards]}
+    raise ValueError(f"unknown game: {game}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recompute a casino round from a revealed server seed and its nonce.")
+    parser.add_argument("--seed", required=True, help="Revealed server seed (hex)")
+    parser.add_argument("--nonce", type=int, required=True)
+    parser.add_argument("--game", choices=["multiplier", "case", "roulette", "blackjack"], required=True)
+    parser.add_argument("--hash", default="", help="Published seed hash to check the seed against")
+    parser.add_argument("--case", default="afet", choices=sorted(CASES))
+    parser.add_argument("--decks", type=int, default=SHOE_DECKS)
+    args = parser.parse_args()
+
+    if args.hash and not verify_seed(args.seed, args.hash):
+        print(f"seed does not match hash {args.hash}", file=sys.stderr)
+        sys.exit(1)
+    out = {"seed_hash": seed_hash(bytes.fromhex(args.seed)), "nonce": args.nonce}
+    out.update(replay_round(args.game, args.seed, args.nonce, args.case, args.decks))
+    print(json.dumps(out, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
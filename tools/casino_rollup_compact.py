@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core import database  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fold casino rollup hours older than the hourly retention into day buckets.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild all rollups and leaderboards from casino_games first")
+    args = parser.parse_args()
+
+    database.setup()
+    if args.rebuild:
+        with database.connect("casino/player") as db:
+            db.execute("BEGIN IMMEDIATE")
+            database._backfillrollup(db)
+            db.execute("COMMIT")
+        print("rebuilt rollups from casino_games")
+    print(f"folded {database.compactcasinorollup()} hourly rows into days")
+
+
+if __name__ == "__main__":
+    main()
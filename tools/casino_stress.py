@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core import database  # noqa: E402
+from core.casino import state  # noqa: E402
+from core.casino.blackjack import BlackjackManager  # noqa: E402
+from core.casino.cs2case import CaseManager  # noqa: E402
+from core.casino.multiplier import HISTORY_LIMIT, MultiplierManager  # noqa: E402
+from core.casino.roulette import RouletteManager  # noqa: E402
+
+
+def _settle(*_args) -> tuple[bool, str]:
+    return True, ""
+
+
+def play_user(uid: int, rounds: int, managers: dict, errors: list[str]) -> None:
+    roulette = managers["roulette"]
+    blackjack = managers["blackjack"]
+    multiplier = managers["multiplier"]
+    cases = managers["case"]
+    for n in range(rounds):
+        roulette.start_round(uid)
+        ok, _ = roulette.place_bet(uid, "red", [], 10, f"{uid}:{n}:a")
+        ok2, data = roulette.place_bet(uid, "straight", ["17"], 10, f"{uid}:{n}:b")
+        if not (ok and ok2) or data["state"]["total_bet"] != 20:
+            errors.append(f"roulette place user={uid} round={n}")
+        roulette.lock_bets(uid, f"{uid}:{n}:lock")
+        roulette.spin(uid, f"{uid}:{n}:spin")
+        ok, data = roulette.settle(uid)
+        if not ok or data["total_stake"] != 20:
+            errors.append(f"roulette settle user={uid} round={n}")
+
+        ok, st = blackjack.start_round(uid, 100)
+        while ok and st.get("phase") == "player_turn":
+            ok, st = blackjack.hit(uid) if st["player_total"] < 17 else blackjack.stand(uid)
+        if blackjack.get_state(uid)["phase"] != "finished":
+            errors.append(f"blackjack user={uid} round={n}")
+        blackjack.mark_settled(uid)
+
+        ok, _ = multiplier.play(uid, 10, f"{uid}:{n}:m", _settle)
+        if not ok:
+            errors.append(f"multiplier user={uid} round={n}")
+        ok, _ = cases.open_case(uid, "kristal", f"{uid}:{n}:c", _settle)
+        if not ok:
+            errors.append(f"case user={uid} round={n}")
+
+    if len(multiplier.history(uid, HISTORY_LIMIT)) != min(rounds, HISTORY_LIMIT):
+        errors.append(f"multiplier history user={uid}")
+
+
+def run(threads: int, rounds: int, backend_name: str, stripes: int) -> dict:
+    if backend_name == "sqlite":
+        backend = state.SqliteStateBackend(stripes=stripes)
+    else:
+        backend = state.MemoryStateBackend(stripes=stripes)
+    state.use_backend(backend)
+    managers = {
+        "roulette": RouletteManager(),
+        "blackjack": BlackjackManager(),
+        "multiplier": MultiplierManager(),
+        "case": CaseManager(),
+    }
+    errors: list[str] = []
+    workers = [threading.Thread(target=play_user, args=(uid, rounds, managers, errors)) for uid in range(1, threads + 1)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    played = threads * rounds * 4
+    return {"threads": threads, "rounds": played, "seconds": elapsed, "rounds_per_sec": played / elapsed if elapsed else 0.0, "errors": errors}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Play casino rounds for many users in parallel threads and check manager state.")
+    parser.add_argument("--threads", default="1,50,200", help="Comma separated thread counts (one user per thread)")
+    parser.add_argument("--rounds", type=int, default=20, help="Rounds of every game per user")
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--stripes", type=int, default=state.LOCK_STRIPES, help="Lock stripes (1 = one global mutex)")
+    args = parser.parse_args()
+
+    database.DBROOT = Path(tempfile.mkdtemp(prefix="flux-stress-"))
+    database.setup()
+    failed = False
+    for count in [int(x) for x in args.threads.split(",") if x.strip()]:
+        report = run(count, args.rounds, args.backend, args.stripes)
+        print(f"threads={report['threads']:>4} rounds={report['rounds']:>7} {report['seconds']:.2f}s {report['rounds_per_sec']:.0f} rounds/s errors={len(report['errors'])}")
+        for err in report["errors"][:10]:
+            print(f"  {err}")
+        failed = failed or bool(report["errors"])
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core import database  # noqa: E402
+
+
+def _shift_month(month: str, back: int) -> str:
+    year, mon = (int(x) for x in month.split("-"))
+    index = year * 12 + (mon - 1) - int(back)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move closed months of ledger/xp_ledger into monthly archive databases.")
+    parser.add_argument("--keep-months", type=int, default=1, help="Closed months to keep hot besides the current one")
+    parser.add_argument("--table", choices=["ledger", "xp_ledger", "all"], default="all")
+    parser.add_argument("--users-per-tx", type=int, default=200, help="Users moved per write transaction")
+    parser.add_argument("--horizon-days", type=int, default=database.LEDGER_REF_HORIZON_DAYS, help="Keep archived references reserved this long")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the months that would move")
+    args = parser.parse_args()
+
+    database.setup()
+    current = datetime.now(timezone.utc).strftime("%Y-%m")
+    cutoff = _shift_month(current, max(0, args.keep_months))
+    tables = ["ledger", "xp_ledger"] if args.table == "all" else [args.table]
+    for table in tables:
+        while True:
+            month = database.nextledgermonth(table)
+            if not month or month >= cutoff:
+                break
+            if args.dry_run:
+                print(f"{table} {month} would be archived to {database.ledgerarchivename(month)}")
+                break
+            report = database.archiveledgermonth(table, month, args.users_per_tx)
+            print(f"{table} {month}: rows={report['rows']} moved={report['moved']} remaining={report.get('remaining', 0)}")
+            if report.get("remaining"):
+                sys.exit(1)
+        for part in database.ledgerpartitions(table):
+            state = "archived" if part["archived_at"] else "sealed"
+            print(f"  {table} {part['month']} ids {part['first_id']}..{part['last_id']} rows={part['rows']} total={part['total']} {state}")
+    if not args.dry_run:
+        print(f"pruned {database.pruneledgerrefs(args.horizon_days)} archived references older than {args.horizon_days} days")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core import database  # noqa: E402
+
+
+# Each worker walks its user-id range in batches of --batch users. One batch
+# is one short read transaction on a read-only connection: per-user ledger
+# sums come from idx_ledger_user(user_id, id, amount) and the wallets for the
+# same ids are read in the same snapshot, so a batch is self-consistent and
+# writers are only held off for the length of one batch. Users that drift are
+# read again in a fresh snapshot before they are reported.
+
+BATCH_USERS = 2000
+
+
+def _readonly(db_path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30, isolation_level=None)
+    db.execute("PRAGMA query_only = 1")
+    return db
+
+
+def _snapshot(db: sqlite3.Connection, lo: int, hi: int) -> tuple[dict[int, int], dict[int, int], int]:
+    db.execute("BEGIN")
+    try:
+        sums = {int(u): int(t) for u, t in db.execute("SELECT user_id, SUM(amount) FROM ledger WHERE user_id BETWEEN ? AND ? GROUP BY user_id", (lo, hi))}
+        wallets = {int(u): int(b) for u, b in db.execute("SELECT user_id, balance FROM wallets WHERE user_id BETWEEN ? AND ?", (lo, hi))}
+        rows = int(db.execute("SELECT COUNT(*) FROM ledger WHERE user_id BETWEEN ? AND ?", (lo, hi)).fetchone()[0])
+    finally:
+        db.execute("COMMIT")
+    return sums, wallets, rows
+
+
+def _drift(sums: dict[int, int], wallets: dict[int, int]) -> dict[int, tuple[int | None, int]]:
+    out = {}
+    for uid in sums.keys() | wallets.keys():
+        ledger = sums.get(uid, 0)
+        wallet = wallets.get(uid)
+        if wallet is None or wallet != ledger:
+            out[uid] = (wallet, ledger)
+    return out
+
+
+def audit_range(db_path: str, lo: int, hi: int, batch: int) -> dict:
+    users = rows = 0
+    negative = []
+    drifted: dict[int, tuple[int | None, int]] = {}
+    with _readonly(db_path) as db:
+        start = lo
+        while start <= hi:
+            end = min(hi, start + batch - 1)
+            sums, wallets, count = _snapshot(db, start, end)
+            users += len(sums.keys() | wallets.keys())
+            rows += count
+            negative.extend(uid for uid, total in sums.items() if total < 0)
+            for uid in _drift(sums, wallets):
+                again_sums, again_wallets, _ = _snapshot(db, uid, uid)
+                again = _drift(again_sums, again_wallets)
+                if uid in again:
+                    drifted[uid] = again[uid]
+            start = end + 1
+    return {"lo": lo, "hi": hi, "users": users, "rows": rows, "negative": negative, "drifted": drifted}
+
+
+def user_ranges(db_path: str, parts: int) -> list[tuple[int, int]]:
+    with _readonly(db_path) as db:
+        lo, hi = db.execute(
+            "SELECT MIN(u), MAX(u) FROM (SELECT MIN(user_id) AS u FROM ledger UNION ALL SELECT MAX(user_id) FROM ledger UNION ALL SELECT MIN(user_id) FROM wallets UNION ALL SELECT MAX(user_id) FROM wallets)"
+        ).fetchone()
+    if lo is None:
+        return []
+    lo, hi = int(lo), int(hi)
+    step = max(1, (hi - lo + parts) // max(1, parts))
+    return [(a, min(hi, a + step - 1)) for a in range(lo, hi + 1, step)]
+
+
+def repair_sql(drifted: dict[int, tuple[int | None, int]]) -> str:
+    # Each statement only fires if the wallet still holds the balance the
+    # audit saw, so replaying the script after more play is harmless.
+    lines = ["BEGIN IMMEDIATE;"]
+    for uid in sorted(drifted):
+        wallet, ledger = drifted[uid]
+        if wallet is None:
+            lines.append(f"INSERT OR IGNORE INTO wallets (user_id, balance) VALUES ({uid}, {ledger});")
+        else:
+            lines.append(f"UPDATE wallets SET balance = {ledger}, updated_at = CURRENT_TIMESTAMP WHERE user_id = {uid} AND balance = {wallet};")
+    lines.append("COMMIT;")
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare every wallet balance with its ledger sum using read-only snapshots.")
+    parser.add_argument("--db", default="", help="Path to a casino/player database (default: the live one)")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument("--batch", type=int, default=BATCH_USERS, help="User ids per read transaction")
+    parser.add_argument("--repair", default="", help="Write a guarded repair SQL script to this file")
+    parser.add_argument("--limit", type=int, default=50, help="Drifted users to print")
+    args = parser.parse_args()
+
+    db_path = args.db or str(database.path("casino/player"))
+    started = time.perf_counter()
+    ranges = user_ranges(db_path, max(1, args.workers) * 4)
+    results = []
+    if ranges:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = [pool.submit(audit_range, db_path, lo, hi, max(1, args.batch)) for lo, hi in ranges]
+            results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+
+    drifted: dict[int, tuple[int | None, int]] = {}
+    negative: list[int] = []
+    for res in results:
+        drifted.update(res["drifted"])
+        negative.extend(res["negative"])
+    users = sum(r["users"] for r in results)
+    rows = sum(r["rows"] for r in results)
+    print(f"users={users} ledger_rows={rows} ranges={len(ranges)} {elapsed:.2f}s drifted={len(drifted)} negative={len(negative)}")
+    for uid in sorted(drifted)[: args.limit]:
+        wallet, ledger = drifted[uid]
+        shown = "missing" if wallet is None else str(wallet)
+        print(f"  user={uid} wallet={shown} ledger={ledger} diff={ledger - (wallet or 0)}")
+    for uid in sorted(negative)[: args.limit]:
+        print(f"  user={uid} negative ledger balance")
+    if args.repair and drifted:
+        Path(args.repair).write_text(repair_sql(drifted), encoding="utf-8")
+        print(f"repair script: {args.repair}")
+    if drifted or negative:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from core import database  # noqa: E402
+
+
+# Walks DM and channel history upward from the watermark in search_state. Each
+# batch is read in its own short read and indexed in one short write
+# transaction on search.db, so chat writes are never held off for long and an
+# interrupted run resumes where it stopped. Messages that were already indexed
+# live are skipped by the unique (kind, entryid) key.
+
+
+def _dmbatch(after: int, size: int) -> tuple[list[tuple], int]:
+    with database.connect("dm") as db:
+        entries = db.execute(
+            "SELECT id, conversationid, sender, refid, createdat FROM entries WHERE id > ? AND kind = 'text' ORDER BY id LIMIT ?",
+            (after, size),
+        ).fetchall()
+    if not entries:
+        return [], after
+    refs = [e[3] for e in entries]
+    marks = ",".join(["?"] * len(refs))
+    with database.connect("dmtext") as db:
+        bodies = dict(db.execute(f"SELECT id, body FROM items WHERE id IN ({marks})", refs).fetchall())
+    rows = [
+        (database.SEARCH_DM, convid, 0, sender, eid, bodies[ref], createdat)
+        for eid, convid, sender, ref, createdat in entries
+        if bodies.get(ref)
+    ]
+    return rows, int(entries[-1][0])
+
+
+def _channelbatch(after: int, size: int) -> tuple[list[tuple], int]:
+    with database.connect("servers") as db:
+        entries = db.execute(
+            "SELECT id, serverid, channelid, sender, body, createdat FROM entries WHERE id > ? ORDER BY id LIMIT ?",
+            (after, size),
+        ).fetchall()
+    if not entries:
+        return [], after
+    rows = [
+        (database.SEARCH_CHANNEL, sid, cid, sender, eid, body, createdat)
+        for eid, sid, cid, sender, body, createdat in entries
+        if body
+    ]
+    return rows, int(entries[-1][0])
+
+
+def rebuild(kind: str, batch: int, pause: float, restart: bool) -> tuple[int, int]:
+    read = _dmbatch if kind == database.SEARCH_DM else _channelbatch
+    after = 0 if restart else database.searchwatermark(kind)
+    scanned = added = 0
+    while True:
+        rows, last = read(after, batch)
+        if last == after:
+            break
+        added += database.indexmessagebatch(kind, rows, last)
+        scanned += len(rows)
+        after = last
+        if pause:
+            time.sleep(pause)
+    return scanned, added
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Index existing DM and channel messages into the search database in batches.")
+    parser.add_argument("--kind", choices=[database.SEARCH_DM, database.SEARCH_CHANNEL, "all"], default="all")
+    parser.add_argument("--batch", type=int, default=2000, help="Messages per write transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--restart", action="store_true", help="Walk history from the start instead of the watermark")
+    args = parser.parse_args()
+
+    database.setup()
+    kinds = [database.SEARCH_DM, database.SEARCH_CHANNEL] if args.kind == "all" else [args.kind]
+    for kind in kinds:
+        started = time.perf_counter()
+        scanned, added = rebuild(kind, max(1, args.batch), max(0.0, args.pause), args.restart)
+        print(f"{kind}: scanned={scanned} indexed={added} watermark={database.searchwatermark(kind)} {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()